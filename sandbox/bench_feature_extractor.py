@@ -0,0 +1,179 @@
+"""
+Benchmark of the numpy FeatureExtractor against the former list based implementation
+on synthetic MoBy fall windows (50Hz, thresholds of conf/syspad_monitor.conf).
+
+python sandbox/bench_feature_extractor.py
+"""
+import statistics
+import timeit
+
+import numpy as np
+
+from syspad_monitor.model.feature_extractor import FeatureExtractor
+
+LMT, UMT, IT, FS = 0.8, 1.3, 1.4, 50
+
+
+class LegacyFeatureExtractor:
+    # former implementation, one instance per window since it accumulated peaks and valleys
+
+    def __init__(self, lmt, umt, it, fs):
+        self.it, self.umt, self.lmt, self.freq = it, umt, lmt, fs
+        self.peaks, self.valleys, self.acc = [], [], []
+
+    def get_features(self, acc):
+        self.acc = acc
+        self.peaks_indexes()
+        self.valleys_indexes()
+        longest = self.valley(self.valleys)
+        prev = self.valley(self.valleys[-1:])
+        return [self.aamv(), self.impact_duration(), self.acc[self.peaks[-1]],
+                self.impact_peak_duration(), longest[0], longest[1], len(self.peaks) - 1,
+                len(self.valleys), self.std_ati(), self.area(), self.step_index(),
+                prev[0], prev[1]]
+
+    def step_index(self):
+        counter, last_step = 0, -999
+        for ii in range(self.ini_impact() - 10):
+            is_valley = all(self.acc[jj] < 1 for jj in range(ii, ii + 4))
+            is_peak = any(self.acc[jj] >= 1.6 for jj in range(ii + 4, ii + 10))
+            if is_peak and is_valley and ii > last_step + 10:
+                counter += 1
+                last_step = ii
+        return counter
+
+    def std_ati(self):
+        return statistics.stdev(self.acc[self.end_impact():])
+
+    def center(self):
+        center = (self.ini_impact() + self.end_impact()) // 2
+        return center - int(self.freq // 2), center + int(self.freq // 2)
+
+    def area(self):
+        ini_win, end_win = self.center()
+        return sum(self.acc[ii] for ii in range(ini_win, end_win))
+
+    def aamv(self):
+        ini_win, end_win = self.center()
+        return sum(abs(self.acc[ii + 1] - self.acc[ii])
+                   for ii in range(ini_win, end_win + 1)) / self.freq
+
+    def ini_impact(self):
+        peak_index = self.peaks[-1]
+        for ii in range(peak_index - 1, -1, -1):
+            if self.acc[ii] < self.it:
+                return ii + 1
+        return peak_index - 1
+
+    def end_impact(self):
+        peak_index = self.peaks[-1]
+        index = peak_index + 1
+        for ii in range(peak_index + 1, len(self.acc)):
+            if self.acc[ii] < self.lmt or self.acc[ii] > self.umt:
+                index = ii
+        return index
+
+    def impact_duration(self):
+        return (self.end_impact() - self.ini_impact() + 1) / self.freq * 1000.
+
+    def impact_peak_duration(self):
+        end = self.peaks[-1] + 1
+        for jj in range(self.peaks[-1] + 1, len(self.acc)):
+            if self.acc[jj] < self.it:
+                end = jj - 1
+                break
+        return (end - self.ini_impact() + 1) / self.freq * 1000
+
+    def peaks_indexes(self):
+        ii = 1
+        while ii < len(self.acc):
+            max_val, peak_index = -999.9, -1
+            while self.acc[ii] > self.it:
+                if self.acc[ii] > max_val:
+                    max_val, peak_index = self.acc[ii], ii
+                ii = ii + 1
+                if ii == len(self.acc):
+                    break
+            if peak_index >= 0:
+                self.peaks.append(peak_index)
+            ii = ii + 1
+
+    def valleys_indexes(self):
+        ii = self.peaks[-1] - 1
+        while ii >= 0:
+            min_val, valley_index = 999.9, -1
+            while self.acc[ii] < self.lmt:
+                if self.acc[ii] < min_val:
+                    min_val, valley_index = self.acc[ii], ii
+                ii = ii - 1
+                if ii == 0:
+                    break
+            if valley_index >= 0:
+                self.valleys.append(valley_index)
+            ii = ii - 1
+
+    def valley(self, valleys):
+        best = [0.0, -9999]
+        for valley_index in valleys:
+            ini = valley_index - 1
+            for ii in range(valley_index - 1, -1, -1):
+                if self.acc[ii] > self.lmt:
+                    ini = ii + 1
+                    break
+            end = valley_index + 1
+            for jj in range(valley_index + 1, len(self.acc)):
+                if self.acc[jj] > self.lmt:
+                    end = jj - 1
+                    break
+            duration = (end - ini + 1) / self.freq * 1000.
+            if duration > best[1]:
+                best = [self.acc[valley_index], duration]
+        return best
+
+
+def generate_fall(rng, width=300) -> np.ndarray:
+    t = np.arange(width) / FS
+    # marche (1.9Hz) puis chute libre, impact et position allongée
+    acc = 1.0 + 0.7 * np.sin(2 * np.pi * 1.9 * t) + rng.normal(0, 0.05, width)
+    fall = int(rng.randint(150, 220))
+    acc[fall:fall + 15] = rng.uniform(0.2, 0.6, 15)
+    acc[fall + 15:fall + 22] = rng.uniform(2.0, 4.0, 7)
+    acc[fall + 22:] = np.clip(1.0 + rng.normal(0, 0.05, width - fall - 22), 0.85, 1.25)
+    acc[fall + 22 + rng.randint(10, 40)] = 1.35
+    return np.round(acc, 3)
+
+
+def generate_low_start(rng, width=300) -> np.ndarray:
+    # fenêtre commençant sous lmt (seul, puis avec l'échantillon suivant) : cas de l'échantillon 0
+    acc = generate_fall(rng, width)
+    acc[0] = round(rng.uniform(0.2, LMT - 0.05), 3)
+    if rng.rand() < 0.5:
+        acc[1] = round(rng.uniform(LMT + 0.05, 1.2), 3)
+    else:
+        acc[1] = round(rng.uniform(0.2, LMT - 0.05), 3)
+    return acc
+
+
+def check(extractor, windows):
+    batch = extractor.getFeaturesBatch(windows)
+    for window, features in zip(windows, batch):
+        legacy = LegacyFeatureExtractor(LMT, UMT, IT, FS).get_features(window.tolist())
+        np.testing.assert_allclose(features, legacy, rtol=1e-9, atol=1e-9)
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    windows = np.array([generate_fall(rng) for _ in range(500)])
+    extractor = FeatureExtractor(LMT, UMT, IT, FS)
+
+    check(extractor, windows)
+    check(extractor, np.array([generate_low_start(rng) for _ in range(500)]))
+
+    loop = timeit.timeit(lambda: [LegacyFeatureExtractor(LMT, UMT, IT, FS).get_features(w)
+                                  for w in windows.tolist()], number=3) / 3
+    single = timeit.timeit(lambda: [extractor.getFeatures(w) for w in windows], number=3) / 3
+    vect = timeit.timeit(lambda: extractor.getFeaturesBatch(windows), number=3) / 3
+    print(f"{len(windows)} windows of {windows.shape[1]} samples")
+    print(f"loop          : {loop * 1000:8.2f} ms")
+    print(f"numpy, single : {single * 1000:8.2f} ms  (x{loop / single:.0f})")
+    print(f"numpy, batch  : {vect * 1000:8.2f} ms  (x{loop / vect:.0f})")
@@ -0,0 +1,62 @@
+"""
+Benchmark of DataCollector.get_outs_of_bed (numpy) against the former row by row loop
+on synthetic minute series of Withings sleep nights.
+
+python sandbox/bench_outs_of_bed.py
+"""
+import timeit
+
+import arrow
+import numpy as np
+import pandas as pd
+
+from syspad_monitor.task.dataCollector import DataCollector
+
+
+def outs_of_bed_loop(time_series: pd.DataFrame) -> dict:
+    # former implementation, with the last row included to compare the same gaps
+    counts = 0
+    total_secs = 0
+    last_time = time_series.iloc[0]["Time"].item()
+    n_rows = len(time_series.index)
+    my_list = []
+    for ii in range(1, n_rows):
+        current_time = time_series.iloc[ii]["Time"].item()
+        diff_time = current_time - last_time
+        if diff_time > 60:
+            counts += 1
+            total_secs += diff_time
+            my_list.append((str(arrow.get(last_time).format("DD-MM-YYYY HH:mm:ss")), diff_time))
+        last_time = current_time
+    details = dict(my_list)
+    return {'counts': counts, 'total_secs': total_secs, 'details': details}
+
+
+def generate_night(start: int, minutes=600, outs=5, rng=np.random) -> pd.DataFrame:
+    times = start + 60 * np.arange(minutes)
+    # removing some minutes creates the outs of bed
+    for begin in rng.choice(np.arange(10, minutes - 30), outs, replace=False):
+        times[begin:begin + rng.randint(2, 20)] = -1
+    return pd.DataFrame({"Time": times[times >= 0]})
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    nights = [generate_night(1609452000 + 86400 * n, rng=rng) for n in range(30)]
+    for night in nights:
+        assert DataCollector.get_outs_of_bed(night) == outs_of_bed_loop(night)
+
+    all_nights = pd.concat([night.assign(Night=n) for n, night in enumerate(nights)],
+                           ignore_index=True)
+    by_night = DataCollector.get_outs_of_bed(all_nights, by="Night")
+    assert all(by_night[n] == outs_of_bed_loop(night) for n, night in enumerate(nights))
+
+    loop = timeit.timeit(lambda: [outs_of_bed_loop(night) for night in nights], number=3) / 3
+    vect = timeit.timeit(lambda: [DataCollector.get_outs_of_bed(night) for night in nights],
+                         number=3) / 3
+    batch = timeit.timeit(lambda: DataCollector.get_outs_of_bed(all_nights, by="Night"),
+                          number=3) / 3
+    print(f"{len(nights)} nights of {len(nights[0])} minutes")
+    print(f"loop          : {loop * 1000:8.2f} ms")
+    print(f"numpy         : {vect * 1000:8.2f} ms  (x{loop / vect:.0f})")
+    print(f"numpy, by=    : {batch * 1000:8.2f} ms  (x{loop / batch:.0f})")
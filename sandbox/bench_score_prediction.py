@@ -0,0 +1,90 @@
+"""
+Benchmark of the Score trend prediction: former per item np.polyfit against the closed-form
+least-squares (Score.compute_prediction) and the batch over all residents (Score.update_many),
+on 1,000 synthetic residents filled with generate_data()
+(imputation of the missing values included).
+
+python sandbox/bench_score_prediction.py
+"""
+import contextlib
+import copy
+import io
+import time
+import timeit
+
+import numpy as np
+
+from syspad_monitor.model.score import Score
+
+N_RESIDENTS = 1000
+REPEAT = 7
+
+
+def prediction_polyfit(score: Score) -> float:
+    # former implementation, one np.polyfit per item
+    predicted_score = 0
+    for idx, value in score.data["data_current_day"]['values']:
+        d = score.get_value_history_idx(idx)
+        d.append(value)
+        normalized_score = [score.get_normalized_score(idx, v) for v in d]
+        normalized_score_trimmed = [n - 1e-6 if n == 1.0 else n for n in normalized_score]
+        score_atanh = np.arctanh(normalized_score_trimmed)
+        p = np.poly1d(np.polyfit(list(range(len(score_atanh))), score_atanh, 1))
+        predicted_score += np.tanh(p(len(score_atanh))) * score.get_normalized_weight(idx)
+    return predicted_score
+
+
+if __name__ == '__main__':
+    np.random.seed(0)
+    # the imputation prints when an history is empty
+    with contextlib.redirect_stdout(io.StringIO()):
+        residents = [Score() for _ in range(N_RESIDENTS)]
+        for day in range(7):
+            for score in residents:
+                score.update(score.generate_data())
+        tomorrow = [score.generate_data() for score in residents]
+
+    datas = [score.data for score in residents]
+    for score, data in zip(residents, datas):
+        assert abs(score.compute_prediction(data) - prediction_polyfit(score)) < 1e-9
+
+    # best of REPEAT runs: the mean is too sensitive to the load of the machine
+    loop = min(timeit.repeat(lambda: [prediction_polyfit(score) for score in residents],
+                             number=1, repeat=REPEAT))
+    closed = min(timeit.repeat(lambda: [score.compute_prediction(data)
+                                        for score, data in zip(residents, datas)],
+                               number=1, repeat=REPEAT))
+
+    def timed(update, repeat=REPEAT) -> float:
+        # the residents are copied before each run, out of the measure
+        best = float("inf")
+        for _ in range(repeat):
+            scores, values = copy.deepcopy(residents), copy.deepcopy(tomorrow)
+            start = time.perf_counter()
+            update(scores, values)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    # update_many gives the same current day as update, imputed values included
+    with contextlib.redirect_stdout(io.StringIO()):
+        single, batch = copy.deepcopy(residents), copy.deepcopy(residents)
+        for score, value in zip(single, copy.deepcopy(tomorrow)):
+            score.update(value)
+        Score.update_many(batch, copy.deepcopy(tomorrow))
+    for one, many in zip(single, batch):
+        day_one, day_many = one.data["data_current_day"], many.data["data_current_day"]
+        assert day_one['values'] == day_many['values'] and day_one['filled'] == day_many['filled']
+        for key in ('filling_rate', 'score4today', 'trust_index', 'score4tomorrow'):
+            assert np.isclose(day_one[key], day_many[key])
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        updates = timed(lambda scores, values: [score.update(value)
+                                                for score, value in zip(scores, values)])
+        updates_many = timed(Score.update_many)
+    print(f"{N_RESIDENTS} residents, {residents[0].get_number_of_items()} items, "
+          f"{len(residents[0].data['data_prev_days'])} days of history")
+    print(f"prediction, polyfit      : {loop * 1000:8.2f} ms")
+    print(f"prediction, closed-form  : {closed * 1000:8.2f} ms  (x{loop / closed:.0f})")
+    print(f"update per resident      : {updates * 1000:8.2f} ms")
+    print(f"update_many              : {updates_many * 1000:8.2f} ms  "
+          f"(x{updates / updates_many:.1f})")
@@ -12,15 +12,17 @@ from flask import Flask, request, jsonify
 
 from syspad_monitor.model.score import Score
 from syspad_monitor.database_encry import SysPadDb_encry
+from syspad_monitor.http_client import get_client
 from syspad_monitor.model.oauth_api import MyWithingsApi
 from syspad_monitor.task.alarmSender import AlarmSender
-from syspad_monitor.task.bedMonitor import BedMonitor
+from syspad_monitor.task.bedMonitor import BedMonitor, DeadlineScheduler
 from syspad_monitor.task.dataCollector import DataCollector
 from syspad_monitor.task.dataProcessing import DataProcessor
 from syspad_monitor.task.tokensUpdater import TokensUpdater
 from syspad_monitor.task.deviceMonitor import DeviceMonitor
 from syspad_monitor.task.obsTransmitter import ObsTransmitter
 from syspad_monitor.task.scorePredictor import ScorePredictor
+from syspad_monitor.task.scheduler import TaskScheduler
 
 class SysPad(Thread):
 
@@ -42,16 +44,25 @@ class SysPad(Thread):
         self.__apis = MyWithingsApi(bd=self.__db, withings_evt_url=my_params["withings"])
         self.__updater = TokensUpdater(database=self.__db, api=self.__apis)
         self.__collector = DataCollector(bd=self.__db, zmq_port=my_params["ports"]["zmq"])
-        self.__bedmonitor = BedMonitor(bd=self.__db)
-        self.__dataprocessor = DataProcessor(bd=self.__db, minutes_out_of_bounds=int(my_params["minutes_outbounds"]),
-                                             classifier_params=my_params["class_params"])
+        # échéances de sortie de lit : un seul thread, conservées au redémarrage du Bed Monitor
+        self.__bedDeadlines = DeadlineScheduler(
+            on_expire=lambda pat_id: BedMonitor.bed_exit_alarm(self.__db, pat_id),
+            path=my_params["bed_deadlines"], name="BED-DEADLINES")
+        self.__bedmonitor = BedMonitor(bd=self.__db, deadlines=self.__bedDeadlines)
+        self.__dataprocessor = DataProcessor(
+            bd=self.__db,
+            minutes_out_of_bounds=int(my_params["minutes_outbounds"]),
+            classifier_params=my_params["class_params"]
+        )
         self.__devmonitor = DeviceMonitor(bd=self.__db)
         self.__obstransmitter = ObsTransmitter(
             bd=self.__db,
             crm_url=my_params["ehpad_crm"]["url"],
             crm_key=my_params["ehpad_crm"]["key"]
         )
-        self.__predictor = ScorePredictor(bd=self.__db) #, crm_url=my_params["ehpad_crm"]["url"], crm_key=my_params["ehpad_crm"]["key"])
+        #, crm_url=my_params["ehpad_crm"]["url"], crm_key=my_params["ehpad_crm"]["key"])
+        self.__predictor = ScorePredictor(bd=self.__db, snapshot_dir=my_params["score_snapshots"])
+        self.__scheduler = None
 
     def getResNames(self, room:int) -> []:
         return self.__obstransmitter.getResidentName(numCh=room)
@@ -64,18 +75,14 @@ class SysPad(Thread):
         self.__db.erase_old_observables(before_days=7)
         self.__db.erase_old_scores(before_days=7)
 
-        # création et démarrage du process de surveillance de la validité des Tokens pour chaque API
-        # démarrage du processus d'envoi des alarmes vers Mail, SMS, voice_call
+        # les taches périodiques (Tokens, alarmes, trackers, dispositifs, NetSOINS, Scores) sont
+        # des jobs d'un seul ordonnanceur, seules les taches événementielles (ZMQ, sorties de lit)
+        # gardent leur propre thread
         logging.info(f"SYSPAD --> Starting all processes...It will take 20 secs...")
-        self.__updater.start()
-        time.sleep(20)  # mettre 20s apres test
-        self.__aSender.start()
+        self.__scheduler = self.__startScheduler()
         self.__collector.start()
+        self.__bedDeadlines.start()
         self.__bedmonitor.start()
-        self.__dataprocessor.start()
-        self.__devmonitor.start()
-        self.__obstransmitter.start()
-        self.__predictor.start()
 
         time_to_erase = arrow.now().shift(days=1)
 
@@ -83,22 +90,9 @@ class SysPad(Thread):
             logging.info(f"SYSPAD --> WatchDog des processus...")
             all_proc_ok = True
 
-            if not self.__updater.is_alive():
-                logging.error(f"SYSPAD ===> Tokens Updater IS DOWN!!! Starting thread again...")
-                self.__updater = TokensUpdater(database=self.__db, api=self.__apis)
-                self.__updater.start()
-                all_proc_ok = False
-            if not self.__aSender.is_alive():
-                logging.error(f"SYSPAD ===> Alarm Sender IS DOWN!!! Starting thread again...")
-                self.__aSender = AlarmSender(
-                    bd=self.__db,
-                    params_mail=my_params["smtp"],
-                    params_sms=my_params["sms"],
-                    time_out=my_params["alarm"],
-                    serv_url=my_params["ehpad_server"],
-                    firebase=my_params["firebase"]
-                )
-                self.__aSender.start()
+            if not self.__scheduler.is_alive():
+                logging.error(f"SYSPAD ===> Task Scheduler IS DOWN!!! Starting thread again...")
+                self.__scheduler = self.__startScheduler()
                 all_proc_ok = False
             if not self.__collector.is_alive():
                 logging.error(f"SYSPAD ===> Data Collector IS DOWN!!! Starting thread again...")
@@ -107,35 +101,16 @@ class SysPad(Thread):
                 all_proc_ok = False
             if not self.__bedmonitor.is_alive():
                 logging.error(f"SYSPAD ===> Bed Monitor IS DOWN!!! Starting thread again...")
-                self.__bedmonitor = BedMonitor(bd=self.__db)
+                self.__bedmonitor = BedMonitor(bd=self.__db, deadlines=self.__bedDeadlines)
                 self.__bedmonitor.start()
                 all_proc_ok = False
-            if not self.__dataprocessor.is_alive():
-                logging.error(f"SYSPAD ===> Data Processor IS DOWN!!! Starting thread again...")
-                self.__dataprocessor = DataProcessor(bd=self.__db,
-                                                     minutes_out_of_bounds=int(my_params["minutes_outbounds"]))
-                self.__dataprocessor.start()
-                all_proc_ok = False
-            if not self.__devmonitor.is_alive():
-                logging.error(f"SYSPAD ===> Devices Monitor IS DOWN!!! Starting thread again...")
-                self.__devmonitor = DeviceMonitor(bd=self.__db)
-                self.__devmonitor.start()
-                all_proc_ok = False
-            if not self.__predictor.is_alive():
-                logging.error(f"SYSPAD ===> Score Predictor IS DOWN!!! Starting thread again...")
-                self.__predictor = ScorePredictor(bd=self.__db) #, crm_url=my_params["ehpad_crm"]["url"], crm_key=my_params["ehpad_crm"]["key"])
-                self.__predictor.start()
-                all_proc_ok = False
-            if not self.__obstransmitter.is_alive() and my_params["ehpad_crm"]["url"]:
-                logging.error(f"SYSPAD ===> Observable Transmitter IS DOWN!!! Starting thread again...")
-                self.__obstransmitter = ObsTransmitter(
-                    bd=self.__db,
-                    crm_url=my_params["ehpad_crm"]["url"],
-                    crm_key=my_params["ehpad_crm"]["key"]
-                )
-                self.__obstransmitter.start()
-                all_proc_ok = False
 
+            logging.debug(f"SYSPAD --> Pool BD: {self.__db.pool_stats}")
+            logging.debug(f"SYSPAD --> Alarmes: {self.__db.alarm_stats}")
+            logging.debug(f"SYSPAD --> Data Collector: {self.__collector.stats}")
+            logging.debug(f"SYSPAD --> Alarm Sender: {self.__aSender.stats}")
+            logging.debug(f"SYSPAD --> HTTP: {get_client().stats}")
+            logging.debug(f"SYSPAD --> Jobs: {self.__scheduler.stats}")
             if all_proc_ok:
                 logging.info(f"SYSPAD --> All processes are running OK!")
             else:
@@ -153,6 +128,36 @@ class SysPad(Thread):
 
             time.sleep(self.REFRESH_TIME)
 
+    def __startScheduler(self) -> TaskScheduler:
+        """ Déclare les jobs périodiques dans un nouvel ordonnanceur et le démarre """
+        scheduler = TaskScheduler()
+        scheduler.add_interval("tokens", self.__updater.refresh_tokens, TokensUpdater.REFRESH_TIME)
+        # 20s pour laisser les Tokens se mettre à jour avant les autres taches
+        # les alarmes ont leur propre thread pour ne pas attendre derrière les jobs longs
+        scheduler.add_interval("alarms", self.__aSender.poll, AlarmSender.REFRESH_TIME,
+                               first_delay=20, dedicated=True)
+        scheduler.add_interval("trackers", self.__dataprocessor.process_trackers,
+                               DataProcessor.REFRESH_TIME, first_delay=20)
+        scheduler.add_interval("devices", self.__devmonitor.check_devices,
+                               DeviceMonitor.REFRESH_TIME, jitter=60, first_delay=20)
+        if self.__obstransmitter.enabled:
+            scheduler.add_interval("observables", self.__obstransmitter.transmit_observables,
+                                   ObsTransmitter.REFRESH_TIME, first_delay=20)
+            # les nuits sont transmises à 12h pour attendre toutes les données de la nuit
+            # (une échéance du jour manquée au démarrage est rattrapée, voir last_run)
+            scheduler.add_cron("nights", self.__obstransmitter.transmit_nights, "0 12 * * *",
+                               last_run=lambda: self.__obstransmitter.nights_date)
+            scheduler.add_cron("crm-references", self.__obstransmitter.refresh_references,
+                               "50 23 * * *")
+            scheduler.add_cron("days", self.__obstransmitter.transmit_days, "55 23 * * *",
+                               last_run=lambda: self.__obstransmitter.days_date)
+        scheduler.add_cron("imputation", self.__predictor.impute, "0 23 * * *",
+                           last_run=lambda: self.__predictor.imputation_date)
+        scheduler.add_cron("scores", self.__predictor.compute_scores, "30 23 * * *",
+                           last_run=lambda: self.__predictor.score_date)
+        scheduler.start()
+        return scheduler
+
 
 def load_config() -> dict:
     config = configparser.ConfigParser()
@@ -167,7 +172,9 @@ def load_config() -> dict:
                              "lmt": float(config.get("THRESHOLDS", 'lmt')),
                              "umt": float(config.get("THRESHOLDS", 'umt')),
                              "it": float(config.get("THRESHOLDS", 'it')),
-                             "fs": float(config.get("THRESHOLDS", 'fs'))}
+                             "fs": float(config.get("THRESHOLDS", 'fs')),
+                             "threshold": config.getfloat("CLASSIFIER", 'threshold', fallback=0.5),
+                             "fall_label": config.getint("CLASSIFIER", 'fall_label', fallback=1)}
         smtp_params = {
             "host": config.get("MAIL", "host"),
             "port": config.get("MAIL", "port"),
@@ -181,6 +188,8 @@ def load_config() -> dict:
             "user": config.get("DATABASE", "user"),
             "pwd": config.get("DATABASE", "pass"),
             "name": config.get("DATABASE", "dbname"),
+            "pool_min": config.getint("DATABASE", "pool_min", fallback=2),
+            "pool_max": config.getint("DATABASE", "pool_max", fallback=10),
         }
         sms_params = {
             "user": config.get("SMS", "user"),
@@ -211,6 +220,8 @@ def load_config() -> dict:
             "ehpad_crm": crm_info,
             "firebase": firebase,
             "class_params": classifier_params,
+            "score_snapshots": config.get("SCORE", "snapshots", fallback="scores"),
+            "bed_deadlines": config.get("BED", "deadlines", fallback="bed_deadlines.json"),
         }
         return my_params_dict
 
@@ -228,6 +239,8 @@ logging.getLogger("SYSPAD_M").addHandler(logging.StreamHandler())
 db = SysPadDb_encry(params=my_params["database"], alarm_times=int(my_params["atimes"]))
 # Établir la connexion à la base de données
 db.connect()
+# chargement de l'index capteurs/patients partagé par les taches
+db.refresh_index()
 
 # L'instance au système
 syspad = SysPad()
@@ -358,6 +371,8 @@ def withings_evt():
             logging.debug(request.headers)
             request_data = request.form.to_dict(flat=True)
             logging.debug(f"form : {request_data}")
+            # horodatage de réception pour mesurer la latence jusqu'au DataCollector
+            request_data["recv_ts"] = time.time()
             zmq_message = f"wgs_notify_receiver {json.dumps(request_data)}"
             logging.debug(f"Message envoyé vers ZMQ: {zmq_message}")
             zmq_socket.send_string(zmq_message)
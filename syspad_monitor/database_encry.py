@@ -4,11 +4,14 @@ Classe pour gérer la base de données de SysPAD
 :author: all
 """
 
+import functools
 import json
 import logging
+import queue
 import threading
 import time
 import datetime as dt
+from contextlib import contextmanager
 from datetime import datetime, timedelta, date
 import arrow
 from typing import Union
@@ -16,21 +19,90 @@ from typing import Union
 import psycopg2
 import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
 
 from syspad_monitor.task import PatientConst, AlarmConst
 
 
+def _pooled(method):
+    """ Décorateur: emprunte une connexion du pool pour la durée de l'appel
+        (les appels imbriqués dans le même thread réutilisent la même connexion)
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.checkout():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class _NoConnection:
+    """ Connexion prêtée quand le pool ne peut pas en fournir une : cursor() lève OperationalError,
+        la méthode appelante suit son chemin d'erreur habituel (pas de rollback possible)
+        et renvoie sa valeur d'échec
+    """
+    def cursor(self, *args, **kwargs):
+        raise psycopg2.OperationalError("BASE DONNEES --> aucune connexion disponible")
+
+
 class SysPadDb_encry:
     """ Classe pour gérer la base de donnée Mobaspace """
+    # au-delà de ce temps d'attente (en secondes) pour obtenir une connexion, on trace un warning
+    POOL_WAIT_WARNING = 1.0
+    # fenêtre (en secondes) de regroupement des lectures Smart-Tracker avant écriture
+    TRACKER_FLUSH_WINDOW = 2.0
+    # durée de validité (en secondes) de l'index capteurs/patients
+    INDEX_TTL = 300
+    # une clé inconnue provoque un rechargement si l'index a plus de INDEX_MISS_AGE secondes
+    INDEX_MISS_AGE = 30
+    # les correspondances sont modifiées par l'application web : toutes les INDEX_CHECK secondes
+    # une signature (md5) des colonnes indexées est comparée à celle du chargement
+    INDEX_CHECK = 15
+    # fenêtre (en secondes) de regroupement des alarmes identiques (patient, capteur,
+    # description) : une seule ligne par fenêtre, les répétitions sont comptées dans la table
+    # RepetitionsAlarmes
+    ALARM_COALESCE_WINDOW = 300
+    # une répétition attend la fin de la première insertion du groupe : au-delà de
+    # ALARM_READY_WAIT secondes un warning est tracé et l'attente continue
+    # (une nouvelle insertion créerait un doublon)
+    ALARM_READY_WAIT = 10
+
     def __init__(self, params: dict, alarm_times: int):
         """ Initialize the database instance
 
-            :param params: the database connection parameters
+            :param params: the database connection parameters, "pool_min" and "pool_max"
+             give the bounds of the connection pool
             :type params: dict
         """
-        self.__cnx = None
+        self.__pool = None
         self.__params = params
         self.__connected = False
+        self.__pool_min = int(params.get("pool_min", 2))
+        self.__pool_max = max(int(params.get("pool_max", 10)), self.__pool_min)
+        # le pool psycopg2 lève une exception quand il est vide, le sémaphore permet d'attendre
+        self.__slots = threading.BoundedSemaphore(self.__pool_max)
+        self.__local = threading.local()
+        self.__stats_lock = threading.Lock()
+        self.__stats = {"checkouts": 0, "waits": 0, "wait_total": 0.0, "wait_max": 0.0,
+                        "in_use": 0}
+        # patients ayant reçu un BED_IN/BED_OUT, consommés par le BedMonitor
+        self.__bed_events = queue.Queue()
+        # lectures Smart-Tracker en attente d'écriture, par adresse MAC
+        self.__tracker_buffer = dict()
+        self.__tracker_lock = threading.Lock()
+        # index en mémoire MAC/userid -> capteur -> patient -> chambre (voir refresh_index)
+        self.__index = {"wgs_user": dict(), "mac": dict(), "capteur": dict(),
+                        "sensor_for_pat": dict(), "sensors_of_pat": dict(), "patient": dict(),
+                        "contact": dict()}
+        self.__index_date = None
+        self.__index_checked = None
+        self.__index_signature = None
+        self.__index_lock = threading.Lock()
+        # un seul rechargement/vérification de l'index à la fois
+        self.__refresh_lock = threading.Lock()
+        # alarmes insérées dans la fenêtre de regroupement, par (patient, capteur, description)
+        self.__recent_alarms = dict()
+        self.__alarms_lock = threading.Lock()
+        self.__alarm_stats = {"inserted": 0, "coalesced": 0, "escalated": 0}
         # heart beat thread
         self.__thread = threading.Thread(target=self.__heart_beat, args=())
         self.__thread.daemon = True
@@ -41,13 +113,20 @@ class SysPadDb_encry:
         """
         logging.info(
             f"BASE DONNEES --> connecting to {self.__params['name']} on {self.__params['host']} "
+            f"(pool {self.__pool_min}-{self.__pool_max})"
         )
         try:
-            self.__cnx = psycopg2.connect(
+            old_pool = self.__pool
+            self.__pool = psycopg2.pool.ThreadedConnectionPool(
+                self.__pool_min,
+                self.__pool_max,
                 "host={host} port={port} user={user} password={pwd} dbname={name} \
                  application_name=syspad".format(**self.__params)
             )
             self.__connected = True
+            if old_pool is not None:
+                # les connexions encore empruntées seront fermées à leur restitution
+                old_pool.closeall()
         except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
             try:
                 logging.error(error.pgerror)
@@ -59,11 +138,278 @@ class SysPadDb_encry:
         """
         logging.info("BASE DONNEES --> disconnecting")
         if self.__connected:
-            self.__cnx.close()
+            self.__pool.closeall()
             self.__connected = False
             logging.info("Database, disconnected")
 
+    @contextmanager
+    def checkout(self):
+        """ Emprunte une connexion du pool pour le thread courant et la restitue à la sortie
+
+            :return: la connexion, une connexion factice (_NoConnection)
+             si la base n'est pas joignable
+        """
+        local = self.__local
+        if getattr(local, "cnx", None) is not None:
+            # appel imbriqué (ex. set_observable -> get_patId_from_room), même connexion
+            local.depth += 1
+            try:
+                yield local.cnx
+            finally:
+                local.depth -= 1
+            return
+
+        if not self.__connected:
+            self.connect()
+        pool = self.__pool
+        if not self.__connected or pool is None:
+            local.cnx, local.depth = _NoConnection(), 0
+            try:
+                yield local.cnx
+            finally:
+                local.cnx = None
+            return
+
+        start = time.monotonic()
+        self.__slots.acquire()
+        waited = time.monotonic() - start
+        cnx = None
+        try:
+            try:
+                cnx = pool.getconn()
+            except (psycopg2.DatabaseError, psycopg2.InterfaceError,
+                    psycopg2.pool.PoolError) as error:
+                logging.error(f"BASE DONNEES --> impossible d'obtenir une connexion du pool: "
+                              f"{error}")
+            self.__record_checkout(waited)
+            local.cnx, local.depth = (cnx if cnx is not None else _NoConnection()), 0
+            yield local.cnx
+        finally:
+            local.cnx = None
+            if cnx is not None:
+                try:
+                    # une connexion cassée (serveur redémarré...) est jetée,
+                    # le pool en recréera une
+                    pool.putconn(cnx, close=bool(cnx.closed))
+                except psycopg2.pool.PoolError:
+                    # le pool a été recréé entre temps (reconnexion du heart beat)
+                    cnx.close()
+            with self.__stats_lock:
+                self.__stats["in_use"] -= 1
+            self.__slots.release()
+
+    def __record_checkout(self, waited: float):
+        with self.__stats_lock:
+            stats = self.__stats
+            stats["checkouts"] += 1
+            stats["in_use"] += 1
+            if waited > 0.001:
+                stats["waits"] += 1
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+        if waited > self.POOL_WAIT_WARNING:
+            logging.warning(f"BASE DONNEES --> attente de {waited:.2f}s "
+                            f"pour obtenir une connexion du pool")
+
+    @property
+    def pool_stats(self) -> dict:
+        """ Métriques du pool de connexions
+
+            :return: nombre d'emprunts, nombre d'attentes, temps d'attente total/moyen/max (s),
+             connexions en cours d'utilisation et bornes du pool
+            :rtype: dict
+        """
+        with self.__stats_lock:
+            stats = dict(self.__stats)
+        stats["wait_avg"] = stats["wait_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        stats["min"] = self.__pool_min
+        stats["max"] = self.__pool_max
+        return stats
+
+    @property
+    def __cnx(self):
+        """ La connexion empruntée par le thread courant (voir checkout) """
+        return getattr(self.__local, "cnx", None)
+
+    def refresh_index(self):
+        """ (Re)charge l'index en mémoire des correspondances capteur/API/patient/chambre
+
+            adresse MAC -> CapteurId, Withings userid -> PatientId, CapteurId -> PatientId,
+            PatientId -> chambre, PatientId -> contact d'alarme. Il est rechargé automatiquement
+            après INDEX_TTL secondes, ou dès que la signature des correspondances en base change.
+        """
+        with self.__index_lock:
+            seen = self.__index_date
+        self.__refresh(seen)
+
+    def invalidate_index(self):
+        """ Force le rechargement de l'index à la prochaine consultation """
+        with self.__index_lock:
+            self.__index_date = None
+
+    def __refresh(self, seen):
+        """ Recharge l'index, sauf s'il l'a été depuis la date seen : les threads qui le trouvent
+            périmé en même temps attendent le rechargement en cours au lieu d'en lancer un chacun
+        """
+        with self.__refresh_lock:
+            with self.__index_lock:
+                if self.__index_date is not None and self.__index_date != seen:
+                    return
+            loaded = self.__load_index()
+            if loaded is not None:
+                now = time.monotonic()
+                with self.__index_lock:
+                    self.__index, self.__index_signature = loaded
+                    self.__index_date = self.__index_checked = now
+
+    def __check_index(self, seen):
+        """ Recharge l'index si la signature des correspondances en base a changé """
+        # un seul thread vérifie, les autres consultent l'index courant
+        if not self.__refresh_lock.acquire(blocking=False):
+            return
+        try:
+            with self.__index_lock:
+                if self.__index_date != seen:
+                    return
+            signature = self.__load_index_signature()
+            with self.__index_lock:
+                # même en cas d'échec, pour ne pas interroger la base à chaque consultation
+                self.__index_checked = time.monotonic()
+                changed = signature is not None and signature != self.__index_signature
+        finally:
+            self.__refresh_lock.release()
+        if changed:
+            logging.info("BASE DONNEES --> correspondances capteurs/patients/contacts modifiées, "
+                         "rechargement de l'index")
+            self.__refresh(seen)
+
+    def __lookup(self, section: str, key, default=None):
+        """ Consulte l'index, rechargé si périmé,
+            ou sur une clé inconnue s'il a plus de INDEX_MISS_AGE s
+        """
+        with self.__index_lock:
+            date_index, date_check = self.__index_date, self.__index_checked
+        now = time.monotonic()
+        age = None if date_index is None else now - date_index
+        if age is None or age > self.INDEX_TTL:
+            self.__refresh(date_index)
+        elif key not in self.__index[section] and age > self.INDEX_MISS_AGE:
+            # capteur/patient ajouté depuis le dernier chargement?
+            self.__refresh(date_index)
+        elif now - date_check > self.INDEX_CHECK:
+            self.__check_index(date_index)
+        return self.__index[section].get(key, default)
+
+    # requêtes de l'index : OAuth2Apis, capteurs, patients, contacts
+    __INDEX_SELECTS = (
+        'SELECT "Id", "ApiUserId", "PatientId", "Provider" FROM mobaspace_data."OAuth2Apis"',
+        """
+            SELECT mobaspace_data."Capteurs"."Id", "Identifiant", "ApiId"
+            FROM mobaspace_data."Capteurs"
+            LEFT JOIN mobaspace_data."ApisCapteurs"
+             ON (mobaspace_data."Capteurs"."Id" = "CapteurId")
+        """,
+        'SELECT "Id", "NumCh", "Chambre" FROM mobaspace_data."patientsview"',
+        """
+            SELECT "PatientId", "Appel", "CanalNotif"
+            FROM mobaspace_data."ContactsPatients"
+            INNER JOIN mobaspace_data."AspNetUsers"
+             ON (mobaspace_data."ContactsPatients"."UtilisateurId"
+                 = mobaspace_data."AspNetUsers"."Id")
+        """,
+    )
+    # signature de toutes les lignes de l'index calculée par la base
+    # (seuls 32 caractères sont transférés)
+    __INDEX_SIGNATURE = "SELECT md5(concat_ws('|', {}))".format(", ".join(
+        f"(SELECT string_agg(t::text, ';' ORDER BY t::text) FROM ({select}) t)"
+        for select in __INDEX_SELECTS
+    ))
+
+    @_pooled
+    def __load_index_signature(self) -> Union[str, None]:
+        cur = None
+        signature = None
+        try:
+            cur = self.__cnx.cursor()
+            cur.execute(self.__INDEX_SIGNATURE)
+            signature = cur.fetchone()[0]
+            self.__cnx.commit()
+        except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
+            try:
+                self.__cnx.rollback()
+                logging.error(error.pgerror)
+            except AttributeError:
+                logging.error(error)
+        finally:
+            if isinstance(cur, psycopg2.extensions.cursor):
+                cur.close()
+        return signature
+
+    @_pooled
+    def __load_index(self) -> Union[tuple, None]:
+        """ :return: (index, signature) ou None en cas d'erreur """
+        apis_select, capteurs_select, patients_select, contacts_select = self.__INDEX_SELECTS
+        logging.debug("BASE DONNEES --> chargement de l'index capteurs/patients")
+        cur = None
+        index = None
+        signature = None
+        try:
+            cur = self.__cnx.cursor()
+            cur.execute(apis_select)
+            apis = cur.fetchall()
+            cur.execute(capteurs_select)
+            capteurs = cur.fetchall()
+            cur.execute(patients_select)
+            patients = cur.fetchall()
+            cur.execute(contacts_select)
+            contacts = cur.fetchall()
+            cur.execute(self.__INDEX_SIGNATURE)
+            signature = cur.fetchone()[0]
+            self.__cnx.commit()
+
+            index = {"wgs_user": dict(), "mac": dict(), "capteur": dict(),
+                     "sensor_for_pat": dict(), "sensors_of_pat": dict(), "patient": dict(),
+                     "contact": dict()}
+            apis_by_id = dict()
+            for api_id, user_id, pat_id, provider in apis:
+                apis_by_id[api_id] = (pat_id, provider)
+                if user_id is not None:
+                    index["wgs_user"].setdefault(str(user_id), []).append(pat_id)
+            for capteur_id, mac, api_id in capteurs:
+                capteur = index["capteur"].setdefault(capteur_id,
+                                                      {"mac": mac, "apis": [], "patients": []})
+                index["mac"][mac] = capteur_id
+                if api_id not in apis_by_id:
+                    continue
+                pat_id, provider = apis_by_id[api_id]
+                capteur["apis"].append(api_id)
+                capteur["patients"].append(pat_id)
+                if pat_id is not None:
+                    index["sensor_for_pat"].setdefault((pat_id, provider), capteur_id)
+                    index["sensors_of_pat"].setdefault(pat_id, []).append(capteur_id)
+            for pat_id, num_ch, chambre in patients:
+                index["patient"][pat_id] = {"NumCh": num_ch, "Chambre": chambre}
+                # un patient sans contact est aussi indexé (pas de rechargement à chaque alarme)
+                index["contact"][pat_id] = {"Appel": None, "CanalNotif": None}
+            # seul le premier contact du patient est notifié
+            notified = set()
+            for pat_id, phone, channel in contacts:
+                if pat_id in index["contact"] and pat_id not in notified:
+                    notified.add(pat_id)
+                    index["contact"][pat_id] = {"Appel": phone, "CanalNotif": channel}
+        except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
+            index = None
+            try:
+                self.__cnx.rollback()
+                logging.error(error.pgerror)
+            except AttributeError:
+                logging.error(error)
+        finally:
+            if isinstance(cur, psycopg2.extensions.cursor):
+                cur.close()
+        return None if index is None else (index, signature)
 
+    @_pooled
     def set_alarm_counter(self, alarm_id: int, counter_val: int):
         if not self.__connected:
             self.connect()
@@ -85,30 +431,45 @@ class SysPadDb_encry:
                 cur.close()
         return
 
-    def read_alarms(self) -> Union[list, psycopg2.extras.DictCursor]:
+    @_pooled
+    def read_alarms_since(self, last_id: int,
+                          overlap: int) -> Union[list, psycopg2.extras.DictCursor]:
+        """ Alarmes restant à notifier créées depuis la dernière lecture, sans jointure
+
+            :param last_id: plus grand Id déjà lu (0 pour tout relire)
+            :param overlap: les alarmes créées dans les overlap dernières secondes sont relues
+             (un Id plus petit peut être validé après un Id plus grand), ainsi que celles dont
+             le tour courant n'est pas dans la table des envois (priorité relevée par un
+             regroupement) : un regroupement n'est possible que pendant ALARM_COALESCE_WINDOW,
+             la recherche est limitée aux alarmes créées dans cette fenêtre (plus overlap),
+             les autres sont vues à la relecture complète (last_id=0)
+            :return: liste des alarmes triées par Id,
+             la chambre et le contact sont donnés par get_alarm_contact
+        """
         if not self.__connected:
             self.connect()
         select = """
-            SELECT "alarmesview"."Id" AS "Id", "NbNotifications", "Chambre", "NumCh", "Description",
-             "alarmesview"."Creation", "alarmesview"."Priorite", "Appel", "CanalNotif"
-            FROM mobaspace_data."alarmesview" 
-            INNER JOIN mobaspace_data."patientsview" ON
-             (mobaspace_data."alarmesview"."PatientId" = mobaspace_data."patientsview"."Id")
-            LEFT JOIN mobaspace_data."ContactsPatients" ON
-             (mobaspace_data."patientsview"."Id" = mobaspace_data."ContactsPatients"."PatientId")
-            LEFT JOIN mobaspace_data."AspNetUsers"
-             ON (mobaspace_data."ContactsPatients"."UtilisateurId" = mobaspace_data."AspNetUsers"."Id")
-            WHERE "NbNotifications" > 0;
-        """
-        logging.debug(f"BASE DONNEES --> récupération des alarmes restant à traiter")
+            SELECT "Id", "PatientId", "NbNotifications", "Description", "Creation", "Priorite"
+            FROM mobaspace_data."alarmesview"
+            WHERE "NbNotifications" > 0
+             AND ("Id" > %(last_id)s
+                  OR "Creation" > LOCALTIMESTAMP - %(overlap)s * INTERVAL '1 second'
+                  OR ("Creation" > LOCALTIMESTAMP - %(recent)s * INTERVAL '1 second'
+                      AND NOT EXISTS (SELECT 1 FROM mobaspace_data."EnvoisAlarmes" AS env
+                                      WHERE env."AlarmeId" = "alarmesview"."Id"
+                                       AND env."Tour" = "NbNotifications")))
+            ORDER BY "Id"
+        """
+        params = {"last_id": last_id, "overlap": overlap,
+                  "recent": self.ALARM_COALESCE_WINDOW + overlap}
         cur = None
-        result = dict()
+        result = []
         try:
             cur = self.__cnx.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute(select)
+            cur.execute(select, params)
             result = cur.fetchall()
             self.__cnx.commit()
-        except psycopg2.DatabaseError as error:
+        except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
             try:
                 self.__cnx.rollback()
                 logging.error(error.pgerror)
@@ -117,8 +478,270 @@ class SysPadDb_encry:
         finally:
             if isinstance(cur, psycopg2.extensions.cursor):
                 cur.close()
-            return result
+        return result
+
+    @_pooled
+    def create_alarm_outbox(self) -> bool:
+        """ Crée si besoin la table des envois d'alarmes (outbox)
+            et celle des répétitions regroupées
+
+            Une ligne d'envoi par alarme, tour de notification (valeur de NbNotifications)
+            et canal, identifiée par une clé d'idempotence (Cle)
+            :return: True si les tables sont disponibles
+        """
+        if not self.__connected:
+            self.connect()
+        create = """
+            CREATE TABLE IF NOT EXISTS mobaspace_data."EnvoisAlarmes" (
+             "Id" SERIAL PRIMARY KEY,
+             "Cle" TEXT NOT NULL UNIQUE,
+             "AlarmeId" INTEGER NOT NULL,
+             "Tour" INTEGER NOT NULL,
+             "Canal" TEXT NOT NULL,
+             "Priorite" INTEGER NOT NULL,
+             "Contenu" JSONB NOT NULL,
+             "Statut" TEXT NOT NULL DEFAULT 'attente',
+             "Tentatives" INTEGER NOT NULL DEFAULT 0,
+             "ProchainEssai" TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+             "Creation" TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+             "CreationAlarme" TIMESTAMP,
+             "Premier" BOOLEAN NOT NULL DEFAULT FALSE,
+             "Envoi" TIMESTAMP,
+             "Erreur" TEXT
+            );
+            CREATE INDEX IF NOT EXISTS "EnvoisAlarmes_dus"
+             ON mobaspace_data."EnvoisAlarmes" ("Canal", "ProchainEssai")
+             WHERE "Statut" = 'attente';
+            CREATE INDEX IF NOT EXISTS "EnvoisAlarmes_alarme"
+             ON mobaspace_data."EnvoisAlarmes" ("AlarmeId", "Tour");
+            CREATE TABLE IF NOT EXISTS mobaspace_data."RepetitionsAlarmes" (
+             "AlarmeId" INTEGER PRIMARY KEY,
+             "Occurrences" INTEGER NOT NULL,
+             "Derniere" TIMESTAMP NOT NULL
+            );
+        """
+        logging.debug(f"BASE DONNEES --> création de la table des envois d'alarmes")
+        cur = None
+        result = False
+        try:
+            cur = self.__cnx.cursor()
+            cur.execute(create)
+            self.__cnx.commit()
+            result = True
+        except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
+            try:
+                self.__cnx.rollback()
+                logging.error(error.pgerror)
+            except AttributeError:
+                logging.error(error)
+        finally:
+            if isinstance(cur, psycopg2.extensions.cursor):
+                cur.close()
+        return result
+
+    @_pooled
+    def enqueue_alarm_deliveries(self, deliveries: [], resend_delay: int) -> bool:
+        """ Ajoute les envois du tour courant des alarmes,
+            sans doublon si plusieurs émetteurs tournent
 
+            :param deliveries: liste de dict {"key" (clé d'idempotence), "alarm_id", "round",
+             "channel", "priority", "creation", "payload"}
+            :param resend_delay: délai (s) entre deux tours de notification d'une même alarme
+            :return: True si l'insertion est faite
+        """
+        if not self.__connected:
+            self.connect()
+        # le tour suivant est programmé resend_delay secondes après le dernier envoi réussi du tour
+        # précédent (NbNotifications décroît, le tour précédent a le numéro suivant)
+        insert = """
+            INSERT INTO mobaspace_data."EnvoisAlarmes"
+             ("Cle", "AlarmeId", "Tour", "Canal", "Priorite", "Contenu", "CreationAlarme",
+              "Premier", "ProchainEssai")
+            SELECT %(key)s, %(alarm_id)s, %(round)s, %(channel)s, %(priority)s, %(payload)s,
+             %(creation)s, previous."Envoi" IS NULL,
+             GREATEST(LOCALTIMESTAMP,
+                      COALESCE(previous."Envoi" + %(delay)s * INTERVAL '1 second', LOCALTIMESTAMP))
+            FROM (SELECT max("Envoi") AS "Envoi" FROM mobaspace_data."EnvoisAlarmes"
+                  WHERE "AlarmeId" = %(alarm_id)s AND "Tour" = %(round)s + 1) AS previous
+            ON CONFLICT ("Cle") DO NOTHING
+        """
+        cur = None
+        result = False
+        try:
+            cur = self.__cnx.cursor()
+            psycopg2.extras.execute_batch(cur, insert, [
+                dict(delivery,
+                     payload=json.dumps(delivery["payload"]),
+                     delay=resend_delay)
+                for delivery in deliveries
+            ])
+            self.__cnx.commit()
+            result = True
+        except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
+            try:
+                self.__cnx.rollback()
+                logging.error(error.pgerror)
+            except AttributeError:
+                logging.error(error)
+        finally:
+            if isinstance(cur, psycopg2.extensions.cursor):
+                cur.close()
+        return result
+
+    @_pooled
+    def advance_alarm_rounds(self, resend_delay: int) -> Union[list, psycopg2.extras.DictCursor]:
+        """ Décrémente NbNotifications des alarmes dont au moins un envoi du tour courant a réussi
+
+            Les envois encore en attente d'un tour consommé sont remplacés par ceux du tour suivant
+            ("echec"), ceux du dernier tour continuent leurs essais. Un tour dont tous les envois
+            ont été abandonnés n'est pas consommé : ses envois sont remis en attente resend_delay
+            secondes plus tard, jusqu'à ce qu'un canal réussisse.
+            :param resend_delay: délai (s) avant de retenter un tour entièrement en échec
+            :return: les alarmes passées au tour suivant (mêmes colonnes que read_alarms_since)
+        """
+        if not self.__connected:
+            self.connect()
+        update = """
+            UPDATE mobaspace_data."alarmesview" AS alarm
+            SET "NbNotifications" = alarm."NbNotifications" - 1
+            WHERE alarm."NbNotifications" > 0
+             AND EXISTS (SELECT 1 FROM mobaspace_data."EnvoisAlarmes" AS env
+                         WHERE env."AlarmeId" = alarm."Id" AND env."Tour" = alarm."NbNotifications"
+                          AND env."Statut" = 'envoye')
+            RETURNING "Id", "PatientId", "NbNotifications", "Description", "Creation", "Priorite"
+        """
+        supersede = """
+            UPDATE mobaspace_data."EnvoisAlarmes"
+            SET "Statut" = 'echec', "Erreur" = 'remplacé par le tour suivant'
+            WHERE "Statut" = 'attente' AND ("AlarmeId", "Tour") IN %s
+        """
+        rearm = """
+            UPDATE mobaspace_data."EnvoisAlarmes" AS env
+            SET "Statut" = 'attente', "Tentatives" = 0,
+             "ProchainEssai" = LOCALTIMESTAMP + %s * INTERVAL '1 second'
+            FROM mobaspace_data."alarmesview" AS alarm
+            WHERE env."AlarmeId" = alarm."Id" AND env."Tour" = alarm."NbNotifications"
+             AND alarm."NbNotifications" > 0 AND env."Statut" = 'echec'
+             AND NOT EXISTS (SELECT 1 FROM mobaspace_data."EnvoisAlarmes" AS other
+                             WHERE other."AlarmeId" = env."AlarmeId" AND other."Tour" = env."Tour"
+                              AND other."Statut" <> 'echec')
+            RETURNING env."Cle"
+        """
+        cur = None
+        result = []
+        try:
+            cur = self.__cnx.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cur.execute(update)
+            result = cur.fetchall()
+            replaced = tuple((alarm["Id"], alarm["NbNotifications"] + 1) for alarm in result
+                             if alarm["NbNotifications"] > 0)
+            if replaced:
+                cur.execute(supersede, (replaced,))
+            cur.execute(rearm, (resend_delay,))
+            rearmed = [row[0] for row in cur.fetchall()]
+            self.__cnx.commit()
+            if rearmed:
+                logging.warning(f"BASE DONNEES --> aucun canal n'a réussi, "
+                                f"nouvel essai dans {resend_delay}s : {rearmed}")
+        except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
+            try:
+                self.__cnx.rollback()
+                logging.error(error.pgerror)
+            except AttributeError:
+                logging.error(error)
+        finally:
+            if isinstance(cur, psycopg2.extensions.cursor):
+                cur.close()
+        return result
+
+    @_pooled
+    def claim_alarm_deliveries(self, channel: str, limit: int,
+                               lease: int) -> Union[list, psycopg2.extras.DictCursor]:
+        """ Réserve les envois dus d'un canal, les plus prioritaires puis les plus anciens d'abord
+
+            Les lignes verrouillées par un autre émetteur sont sautées (SKIP LOCKED).
+            La réservation repousse le prochain essai de lease secondes : un envoi non terminé
+            (émetteur arrêté) redevient dû à la fin du bail.
+            :return: liste des envois réservés
+        """
+        if not self.__connected:
+            self.connect()
+        claim = """
+            UPDATE mobaspace_data."EnvoisAlarmes"
+            SET "Tentatives" = "Tentatives" + 1,
+             "ProchainEssai" = LOCALTIMESTAMP + %s * INTERVAL '1 second'
+            WHERE "Id" IN (
+             SELECT "Id" FROM mobaspace_data."EnvoisAlarmes"
+             WHERE "Canal" = %s AND "Statut" = 'attente' AND "ProchainEssai" <= LOCALTIMESTAMP
+             ORDER BY "Priorite" DESC, "Creation"
+             LIMIT %s
+             FOR UPDATE SKIP LOCKED)
+            RETURNING "Id", "Cle", "AlarmeId", "Tour", "Canal", "Priorite", "Contenu",
+             "Tentatives", "Creation", "CreationAlarme", "Premier"
+        """
+        cur = None
+        result = []
+        try:
+            cur = self.__cnx.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cur.execute(claim, (lease, channel, limit))
+            result = cur.fetchall()
+            self.__cnx.commit()
+        except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
+            try:
+                self.__cnx.rollback()
+                logging.error(error.pgerror)
+            except AttributeError:
+                logging.error(error)
+        finally:
+            if isinstance(cur, psycopg2.extensions.cursor):
+                cur.close()
+        return result
+
+    @_pooled
+    def complete_alarm_delivery(self, delivery_id: int, ok: bool, error_msg=None,
+                                retry_in=None) -> bool:
+        """ Enregistre le résultat d'un envoi réservé
+
+            :param ok: envoi réussi ("envoye")
+            :param error_msg: cause de l'échec
+            :param retry_in: délai (s) avant un nouvel essai,
+             None pour abandonner l'envoi ("echec") ;
+             un envoi remplacé par le tour suivant n'est pas remis en attente
+            :return: True si la mise à jour est faite
+        """
+        if not self.__connected:
+            self.connect()
+        update = """
+            UPDATE mobaspace_data."EnvoisAlarmes"
+            SET "Statut" = %s, "Envoi" = CASE WHEN %s THEN LOCALTIMESTAMP END, "Erreur" = %s,
+             "ProchainEssai" = LOCALTIMESTAMP + %s * INTERVAL '1 second'
+            WHERE "Id" = %s AND ("Statut" = 'attente' OR %s)
+        """
+        if ok:
+            status = "envoye"
+        elif retry_in is None:
+            status = "echec"
+        else:
+            status = "attente"
+        cur = None
+        result = False
+        try:
+            cur = self.__cnx.cursor()
+            cur.execute(update, (status, ok, error_msg, retry_in or 0, delivery_id, ok))
+            self.__cnx.commit()
+            result = True
+        except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
+            try:
+                self.__cnx.rollback()
+                logging.error(error.pgerror)
+            except AttributeError:
+                logging.error(error)
+        finally:
+            if isinstance(cur, psycopg2.extensions.cursor):
+                cur.close()
+        return result
+
+    @_pooled
     def get_uri_for_Observable(self, libelle:str) -> str:
         select = """
             SELECT "URI" 
@@ -145,6 +768,7 @@ class SysPadDb_encry:
             return result[0]['URI']
 
 
+    @_pooled
     def update_uri_typeObservable(self, libelle:str, new_uri:str):
         """
         Fonction pour mettre à jour les URI des différents types d'observables
@@ -183,6 +807,7 @@ class SysPadDb_encry:
             if isinstance(cur, psycopg2.extensions.cursor):
                 cur.close()
 
+    @_pooled
     def get_journeyObservables4room(self, room:int, day:datetime.date, my_type:str) -> Union[list, psycopg2.extras.DictCursor]:
         """
         Fonction pour recupérer les observables d'une chambre pour un jour donnée
@@ -218,6 +843,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def get_all_observables(self) -> Union[list, psycopg2.extras.DictCursor]:
         """
         Fonction pour recupérer tous les observables non traités
@@ -248,6 +874,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def erase_observable(self, obs_id: int):
         if not self.__connected:
             self.connect()
@@ -272,6 +899,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def change_obs_flag(self, obs_id: int, flag=True):
         """
         Cette fonction change la valeur du flag 'Traite' dans la table d'observables
@@ -302,6 +930,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def set_observable(self, room: int, uriPer:str, type_obs: str, values: [], comment=None):
         """
         Cette fonction permet d'insérer un nouveau observable dans la BD SySPAD
@@ -353,6 +982,7 @@ class SysPadDb_encry:
             if isinstance(cur, psycopg2.extensions.cursor):
                 cur.close()
 
+    @_pooled
     def get_obsTypeId(self, type:str) -> int:
         """
         Recupère le ID du type d'observable donné en entrée
@@ -381,6 +1011,7 @@ class SysPadDb_encry:
                 cur.close()
                 return result
 
+    @_pooled
     def existingTransaction(self, uri:str) -> str:
         if not self.__connected:
             self.connect()
@@ -406,6 +1037,7 @@ class SysPadDb_encry:
                 cur.close()
                 return result
 
+    @_pooled
     def insert_transaction(self, code:str, uri:str, detail=None):
         if not self.__connected:
             self.connect()
@@ -443,6 +1075,7 @@ class SysPadDb_encry:
             if isinstance(cur, psycopg2.extensions.cursor):
                 cur.close()
 
+    @_pooled
     def get_patId_from_room(self, room:int) -> int:
         """
         Recupère le ID d'un patient
@@ -475,36 +1108,16 @@ class SysPadDb_encry:
 
 
     def get_patient_from_wgs_user(self, wgs_user_id: str) -> []:
-        if not self.__connected:
-            self.connect()
-
-        # création de la requête SQL
-        select = """
-        SELECT "PatientId" FROM mobaspace_data."OAuth2Apis"
-        WHERE "ApiUserId"=%s
         """
-
+        Correspondance Patient <--> Withings user, servie par l'index en mémoire
+        :return: liste de tuples (PatientId,) comme la requête sur OAuth2Apis
+        """
         logging.debug(
             f"BASE DONNEES --> Correspondance Patient <--> Withings user"
         )
-        cur = None
-        result = dict()
-        try:
-            cur = self.__cnx.cursor()
-            cur.execute(select, (wgs_user_id,))
-            result = cur.fetchall()
-            self.__cnx.commit()
-        except psycopg2.DatabaseError as error:
-            try:
-                self.__cnx.rollback()
-                logging.error(error.pgerror)
-            except AttributeError:
-                logging.error(error)
-        finally:
-            if isinstance(cur, psycopg2.extensions.cursor):
-                cur.close()
-            return result
+        return [(pat_id,) for pat_id in self.__lookup("wgs_user", str(wgs_user_id), default=[])]
 
+    @_pooled
     def update_patient_lying_day_time(self, patient_id, amount: int):
         update = (
             'UPDATE mobaspace_data."patientsview"'
@@ -529,6 +1142,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def update_patient_posture(self, patient_id: int, posture: int):
         update = (
             'UPDATE mobaspace_data."patientsview"'
@@ -553,30 +1167,29 @@ class SysPadDb_encry:
         return
 
     def get_id_sensor_for_pat(self, patient_id: int, provider='Withings'):
-        select = """
-        SELECT "CapteurId" FROM mobaspace_data."ApisCapteurs"
-        INNER JOIN mobaspace_data."OAuth2Apis" on ("OAuth2Apis"."Id" = "ApiId")
-        WHERE "PatientId"=%s AND "Provider"=%s
+        return self.__lookup("sensor_for_pat", (patient_id, provider))
+
+    def get_room_of_patient(self, patient_id: int) -> Union[dict, None]:
         """
-        cur = None
-        result = None
-        try:
-            cur = self.__cnx.cursor()
-            cur.execute(select, (patient_id, provider,))
-            result = cur.fetchone()[0]
-            self.__cnx.commit()
-        except psycopg2.DatabaseError as error:
-            try:
-                self.__cnx.rollback()
-                logging.error(error.pgerror)
-            except AttributeError:
-                logging.error(error)
-        finally:
-            if isinstance(cur, psycopg2.extensions.cursor):
-                cur.close()
-            return result
+        Chambre d'un patient, servie par l'index en mémoire
+        :return: dict avec "NumCh" et "Chambre", None si le patient est inconnu
+        """
+        if patient_id is None:
+            return None
+        return self.__lookup("patient", patient_id)
 
+    def get_alarm_contact(self, patient_id: int) -> dict:
+        """
+        Chambre et contact à notifier pour les alarmes d'un patient, servis par l'index en mémoire
+        :return: dict avec "NumCh", "Chambre", "Appel" et "CanalNotif" (None si inconnus)
+        """
+        contact = {"NumCh": None, "Chambre": None, "Appel": None, "CanalNotif": None}
+        if patient_id is not None:
+            contact.update(self.__lookup("patient", patient_id) or {})
+            contact.update(self.__lookup("contact", patient_id) or {})
+        return contact
 
+    @_pooled
     def update_bed_notify(self, patient_id: int, bed_type: int, noti_date: int):
         if bed_type == PatientConst.BED_IN.value:
             update = (
@@ -598,6 +1211,8 @@ class SysPadDb_encry:
             cur = self.__cnx.cursor()
             cur.execute(update, (True, noti_date, patient_id))
             self.__cnx.commit()
+            # réveil immédiat du BedMonitor pour ce seul patient
+            self.__bed_events.put(patient_id)
         except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
             try:
                 self.__cnx.rollback()
@@ -609,6 +1224,18 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    def wait_bed_event(self, timeout: float) -> Union[int, None]:
+        """ Attend qu'un évènement BED_IN/BED_OUT soit enregistré par update_bed_notify
+
+            :param timeout: temps d'attente maximum en secondes
+            :return: l'Id du patient concerné, None si aucun évènement pendant timeout
+        """
+        try:
+            return self.__bed_events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    @_pooled
     def check_patient_flags(self, patient_id: int) -> []:
         if not self.__connected:
             self.connect()
@@ -634,6 +1261,7 @@ class SysPadDb_encry:
                 cur.close()
                 return result
 
+    @_pooled
     def change_patient_flag(self, patient_id: int, flag: bool, mytype: str):
         """
         Permet de changer le flag d'un patient, normalement utilisé par le process qui traite les données
@@ -680,6 +1308,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def get_last_bed_events(self, patient_id: int):
         if not self.__connected:
             self.connect()
@@ -707,6 +1336,7 @@ class SysPadDb_encry:
                 cur.close()
                 return result
 
+    @_pooled
     def is_api_in_table(self, api_id: int) -> bool:
         result = False
         if not self.__connected:
@@ -731,6 +1361,7 @@ class SysPadDb_encry:
                 cur.close()
         return result
 
+    @_pooled
     def get_patient_limits(self, pat_id: int):
         if not self.__connected:
             self.connect()
@@ -755,6 +1386,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def read_one_patient(self, pat_id: int) -> Union[list, psycopg2.extras.DictCursor]:
         result = []
         if not self.__connected:
@@ -778,6 +1410,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def read_all_patients(self) -> Union[list, psycopg2.extras.DictCursor]:
         """
         Lecture de la liste des patients
@@ -807,6 +1440,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def read_pat_id_from_apis(self) -> Union[list, psycopg2.extras.DictCursor]:
         """
         Lecture de la liste des patients
@@ -836,6 +1470,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def read_tokens_keys(self, api_id: int) -> Union[list, psycopg2.extras.DictCursor]:
         result = []
         if not self.__connected:
@@ -863,6 +1498,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def read_patient_api(self, patient_id: int, provider="Withings") -> []:
         """
         Lecture des API liés au patient
@@ -899,6 +1535,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def get_expired_api_ids(self, provider="Withings"):
         """
         Cette fonction retourne les Id des apis qui ont un access_token qui va expirer dans 15min
@@ -932,6 +1569,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def set_tracker_state(self, tracker_mac:str, state=True):
         if not self.__connected:
             self.connect()
@@ -955,6 +1593,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def set_api_state(self, api_id:int, state:bool):
         if not self.__connected:
             self.connect()
@@ -978,6 +1617,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def set_sensor_state(self, sensor_id:int, state:bool):
         if not self.__connected:
             self.connect()
@@ -1001,6 +1641,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def read_sensors(self, patient_id: int, type: str) -> Union[list, psycopg2.extras.DictCursor]:
         """
         Lecture de la liste des capteurs pour un patient
@@ -1012,17 +1653,18 @@ class SysPadDb_encry:
         result = []
         if not self.__connected:
             self.connect()
-        select = """SELECT mobaspace_data."Capteurs"."Id", mobaspace_data."Capteurs"."EtatOK" 
+        # les capteurs associés au patient viennent de l'index, seul l'état est lu en base
+        sensor_ids = self.__lookup("sensors_of_pat", patient_id, default=[])
+        if not sensor_ids:
+            return result
+        select = """SELECT "Id", "EtatOK"
                 FROM mobaspace_data."Capteurs"
-                INNER JOIN mobaspace_data."ApisCapteurs" on (mobaspace_data."Capteurs"."Id" = "CapteurId")
-                INNER JOIN mobaspace_data."OAuth2Apis" on ("ApiId" = mobaspace_data."OAuth2Apis"."Id")
-                WHERE mobaspace_data."OAuth2Apis"."PatientId" = %s
-                AND   mobaspace_data."Capteurs"."Type"= %s """
+                WHERE "Id" = ANY(%s) AND "Type"= %s """
         logging.debug(f"BASE DONNEES --> récupération du Capteure de Type={type} associé au Patient={patient_id}")
         cur = None
         try:
             cur = self.__cnx.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute(select, (patient_id, type,))
+            cur.execute(select, (sensor_ids, type,))
             result = cur.fetchall()
             self.__cnx.commit()
         except psycopg2.DatabaseError as error:
@@ -1036,6 +1678,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def update_token(self, api_id: int, access_token: str, refresh_token: str, expiry_date: float):
         """
         Mets à jour les tokens d'une API
@@ -1071,17 +1714,152 @@ class SysPadDb_encry:
                 cur.close()
         return
 
-    def insert_alarm(self, alarm):
-        """ Insere une alarme dans la base de donnée
+    @property
+    def alarm_stats(self) -> dict:
+        """ Métriques du regroupement des alarmes
+
+            :return: alarmes insérées, répétitions regroupées, priorités relevées
+             et groupes ouverts
+            :rtype: dict
+        """
+        with self.__alarms_lock:
+            stats = dict(self.__alarm_stats)
+            stats["open_groups"] = len(self.__recent_alarms)
+        return stats
+
+    def insert_alarm(self, alarm) -> Union[int, None]:
+        """ Insere une alarme dans la base de donnée, sauf si la même alarme (patient, capteur,
+            description) a été insérée depuis moins de ALARM_COALESCE_WINDOW secondes :
+            la répétition est comptée sur l'alarme existante, dont la priorité est relevée
+            si besoin
+
+            Une répétition HIGH (ou qui relève la priorité) d'une alarme dont tous les tours de
+            notification sont faits n'est pas regroupée : une nouvelle alarme est insérée pour
+            prévenir à nouveau.
             :param alarm: L'alarme à insérer
+            :return: Id de l'alarme insérée ou regroupée, None en cas d'erreur
+        """
+        key = (alarm["id_patient"], alarm["id_capteur"], alarm["desc"])
+        now = time.monotonic()
+        with self.__alarms_lock:
+            for old_key in [k for k, group in self.__recent_alarms.items()
+                            if now - group["start"] > self.ALARM_COALESCE_WINDOW]:
+                del self.__recent_alarms[old_key]
+            group = self.__recent_alarms.get(key)
+            if group is None:
+                # réservé avant l'insertion : une répétition simultanée est regroupée
+                group = {"id": None, "start": now, "count": 1, "priorite": alarm["priorite"],
+                         "ready": threading.Event()}
+                self.__recent_alarms[key] = group
+                new_group = True
+            else:
+                new_group = False
+
+        if new_group:
+            alarm_id = self.__insert_alarm_row(alarm)
+            with self.__alarms_lock:
+                if alarm_id is None:
+                    if self.__recent_alarms.get(key) is group:
+                        del self.__recent_alarms[key]
+                else:
+                    group["id"] = alarm_id
+                    self.__alarm_stats["inserted"] += 1
+            group["ready"].set()
+            return alarm_id
+
+        while not group["ready"].wait(timeout=self.ALARM_READY_WAIT):
+            logging.warning(f"BASE DONNEES --> insertion de l'alarme {alarm['desc']} toujours "
+                            f"en cours après {self.ALARM_READY_WAIT}s, la répétition attend")
+        escalate = alarm["priorite"] > group["priorite"]
+        if group["id"] is None or (
+                (escalate or alarm["priorite"] >= AlarmConst.HIGH.value)
+                and not self.__alarm_remaining(group["id"])):
+            # première insertion en échec, ou alarme déjà entièrement notifiée : nouvelle alarme
+            logging.debug(f"BASE DONNEES --> alarme {alarm['desc']} non regroupée "
+                          f"avec l'alarme {group['id']}")
+            with self.__alarms_lock:
+                if self.__recent_alarms.get(key) is group:
+                    del self.__recent_alarms[key]
+            return self.insert_alarm(alarm)
+
+        with self.__alarms_lock:
+            group["count"] += 1
+            count = group["count"]
+            group["priorite"] = max(group["priorite"], alarm["priorite"])
+            self.__alarm_stats["coalesced"] += 1
+        logging.debug(f"BASE DONNEES --> alarme {alarm['desc']} regroupée "
+                      f"avec l'alarme {group['id']} ({count} occurrences)")
+        self.__record_repeat(group["id"], count)
+        if escalate:
+            self.__escalate_alarm(group["id"], alarm["priorite"])
+        return group["id"]
+
+    @_pooled
+    def __alarm_remaining(self, alarm_id: int) -> Union[int, None]:
+        """ Nombre de tours de notification restant à une alarme
+            (None si elle n'existe plus ou en cas d'erreur)
         """
+        if not self.__connected:
+            self.connect()
+        select = 'SELECT "NbNotifications" FROM mobaspace_data."alarmesview" WHERE "Id"=%s'
+        cur = None
+        result = None
+        try:
+            cur = self.__cnx.cursor()
+            cur.execute(select, (alarm_id,))
+            row = cur.fetchone()
+            self.__cnx.commit()
+            if row is not None:
+                result = row[0]
+        except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
+            try:
+                self.__cnx.rollback()
+                logging.error(error.pgerror)
+            except AttributeError:
+                logging.error(error)
+        finally:
+            if isinstance(cur, psycopg2.extensions.cursor):
+                cur.close()
+        return result
+
+    @_pooled
+    def __record_repeat(self, alarm_id: int, occurrences: int):
+        """ Enregistre le nombre d'occurrences d'une alarme regroupée """
+        if not self.__connected:
+            self.connect()
+        upsert = (
+            'INSERT INTO mobaspace_data."RepetitionsAlarmes"'
+            ' ("AlarmeId", "Occurrences", "Derniere")'
+            ' VALUES (%s, %s, LOCALTIMESTAMP)'
+            ' ON CONFLICT ("AlarmeId") DO UPDATE SET'
+            ' "Occurrences"=GREATEST("RepetitionsAlarmes"."Occurrences", EXCLUDED."Occurrences"),'
+            ' "Derniere"=EXCLUDED."Derniere"'
+        )
+        cur = None
+        try:
+            cur = self.__cnx.cursor()
+            cur.execute(upsert, (alarm_id, occurrences))
+            self.__cnx.commit()
+        except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
+            try:
+                self.__cnx.rollback()
+                logging.error(error.pgerror)
+            except AttributeError:
+                logging.error(error)
+        finally:
+            if isinstance(cur, psycopg2.extensions.cursor):
+                cur.close()
+
+    @_pooled
+    def __insert_alarm_row(self, alarm) -> Union[int, None]:
         if not self.__connected:
             self.connect()
         insert = (
             'INSERT INTO mobaspace_data."alarmesview" '
             ' ("CapteurId", "PatientId", "Priorite", "Description", '
             ' "Creation", "NbNotifications") '
-            " VALUES(%s, %s, %s, %s, %s, %s);"
+            " VALUES(%s, %s, %s, %s, %s, %s)"
+            ' RETURNING "Id";'
         )
         counts = 1
         if alarm["priorite"] >= AlarmConst.HIGH.value: #AlarmConst.HIGH.value = 85 so gt 75 is enought to set more counts!!
@@ -1089,6 +1867,7 @@ class SysPadDb_encry:
         create_date = datetime.now()
         logging.debug(f"BASE DONNEES --> insertion de l'alarme {alarm['desc']} à {create_date}")
         cur = None
+        alarm_id = None
         # le nombre de notifications par défaut est mis à 3
         try:
             cur = self.__cnx.cursor()
@@ -1103,7 +1882,40 @@ class SysPadDb_encry:
                     counts,
                 ),
             )
+            alarm_id = cur.fetchone()[0]
+            self.__cnx.commit()
+        except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
+            try:
+                self.__cnx.rollback()
+                logging.error(error.pgerror)
+            except AttributeError:
+                logging.error(error)
+        finally:
+            if isinstance(cur, psycopg2.extensions.cursor):
+                cur.close()
+        return alarm_id
+
+    @_pooled
+    def __escalate_alarm(self, alarm_id: int, priority: int):
+        """ Relève la priorité d'une alarme regroupée,
+            avec le nombre de notifications d'une alarme HIGH si besoin
+        """
+        if not self.__connected:
+            self.connect()
+        update = (
+            'UPDATE mobaspace_data."alarmesview"'
+            ' SET "Priorite"=%s, "NbNotifications"=GREATEST("NbNotifications", %s)'
+            ' WHERE "Id"=%s AND "Priorite"<%s'
+        )
+        counts = self.__atimes if priority >= AlarmConst.HIGH.value else 1
+        logging.debug(f"BASE DONNEES --> priorité de l'alarme {alarm_id} relevée à {priority}")
+        cur = None
+        try:
+            cur = self.__cnx.cursor()
+            cur.execute(update, (priority, counts, alarm_id, priority))
             self.__cnx.commit()
+            with self.__alarms_lock:
+                self.__alarm_stats["escalated"] += cur.rowcount
         except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
             try:
                 self.__cnx.rollback()
@@ -1114,6 +1926,7 @@ class SysPadDb_encry:
             if isinstance(cur, psycopg2.extensions.cursor):
                 cur.close()
 
+    @_pooled
     def update_prediction(self, id:int, s4today:float, s4tomorrow:float, ti:float, fr:float):
         if not self.__connected:
             self.connect()
@@ -1148,6 +1961,7 @@ class SysPadDb_encry:
             if isinstance(cur, psycopg2.extensions.cursor):
                 cur.close()
 
+    @_pooled
     def get_roomValues_4_prediction(self, room:int) -> Union[list, psycopg2.extras.DictCursor]:
         if not self.__connected:
             self.connect()
@@ -1175,6 +1989,82 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
+    def update_predictions(self, predictions: []) -> bool:
+        """ Met à jour les scores de plusieurs chambres en une seule transaction
+            :param predictions: liste de dict {"id", "s4today", "s4tomorrow", "ti", "fr"}
+            :return: True si la mise à jour est faite
+        """
+        if not self.__connected:
+            self.connect()
+        update = (
+            'UPDATE mobaspace_data."ScoreForme"'
+            ' SET "TauxDeRemp"=%s, "ScoreJour"=%s, "ScorePred"=%s, "IndiceDeConfiance"=%s'
+            ' WHERE "Id"=%s'
+        )
+        logging.debug(f"BASE DONNEES --> update groupé des scores de {len(predictions)} "
+                      f"chambre(s)")
+        cur = None
+        result = False
+        try:
+            cur = self.__cnx.cursor()
+            psycopg2.extras.execute_batch(cur, update, [
+                (
+                    pred["fr"], #fillingRate
+                    pred["s4today"],
+                    pred["s4tomorrow"],
+                    pred["ti"], #trustIndex
+                    pred["id"], #primary key
+                ) for pred in predictions
+            ])
+            self.__cnx.commit()
+            result = True
+        except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
+            try:
+                self.__cnx.rollback()
+                logging.error(error.pgerror)
+            except AttributeError:
+                logging.error(error)
+        finally:
+            if isinstance(cur, psycopg2.extensions.cursor):
+                cur.close()
+        return result
+
+    @_pooled
+    def get_roomsValues_4_prediction(self, rooms: []) -> Union[list, psycopg2.extras.DictCursor]:
+        """ Valeurs des 7 derniers jours de plusieurs chambres en une seule requête
+            :param rooms: liste des numéros de chambre
+            :return: lignes "NumCh", "Id", "Date", "Current_values"
+             rangées par chambre puis par date
+        """
+        if not self.__connected:
+            self.connect()
+        select = (
+            'SELECT "NumCh", "Id", "Date", "Current_values" from mobaspace_data."ScoreForme"'
+            ' WHERE "NumCh" = ANY(%s) AND "Date" > CURRENT_DATE - 7'
+            ' ORDER BY "NumCh", "Date" ASC'
+        )
+        logging.debug(f"BASE DONNEES --> Recupération des valeurs de {len(rooms)} chambre(s) "
+                      f"pour la prédiction")
+        cur = None
+        result = None
+        try:
+            cur = self.__cnx.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cur.execute(select, (list(rooms),))
+            result = cur.fetchall()
+            self.__cnx.commit()
+        except psycopg2.DatabaseError as error:
+            try:
+                self.__cnx.rollback()
+                logging.error(error.pgerror)
+            except AttributeError:
+                logging.error(error)
+        finally:
+            if isinstance(cur, psycopg2.extensions.cursor):
+                cur.close()
+            return result
+
+    @_pooled
     def get_roomsId_4_prediction(self) -> []:
         if not self.__connected:
             self.connect()
@@ -1200,6 +2090,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def set_filledForm(self, room: int, values: [], for_date=None):
         if not self.__connected:
             self.connect()
@@ -1243,6 +2134,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def insert_day_total_lying_time(self, patient: int, date_jour: str, temps_allonge_total: int):
         if not self.__connected:
             self.connect()
@@ -1281,6 +2173,7 @@ class SysPadDb_encry:
             if isinstance(cur, psycopg2.extensions.cursor):
                 cur.close()
 
+    @_pooled
     def setURItoUser(self, userId: str, uri: str):
         if not self.__connected:
             self.connect()
@@ -1311,6 +2204,7 @@ class SysPadDb_encry:
             if isinstance(cur, psycopg2.extensions.cursor):
                 cur.close()
 
+    @_pooled
     def getRoomsVisited4User(self, idPer:str) -> Union[list, psycopg2.extras.DictCursor]:
 
         if not self.__connected:
@@ -1340,6 +2234,7 @@ class SysPadDb_encry:
             return result
 
     #obtenition des blocs d'information non traités
+    @_pooled
     def getRoomsInfoBlocks(self) -> Union[list, psycopg2.extras.DictCursor]:
         if not self.__connected:
             self.connect()
@@ -1365,6 +2260,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def setRoomBlockFlag (self, id:int, flag:bool):
         if not self.__connected:
             self.connect()
@@ -1396,6 +2292,7 @@ class SysPadDb_encry:
                 cur.close()
 
     #insertion d'une nouvelle ligne block chambre
+    @_pooled
     def setBedroomInfoBlock(self, room:int, values: dict, idPer:str):
         if not self.__connected:
             self.connect()
@@ -1432,6 +2329,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def getUsersWithoutURI(self) -> Union[list, psycopg2.extras.DictCursor]:
         if not self.__connected:
             self.connect()
@@ -1459,6 +2357,7 @@ class SysPadDb_encry:
             return result
 
 
+    @_pooled
     def get_day_stepfreqs(self, patient:int, date_jour: str) -> []:
         if not self.__connected:
             self.connect()
@@ -1487,6 +2386,7 @@ class SysPadDb_encry:
                 cur.close()
         return my_list
 
+    @_pooled
     def insert_day_steps(self, patient: int, date_jour: str, steps: int, activityTime: int, stepfreq: float):
         if not self.__connected:
             self.connect()
@@ -1540,6 +2440,7 @@ class SysPadDb_encry:
             if isinstance(cur, psycopg2.extensions.cursor):
                 cur.close()
 
+    @_pooled
     def insert_sleep_summary(self, patient: int, date_nuit: str, data: dict):
         """ Insère ou met à jour les données de nuit dans la base de donnée
             :param patient: id patient
@@ -1597,6 +2498,7 @@ class SysPadDb_encry:
             if isinstance(cur, psycopg2.extensions.cursor):
                 cur.close()
 
+    @_pooled
     def insert_bedouts_summary(self, patient: int, date_nuit: str, bedouts_summ: dict):
         if not self.__connected:
             self.connect()
@@ -1641,6 +2543,7 @@ class SysPadDb_encry:
             if isinstance(cur, psycopg2.extensions.cursor):
                 cur.close()
 
+    @_pooled
     def get_sleep_score(self, patId:int, mydate:date) -> int:
         result = None
         myts = mydate
@@ -1669,6 +2572,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def get_step_score(self, patId:int, mydate:date) -> int:
         result = None
         if not self.__connected:
@@ -1696,6 +2600,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def get_lying_time(self, patId:int, mydate:date) -> int:
         result = None
         if not self.__connected:
@@ -1723,6 +2628,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def get_SLEEP_from_nights(self, id:int) -> Union[list, psycopg2.extras.DictCursor]:
         result = []
         if not self.__connected:
@@ -1755,6 +2661,7 @@ class SysPadDb_encry:
 
 
 
+    @_pooled
     def erase_old_nights(self, before_days:int):
         date_lim = datetime.now().date() - timedelta(days=before_days)
         if not self.__connected:
@@ -1780,6 +2687,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def erase_old_scores(self, before_days:int):
         date_lim = datetime.now().date() - timedelta(days=before_days)
         if not self.__connected:
@@ -1805,6 +2713,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def erase_night(self, id:int) -> None:
         if not self.__connected:
             self.connect()
@@ -1829,6 +2738,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def update_night_flagTraitee(self, night_id:int, flag=True):
         if not self.__connected:
             self.connect()
@@ -1856,6 +2766,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def get_ids_from_nights(self) -> Union[list, psycopg2.extras.DictCursor]:
         result = []
         if not self.__connected:
@@ -1883,6 +2794,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def get_days(self) -> Union[list, psycopg2.extras.DictCursor]:
         result = []
         if not self.__connected:
@@ -1911,6 +2823,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def erase_day(self, id:int) -> None:
         if not self.__connected:
             self.connect()
@@ -1935,6 +2848,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def erase_old_days(self, before_days:int):
         date_lim = datetime.now().date() - timedelta(days=before_days)
         if not self.__connected:
@@ -1960,6 +2874,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def update_day_flagTraitee(self, day_id:int, flag=True):
         if not self.__connected:
             self.connect()
@@ -1987,6 +2902,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def erase_old_alarms(self, before_days:int):
         date_lim = datetime.now().date() - timedelta(days=before_days)
         if not self.__connected:
@@ -1995,11 +2911,15 @@ class SysPadDb_encry:
             'DELETE from mobaspace_data."alarmesview"'
             ' WHERE "Creation"<%s'
         )
+        delete_outbox = 'DELETE from mobaspace_data."EnvoisAlarmes" WHERE "Creation"<%s'
+        delete_repeats = 'DELETE from mobaspace_data."RepetitionsAlarmes" WHERE "Derniere"<%s'
         logging.debug(f"BASE DONNEES --> effacage des Alarmes antérieurs à {date_lim}")
         cur = None
         try:
             cur = self.__cnx.cursor()
             cur.execute(delete, (date_lim,) )
+            cur.execute(delete_outbox, (date_lim,))
+            cur.execute(delete_repeats, (date_lim,))
             self.__cnx.commit()
         except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
             try:
@@ -2012,6 +2932,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def erase_old_observables(self, before_days:int):
         date_lim = datetime.now().date() - timedelta(days=before_days)
         if not self.__connected:
@@ -2037,6 +2958,7 @@ class SysPadDb_encry:
                 cur.close()
         return
 
+    @_pooled
     def get_tracker_lastUpdate(self, capteurId:int) -> Union[list, psycopg2.extras.DictCursor]:
         if not self.__connected:
             self.connect()
@@ -2064,19 +2986,19 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
-    def get_trackers(self) -> Union[list, psycopg2.extras.DictCursor]:
+    @_pooled
+    def get_trackers(self) -> []:
+        """
+        Données des trackers non traités et attachés à une API, complétées par l'index
+        (adresse MAC, patient, chambre) au lieu d'une jointure sur 4 tables
+        :return: liste de dict
+        """
         if not self.__connected:
             self.connect()
         select = """
-                SELECT "trackersview"."Id", "LecturesWifi", "NbPas", "ActivityTime", "VitesseMarche",
-                        "AccVector", "Identifiant" as "AdresseMAC", 
-                        "LastUpdate", "patientsview"."Id" as "PatientId", 
-                        "Chambre", "NumCh", "Power", "trackersview"."CapteurId" as "CapteurId"
+                SELECT "Id", "LecturesWifi", "NbPas", "ActivityTime", "VitesseMarche",
+                        "AccVector", "LastUpdate", "Power", "CapteurId"
                 FROM mobaspace_data."trackersview"
-                INNER JOIN mobaspace_data."Capteurs" ON (mobaspace_data."trackersview"."CapteurId" = mobaspace_data."Capteurs"."Id")
-                INNER JOIN mobaspace_data."ApisCapteurs" ON (mobaspace_data."Capteurs"."Id" = mobaspace_data."ApisCapteurs"."CapteurId")
-                INNER JOIN mobaspace_data."OAuth2Apis" ON (mobaspace_data."ApisCapteurs"."ApiId" = mobaspace_data."OAuth2Apis"."Id")
-                LEFT JOIN mobaspace_data."patientsview" ON (mobaspace_data."OAuth2Apis"."PatientId" = mobaspace_data."patientsview"."Id")
                 WHERE "Traite" = False;
                 """
         logging.debug(f"BASE DONNEES --> Récupération données Trackers non traités et attachés à un résident")
@@ -2085,7 +3007,20 @@ class SysPadDb_encry:
         try:
             cur = self.__cnx.cursor(cursor_factory=psycopg2.extras.DictCursor)
             cur.execute(select, )
-            result = cur.fetchall()
+            result = []
+            for row in cur.fetchall():
+                capteur = self.__lookup("capteur", row["CapteurId"])
+                if capteur is None or not capteur["apis"]:
+                    # capteur non rattaché à une API, ignoré comme avec l'ancienne jointure
+                    continue
+                tracker = dict(row)
+                tracker["AdresseMAC"] = capteur["mac"]
+                for pat_id in capteur["patients"]:
+                    patient = self.get_room_of_patient(pat_id)
+                    if patient is None:
+                        result.append(dict(tracker, PatientId=None, NumCh=None, Chambre=None))
+                    else:
+                        result.append(dict(tracker, PatientId=pat_id, **patient))
             self.__cnx.commit()
         except psycopg2.DatabaseError as error:
             try:
@@ -2098,6 +3033,7 @@ class SysPadDb_encry:
                 cur.close()
             return result
 
+    @_pooled
     def set_tracker_flag(self, devId:int, flag:bool):
         if not self.__connected:
             self.connect()
@@ -2125,9 +3061,74 @@ class SysPadDb_encry:
                 cur.close()
         return
 
-    def update_tracker(self, macAdd:str, lec_wifi:dict, nb_pas:int, acc_vector:[], power:float, walk_speed:float, act_time:int):
-        if not self.__connected:
-            self.connect()
+    def buffer_tracker(self, macAdd: str, lec_wifi: dict, nb_pas: int, acc_vector: [],
+                       power: float, walk_speed: float, act_time: int):
+        """ Met en attente une lecture Smart-Tracker, écrite par flush_trackers
+
+            Les lectures d'un même dispositif sont fusionnées: les pas et le temps d'activité
+            s'additionnent (ils sont cumulés par jour par le DataProcessor), un vecteur de chute
+            n'est jamais écrasé par une lecture sans chute, le reste garde la dernière valeur.
+        """
+        now = datetime.now()
+        with self.__tracker_lock:
+            previous = self.__tracker_buffer.get(macAdd)
+            if previous is None:
+                self.__tracker_buffer[macAdd] = {
+                    "first": time.monotonic(), "lec_wifi": lec_wifi, "nb_pas": nb_pas,
+                    "acc_vector": acc_vector, "power": power, "walk_speed": walk_speed,
+                    "act_time": act_time, "date": now
+                }
+                return
+            self.__merge_tracker(previous, {
+                "lec_wifi": lec_wifi, "nb_pas": nb_pas, "acc_vector": acc_vector, "power": power,
+                "walk_speed": walk_speed, "act_time": act_time, "date": now
+            })
+
+    @staticmethod
+    def __merge_tracker(previous: dict, reading: dict):
+        """ Fusionne dans previous une lecture plus récente du même dispositif
+            (voir buffer_tracker)
+        """
+        previous["nb_pas"] = (previous["nb_pas"] or 0) + (reading["nb_pas"] or 0)
+        previous["act_time"] = (previous["act_time"] or 0) + (reading["act_time"] or 0)
+        if reading["acc_vector"]:
+            previous["acc_vector"] = reading["acc_vector"]
+        if reading["lec_wifi"]:
+            previous["lec_wifi"] = reading["lec_wifi"]
+        if reading["walk_speed"] and reading["walk_speed"] > 0:
+            previous["walk_speed"] = reading["walk_speed"]
+        previous["power"] = reading["power"]
+        previous["date"] = reading["date"]
+
+    def flush_trackers(self, force=False) -> int:
+        """ Ecrit les lectures Smart-Tracker en attente dans une seule transaction
+
+            :param force: écrire même si la plus ancienne lecture a moins de
+             TRACKER_FLUSH_WINDOW secondes
+            :return: le nombre de dispositifs mis à jour
+        """
+        with self.__tracker_lock:
+            if not self.__tracker_buffer:
+                return 0
+            oldest = min(elem["first"] for elem in self.__tracker_buffer.values())
+            if not force and time.monotonic() - oldest < self.TRACKER_FLUSH_WINDOW:
+                return 0
+            pending = self.__tracker_buffer
+            self.__tracker_buffer = dict()
+        if not self.__write_trackers(pending):
+            # la base n'a pas pu être mise à jour, les lectures seront retentées au prochain flush
+            # les lectures arrivées entre temps sont plus récentes et fusionnées par-dessus
+            with self.__tracker_lock:
+                for mac, elem in pending.items():
+                    newer = self.__tracker_buffer.get(mac)
+                    if newer is not None:
+                        self.__merge_tracker(elem, newer)
+                    self.__tracker_buffer[mac] = elem
+            return 0
+        return len(pending)
+
+    @_pooled
+    def __write_trackers(self, pending: dict) -> bool:
         update = """
             UPDATE mobaspace_data."trackersview"
             SET "LecturesWifi"=%s,
@@ -2138,32 +3139,39 @@ class SysPadDb_encry:
             "Power"=%s,
             "ActivityTime"=%s,
             "VitesseMarche"=%s
-            WHERE(
-                SELECT t1."Id"
-                from mobaspace_data."trackersview" as t1
-                inner join mobaspace_data."Capteurs" as t2
-                on (t1."CapteurId" = t2."Id")
-                where "Identifiant" = %s
-            ) = "Id";
+            WHERE "CapteurId" = %s;
         """
-
-        logging.debug(
-            f"BASE DONNEES --> mise à jour des données tracker pour le dispositif avec Id={macAdd}"
-        )
+        state = 'UPDATE mobaspace_data."Capteurs" SET "EtatOK"=True WHERE "Id" = ANY(%s)'
+        capteurs = dict()
+        for mac in pending:
+            capteur_id = self.__lookup("mac", mac)
+            if capteur_id is None:
+                logging.debug(f"BASE DONNEES --> aucun capteur avec l'adresse {mac}")
+            else:
+                capteurs[mac] = capteur_id
+        if not capteurs:
+            return True
+        logging.debug(f"BASE DONNEES --> mise à jour groupée des données de {len(capteurs)} "
+                      f"tracker(s)")
         cur = None
+        result = False
         try:
             cur = self.__cnx.cursor()
-            cur.execute(update, (
-                json.dumps(lec_wifi),
-                nb_pas,
-                acc_vector,
-                datetime.now(),
-                power,
-                act_time,
-                walk_speed,
-                macAdd
-            ))
+            psycopg2.extras.execute_batch(cur, update, [
+                (
+                    json.dumps(elem["lec_wifi"]),
+                    elem["nb_pas"],
+                    elem["acc_vector"],
+                    elem["date"],
+                    elem["power"],
+                    elem["act_time"],
+                    elem["walk_speed"],
+                    capteurs[mac]
+                ) for mac, elem in pending.items() if mac in capteurs
+            ])
+            cur.execute(state, (list(capteurs.values()),))
             self.__cnx.commit()
+            result = True
         except (psycopg2.DatabaseError, psycopg2.InterfaceError) as error:
             try:
                 self.__cnx.rollback()
@@ -2173,7 +3181,7 @@ class SysPadDb_encry:
         finally:
             if isinstance(cur, psycopg2.extensions.cursor):
                 cur.close()
-        return
+        return result
 
     @property
     def is_connected(self):
@@ -2193,11 +3201,14 @@ class SysPadDb_encry:
         """ Check database connection and try to reconnect every 10s
         """
         while True:
-            if not self.__heart_beat_check():
+            # une connexion cassée est jetée par le pool à sa restitution,
+            # on ne recrée le pool que s'il n'a jamais pu être établi
+            if not self.__heart_beat_check() and not self.__connected:
                 # try to reconnect
                 self.connect()
             time.sleep(10)
 
+    @_pooled
     def __heart_beat_check(self):
         """ Heart beat method, check if database is alive and update its state
         """
@@ -2223,6 +3234,7 @@ class SysPadDb_encry:
                 cur.close()
         return result
 
+    @_pooled
     def checklist_from_db(self, chambre, periode):
         check_list = []
         if not self.__connected:
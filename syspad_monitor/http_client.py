@@ -0,0 +1,162 @@
+# coding: utf8
+"""
+Client HTTP partagé par les API externes (Withings, NetSOINS, serveur d'alarmes, Afilnet)
+
+Une session requests (keep-alive) par hôte, des timeouts de connexion/lecture par défaut,
+une politique de réessais avec backoff exponentiel et des histogrammes de latence
+par point d'accès.
+
+:date: 18/10/2026
+
+"""
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class HttpClient:
+    """
+    Cette classe centralise les appels HTTP sortants
+    """
+    # timeout (connexion, lecture) en secondes appliqué si l'appelant n'en donne pas
+    DEFAULT_TIMEOUT = (5, 30)
+    # réessais sur erreur de connexion pour toutes les méthodes,
+    # sur erreur de lecture ou statut 502/503/504 pour les méthodes idempotentes seulement
+    # (request(..., idempotent=False) les désactive aussi pour un GET : envoi de SMS, appel vocal)
+    RETRIES = 3
+    BACKOFF_FACTOR = 0.5
+    RETRY_STATUS = (502, 503, 504)
+    # connexions gardées ouvertes par hôte
+    POOL_SIZE = 8
+    # bornes supérieures (s) des classes de l'histogramme de latence
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=RETRIES, backoff_factor=BACKOFF_FACTOR,
+                 pool_size=POOL_SIZE):
+        self.__timeout = timeout
+        self.__retries = retries
+        self.__backoff = backoff_factor
+        self.__pool_size = pool_size
+        self.__sessions = dict()  # ("schema://hôte:port", idempotent) -> requests.Session
+        self.__lock = threading.Lock()
+        self.__stats = dict()  # "METHODE hôte/chemin" -> compteurs et histogramme
+
+    def request(self, method: str, url: str, idempotent=True, **kwargs) -> requests.Response:
+        """ Envoie une requête via la session de l'hôte
+
+            :param method: méthode HTTP
+            :param url: URL complète
+            :param idempotent: False si la requête a un effet à chaque réception (SMS, appel...) :
+             elle n'est réessayée que si la connexion n'a pas pu être établie
+            :param kwargs: arguments de requests (params, data, headers, timeout...)
+            :return: la réponse (les statuts d'erreur ne lèvent pas d'exception)
+            :raise requests.RequestException: si l'hôte reste injoignable après les réessais
+        """
+        kwargs.setdefault("timeout", self.__timeout)
+        parts = urlsplit(url)
+        endpoint = f"{method.upper()} {parts.netloc}{parts.path}"
+        session = self.__session(f"{parts.scheme}://{parts.netloc}", idempotent)
+        start = time.monotonic()
+        failed = True
+        try:
+            response = session.request(method, url, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        except requests.RequestException as error:
+            logging.error(f"HTTP --> {endpoint} en échec: {error}")
+            raise
+        finally:
+            self.__record(endpoint, time.monotonic() - start, failed)
+
+    def get(self, url: str, idempotent=True, **kwargs) -> requests.Response:
+        return self.request("GET", url, idempotent=idempotent, **kwargs)
+
+    def post(self, url: str, idempotent=True, **kwargs) -> requests.Response:
+        return self.request("POST", url, idempotent=idempotent, **kwargs)
+
+    @property
+    def stats(self) -> dict:
+        """ Métriques par point d'accès
+
+            :return: {"METHODE hôte/chemin": nombre d'appels, erreurs, latence moyenne/max (s),
+             histogramme cumulé {borne: nombre d'appels <= borne}}
+            :rtype: dict
+        """
+        with self.__lock:
+            stats = {endpoint: dict(values, histogram=list(values["histogram"]))
+                     for endpoint, values in self.__stats.items()}
+        for values in stats.values():
+            values["avg"] = values["total"] / values["count"] if values["count"] else 0.0
+            values["histogram"] = dict(zip((*self.LATENCY_BUCKETS, "inf"), values["histogram"]))
+        return stats
+
+    def close(self):
+        """ Ferme toutes les sessions (les prochains appels en recréeront) """
+        with self.__lock:
+            sessions, self.__sessions = self.__sessions, dict()
+        for session in sessions.values():
+            session.close()
+
+    def __session(self, origin: str, idempotent: bool) -> requests.Session:
+        with self.__lock:
+            session = self.__sessions.get((origin, idempotent))
+            if session is None:
+                retry = Retry(total=self.__retries, backoff_factor=self.__backoff,
+                              status_forcelist=self.RETRY_STATUS, raise_on_status=False)
+                if not idempotent:
+                    # la requête a pu être reçue :
+                    # pas de nouvel envoi sur timeout de lecture ni sur statut
+                    retry = Retry(total=self.__retries, read=0, status=0,
+                                  backoff_factor=self.__backoff, raise_on_status=False)
+                adapter = HTTPAdapter(pool_maxsize=self.__pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.__sessions[(origin, idempotent)] = session
+            return session
+
+    def __record(self, endpoint: str, latency: float, failed: bool):
+        with self.__lock:
+            values = self.__stats.get(endpoint)
+            if values is None:
+                values = {"count": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                          "histogram": [0] * (len(self.LATENCY_BUCKETS) + 1)}
+                self.__stats[endpoint] = values
+            values["count"] += 1
+            values["errors"] += int(failed)
+            values["total"] += latency
+            values["max"] = max(values["max"], latency)
+            # histogramme cumulé :
+            # l'appel compte dans toutes les classes dont la borne est >= latence
+            for ii, bound in enumerate(self.LATENCY_BUCKETS):
+                if latency <= bound:
+                    values["histogram"][ii] += 1
+            values["histogram"][-1] += 1
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """ Le client partagé du processus, créé au premier appel """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+
+def set_client(client: HttpClient):
+    """ Remplace le client partagé
+
+        (ex. client pointant vers un faux serveur local pour les tests)
+    """
+    global _client
+    with _client_lock:
+        _client = client
@@ -1,235 +1,189 @@
-import statistics
+import numpy as np
 
 
 class FeatureExtractor:
+    """
+    Calcul des 13 caractéristiques de chute sur des fenêtres d'accélération (norme en g).
+    Chaque appel est indépendant : pics et vallées sont recalculés pour chaque fenêtre.
+    """
+    FEATURES = ["AAMV", "ImpDuration", "ImpPeakValue", "ImpPeakDur", "LongValleyVal",
+                "LongValleyDur", "PeaksPriorImp", "ValleysPriorImp", "STDevAfterImp",
+                "AreaPeakDur", "StepCounterBI", "PrevValleyVal", "PrevValleyDur"]
+    # détection des pas : vallée < 1g sur 4 échantillons
+    # suivie d'un pic >= 1.6g dans les 6 suivants
+    STEP_VALLEY = 1.0
+    STEP_PEAK = 1.6
+    NO_VALLEY = (0.0, -9999)
 
     def __init__(self, lmt, umt, it, fs):
         self.__it = it
         self.__umt = umt
         self.__lmt = lmt
         self.__freq = fs
-        self.__peaks = []
-        self.__valleys = []
-        self.__myAcc = []
 
     def getFeaturesOnString(self, acc: []) -> str:
         my_features = self.getFeatures(acc)
         out = ""
-        out += "AAMV              = " + str(my_features[0]) + "\n"
-        out += "ImpDuration       = " + str(my_features[1]) + "\n"
-        out += "ImpPeakValue      = " + str(my_features[2]) + "\n"
-        out += "ImpPeakDur        = " + str(my_features[3]) + "\n"
-        out += "LongValleyVal     = " + str(my_features[4]) + "\n"
-        out += "LongValleyDur     = " + str(my_features[5]) + "\n"
-        out += "PeaksPriorImp     = " + str(my_features[6]) + "\n"
-        out += "ValleysPriorImp   = " + str(my_features[7]) + "\n"
-        out += "STDevAfterImp     = " + str(my_features[8]) + "\n"
-        out += "AreaPeakDur       = " + str(my_features[9]) + "\n"
-        out += "StepCounterBI     = " + str(my_features[10]) + "\n"
-        out += "PrevValleyVal     = " + str(my_features[11]) + "\n"
-        out += "PrevValleyDur     = " + str(my_features[12]) + "\n"
+        for name, value in zip(self.FEATURES, my_features):
+            out += f"{name:<18}= {value}\n"
         return out
 
     def getFeatures(self, acc: []) -> []:
-        self.__myAcc = acc
-        self.__peaksIndexes()
-        self.__valleysIndexes()
-
-        features = []
-        features.append(self.__getAverageAccVar())
-        features.append(self.__getImpactDuration())
-        features.append(self.__getImpactPeakValue())
-        features.append(self.__getImpactPeakDuration())
-        tmp = self.__getLongestValeeyValueAndDuration()
-        features.append(tmp[0])
-        features.append(tmp[1])
-        features.append(len(self.__peaks) - 1)
-        features.append(len(self.__valleys))
-        features.append(self.__getSTD_ATI())
-        features.append(self.__getArea())
-        features.append(self.__getStepIndex())
-        tmp = self.__getPrevValleyValueAndDuration()
-        features.append(tmp[0])
-        features.append(tmp[1])
+        return self.getFeaturesBatch(np.asarray(acc, dtype=np.float64)[np.newaxis, :])[0].tolist()
+
+    def getFeaturesBatch(self, accs) -> np.ndarray:
+        """
+        Calcule les caractéristiques de N fenêtres de même longueur
+        :param accs: tableau (N, window) des normes d'accélération
+        :return: tableau (N, 13) dans l'ordre de FEATURES, NaN pour les fenêtres sans pic d'impact
+        """
+        acc = np.atleast_2d(np.asarray(accs, dtype=np.float64))
+        features = np.full((acc.shape[0], len(self.FEATURES)), np.nan)
+        # un pic est un passage au dessus du seuil d'impact
+        # (le premier échantillon n'est pas évalué)
+        above_it = acc > self.__it
+        above_it[:, 0] = False
+        peak_starts = above_it & ~self.__shifted(above_it)
+        n_peaks = peak_starts.sum(axis=1)
+        has_peak = n_peaks > 0
+        if has_peak.any():
+            features[has_peak] = self.__computeFeatures(acc[has_peak], above_it[has_peak],
+                                                        peak_starts[has_peak], n_peaks[has_peak])
+        return features
 
+    @staticmethod
+    def __shifted(mask: np.ndarray) -> np.ndarray:
+        # mask décalé d'un échantillon vers la droite
+        return np.concatenate((np.zeros((mask.shape[0], 1), dtype=bool), mask[:, :-1]), axis=1)
+
+    @staticmethod
+    def __windowSum(cumsum: np.ndarray, rows: np.ndarray, ini: np.ndarray,
+                    end: np.ndarray) -> np.ndarray:
+        # somme des échantillons [ini, end[ à partir de la somme cumulée
+        # (fenêtre tronquée aux bords)
+        width = cumsum.shape[1] - 1
+        ini = np.clip(ini, 0, width)
+        end = np.maximum(np.clip(end, 0, width), ini)
+        return cumsum[rows, end] - cumsum[rows, ini]
+
+    def __computeFeatures(self, acc, above_it, peak_starts, n_peaks) -> np.ndarray:
+        n_win, width = acc.shape
+        rows = np.arange(n_win)
+        idx = np.arange(width)[np.newaxis, :]
+        half_win = int(self.__freq // 2)
+
+        # pic d'impact : maximum du dernier passage au dessus du seuil
+        last_start = np.where(peak_starts, idx, -1).max(axis=1)
+        peak = np.where(above_it & (idx >= last_start[:, None]), acc, -np.inf).argmax(axis=1)
+        before_peak = idx < peak[:, None]
+        after_peak = idx > peak[:, None]
+
+        below_it = acc < self.__it
+        last_below = np.where(below_it & before_peak, idx, -1).max(axis=1)
+        ini_impact = np.where(last_below >= 0, last_below + 1, peak - 1)
+        out_bounds = (acc < self.__lmt) | (acc > self.__umt)
+        last_out = np.where(out_bounds & after_peak, idx, -1).max(axis=1)
+        end_impact = np.where(last_out >= 0, last_out, peak + 1)
+        first_below = np.where(below_it & after_peak, idx, width).min(axis=1)
+        end_peak = np.where(first_below < width, first_below - 1, peak + 1)
+
+        # AAMV et aire sur une seconde centrée sur l'impact
+        center = (ini_impact + end_impact) // 2
+        variations = np.abs(np.diff(acc, axis=1))
+        cum_var = np.concatenate((np.zeros((n_win, 1)), np.cumsum(variations, axis=1)), axis=1)
+        aamv = self.__windowSum(cum_var, rows, center - half_win,
+                                center + half_win + 1) / self.__freq
+        cum_acc = np.concatenate((np.zeros((n_win, 1)), np.cumsum(acc, axis=1)), axis=1)
+        area = self.__windowSum(cum_acc, rows, center - half_win, center + half_win)
+
+        # écart-type (non biaisé) après l'impact
+        after_impact = idx >= end_impact[:, None]
+        count = after_impact.sum(axis=1)
+        mean = np.where(after_impact, acc, 0.0).sum(axis=1) / np.maximum(count, 1)
+        sq_dev = np.where(after_impact, (acc - mean[:, None]) ** 2, 0.0).sum(axis=1)
+        std_after = np.where(count > 1, np.sqrt(sq_dev / np.maximum(count - 1, 1)), np.nan)
+
+        features = np.empty((n_win, len(self.FEATURES)))
+        features[:, 0] = aamv
+        features[:, 1] = (end_impact - ini_impact + 1) / self.__freq * 1000.
+        features[:, 2] = acc[rows, peak]
+        features[:, 3] = (end_peak - ini_impact + 1) / self.__freq * 1000.
+        features[:, 6] = n_peaks - 1
+        features[:, 8] = std_after
+        features[:, 9] = area
+        features[:, 10] = self.__stepsBeforeImpact(acc, ini_impact)
+        features[:, [7, 4, 5, 11, 12]] = self.__valleysBeforeImpact(acc, before_peak)
         return features
 
-    def __getStepIndex(self) -> int:
-        # evaluation from window start to iniImpac - 200ms
-        # freq is 50Hz (20ms) so 10 samples
-        step_counter_index = 0
-        index_ini_impact = self.__getIndexIniImpact()
-        last_step = -999
-        for ii in range(index_ini_impact - 10):
-            is_valley = True
-            for jj in range(ii, ii + 4):
-                if self.__myAcc[jj] >= 1:
-                    is_valley = False
-                    break
-            is_peak = False
-            for jj in range(ii + 4, ii + 10):
-                if self.__myAcc[jj] >= 1.6:
-                    is_peak = True
-                    break
-            if is_peak and is_valley and ii > last_step + 10:
-                step_counter_index += 1
-                last_step = ii
-        return step_counter_index
-
-    def __getSTD_ATI(self) -> float:
-        ini_eval = self.__getIndexEndImpact()
-        tmp = []
-        for ii in range(ini_eval, len(self.__myAcc)):
-            tmp.append(self.__myAcc[ii])
-        return statistics.stdev(tmp)
-
-    def __getSTD_BFI(self) -> float:
-        ini_eval = self.__getIndexEndImpact()
-        tmp = []
-        for ii in range(ini_eval):
-            tmp.append(self.__myAcc[ii])
-        return statistics.stdev(tmp)
-
-    def __getArea(self) -> float:
-        peak_center = (self.__getIndexIniImpact() + self.__getIndexEndImpact()) // 2
-        ini_win = peak_center - int(self.__freq // 2)
-        end_win = peak_center + int(self.__freq // 2)
-
-        area = 0.0
-        for ii in range(ini_win, end_win):
-            area += self.__myAcc[ii]
-        return area
-
-    def __getIndexIniImpact(self) -> int:
-        peak_index = self.__peaks[-1]
-        index = peak_index - 1
-        ii_range = range(peak_index - 1, -1, -1)
-        for ii in ii_range:
-            if self.__myAcc[ii] < self.__it:
-                index = ii + 1
-                break
-        return index
-
-    def __getIndexEndImpact(self) -> int:
-        peak_index = self.__peaks[-1]
-        index = peak_index + 1
-        ii_range = range(peak_index + 1, len(self.__myAcc))
-        for ii in ii_range:
-            if self.__myAcc[ii] < self.__lmt or self.__myAcc[ii] > self.__umt:
-                index = ii
-        return index
-
-    def __getAverageAccVar(self) -> float:
-        peak_center = (self.__getIndexIniImpact() + self.__getIndexEndImpact()) // 2
-        ini_win = peak_center - int(self.__freq // 2)
-        end_win = peak_center + int(self.__freq // 2)
-        aamv = 0.0
-        for ii in range(ini_win, end_win + 1):
-            aamv += abs(self.__myAcc[ii + 1] - self.__myAcc[ii])
-        return aamv / self.__freq
-
-    def __getImpactDuration(self):
-        return (self.__getIndexEndImpact() - self.__getIndexIniImpact() + 1) / self.__freq * 1000.
-
-    def __peaksIndexes_orig(self):
-        for ii in range(1, len(self.__myAcc)):
-            if (self.__myAcc[ii] > self.__it and
-                    self.__myAcc[ii - 1] < self.__myAcc[ii] and
-                    self.__myAcc[ii + 1] < self.__myAcc[ii]):
-                self.__peaks.append(ii)
-
-    def __peaksIndexes(self):
-        ii = 1
-        while ii < len(self.__myAcc):
-            max_val = -999.9
-            peak_index = -1
-            while self.__myAcc[ii] > self.__it:
-                if self.__myAcc[ii] > max_val:
-                    max_val = self.__myAcc[ii]
-                    peak_index = ii
-                ii = ii + 1
-                if ii == len(self.__myAcc):
-                    break
-            if peak_index >= 0:
-                self.__peaks.append(peak_index)
-            ii = ii + 1
-
-    def __valleysIndexes(self):
-        peak_index = self.__peaks[-1]
-        ii = peak_index - 1
-        while ii >= 0:
-            # for ii in range(peak_index-1, -1, -1):
-            min_val = 999.9
-            valley_index = -1
-            while self.__myAcc[ii] < self.__lmt:
-                if self.__myAcc[ii] < min_val:
-                    min_val = self.__myAcc[ii]
-                    valley_index = ii
-                ii = ii - 1
-                if ii == 0:
-                    break
-            if valley_index >= 0:
-                self.__valleys.append(valley_index)
-            ii = ii - 1
-
-    def __getImpactPeakValue(self) -> float:
-        peak_index = self.__peaks[-1]
-        return self.__myAcc[peak_index]
-
-    def __getImpactPeakDuration(self) -> float:
-        peak_index = self.__peaks[-1] - 1
-        ini = peak_index
-        for ii in range(peak_index, -1, -1):
-            if self.__myAcc[ii] < self.__it:
-                ini = ii + 1
-                break
-
-        peak_index = self.__peaks[-1] + 1
-        end = peak_index
-        for jj in range(peak_index, len(self.__myAcc)):
-            if self.__myAcc[jj] < self.__it:
-                end = jj - 1
-                break
-        return (end - ini + 1) / self.__freq * 1000
-
-    def __getPrevValleyValueAndDuration(self) -> []:
-        prevValley = [0.0, -9999]
-        currentValleyIndex = self.__valleys[-1]
-        ini = currentValleyIndex - 1
-        for ii in range(currentValleyIndex - 1, -1, -1):
-            if self.__myAcc[ii] > self.__lmt:
-                ini = ii + 1
-                break
-        end = currentValleyIndex + 1
-        for jj in range(currentValleyIndex + 1, len(self.__myAcc)):
-            if self.__myAcc[jj] > self.__lmt:
-                end = jj - 1
-                break
-
-        currenValleyDuration = (end - ini + 1) / self.__freq * 1000.
-        if currenValleyDuration > prevValley[1]:
-            prevValley[0] = self.__myAcc[currentValleyIndex]
-            prevValley[1] = currenValleyDuration
-        return prevValley
-
-    def __getLongestValeeyValueAndDuration(self) -> []:
-        longestValley = [0.0, -9999]
-        for vv in range(0, len(self.__valleys)):
-            currentValleyIndex = self.__valleys[vv]
-            ini = currentValleyIndex - 1
-            for ii in range(currentValleyIndex - 1, -1, -1):
-                if self.__myAcc[ii] > self.__lmt:
-                    ini = ii + 1
-                    break
-            end = currentValleyIndex + 1
-            for jj in range(currentValleyIndex + 1, len(self.__myAcc)):
-                if self.__myAcc[jj] > self.__lmt:
-                    end = jj - 1
-                    break
-
-            currenValleyDuration = (end - ini + 1) / self.__freq * 1000.
-            if currenValleyDuration > longestValley[1]:
-                longestValley[0] = self.__myAcc[currentValleyIndex]
-                longestValley[1] = currenValleyDuration
-
-        return longestValley
+    def __stepsBeforeImpact(self, acc: np.ndarray, ini_impact: np.ndarray) -> np.ndarray:
+        # évaluation du début de fenêtre jusqu'à l'impact - 200ms (10 échantillons à 50Hz)
+        n_win, width = acc.shape
+        steps = np.zeros(n_win)
+        if width < 10:
+            return steps
+        zeros = np.zeros((n_win, 1))
+        cum_low = np.concatenate((zeros, np.cumsum(acc < self.STEP_VALLEY, axis=1)), axis=1)
+        cum_high = np.concatenate((zeros, np.cumsum(acc >= self.STEP_PEAK, axis=1)), axis=1)
+        start = np.arange(width - 9)
+        is_valley = cum_low[:, start + 4] - cum_low[:, start] == 4
+        is_peak = cum_high[:, start + 10] - cum_high[:, start + 4] > 0
+        candidates = is_valley & is_peak & (start[np.newaxis, :] < (ini_impact - 10)[:, None])
+        # un pas n'est compté qu'à plus de 10 échantillons du précédent
+        last_step = np.full(n_win, -999)
+        for row, ii in zip(*np.nonzero(candidates)):
+            if ii > last_step[row] + 10:
+                steps[row] += 1
+                last_step[row] = ii
+        return steps
+
+    def __valleysBeforeImpact(self, acc: np.ndarray, before_peak: np.ndarray) -> np.ndarray:
+        """
+        Vallées (passages sous lmt) avant le pic d'impact
+        :return: tableau (N, 5) nombre de vallées, valeur et durée de la plus longue,
+        valeur et durée de la première
+        """
+        n_win, width = acc.shape
+        idx = np.arange(width)[np.newaxis, :]
+        out = np.tile([0, *self.NO_VALLEY, *self.NO_VALLEY], (n_win, 1)).astype(np.float64)
+        below = (acc < self.__lmt) & before_peak & (idx >= 1)
+        # comme l'implémentation d'origine : l'échantillon 0 n'est une vallée que si
+        # l'échantillon 1 n'est pas sous lmt, et si elle n'est pas plus basse que les derniers
+        # échantillons de la fenêtre sous lmt (le parcours à rebours continuait aux index négatifs)
+        tail = np.logical_and.accumulate((acc < self.__lmt)[:, ::-1], axis=1)[:, ::-1]
+        tail_min = np.where(tail, acc, np.inf).min(axis=1)
+        below[:, 0] = (acc[:, 0] < self.__lmt) & ~below[:, 1] & (acc[:, 0] <= tail_min)
+        if not below.any():
+            return out
+
+        # minimum de chaque vallée (le plus tardif en cas d'égalité)
+        valley_starts = (below & ~self.__shifted(below)).ravel()
+        positions = np.flatnonzero(below)
+        labels = (np.cumsum(valley_starts) - 1)[positions]
+        order = np.lexsort((-positions, acc.ravel()[positions], labels))
+        first = np.concatenate(([True], labels[order][1:] != labels[order][:-1]))
+        valley_row, valley_idx = np.divmod(positions[order][first], width)
+        valley_val = acc[valley_row, valley_idx]
+
+        # durée de chaque vallée entre les derniers passages au dessus de lmt
+        above = acc > self.__lmt
+        last_above = np.maximum.accumulate(np.where(above, idx, -1), axis=1)
+        next_above = np.minimum.accumulate(np.where(above, idx, width)[:, ::-1], axis=1)[:, ::-1]
+        prev_above = np.where(valley_idx > 0,
+                              last_above[valley_row, np.maximum(valley_idx - 1, 0)], -1)
+        ini = np.where(prev_above >= 0, prev_above + 1, valley_idx - 1)
+        following = next_above[valley_row, valley_idx + 1]
+        end = np.where(following < width, following - 1, valley_idx + 1)
+        duration = (end - ini + 1) / self.__freq * 1000.
+
+        n_valleys = np.bincount(valley_row, minlength=n_win)
+        out[:, 0] = n_valleys
+        # vallées rangées par fenêtre puis par index : la première est la plus ancienne
+        first_valley = np.concatenate(([True], valley_row[1:] != valley_row[:-1]))
+        out[valley_row[first_valley], 3] = valley_val[first_valley]
+        out[valley_row[first_valley], 4] = duration[first_valley]
+        # la plus longue, la plus tardive en cas d'égalité
+        longest = np.lexsort((valley_idx, duration, valley_row))
+        last_valley = np.concatenate((valley_row[longest][1:] != valley_row[longest][:-1], [True]))
+        out[valley_row[longest][last_valley], 1] = valley_val[longest][last_valley]
+        out[valley_row[longest][last_valley], 2] = duration[longest][last_valley]
+        return out
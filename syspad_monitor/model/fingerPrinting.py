@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import json
+import logging
 
 from sklearn.neighbors import KNeighborsClassifier as kNN
 
@@ -21,32 +22,45 @@ class loc_fingerprinting:
             self.__networks = [z for (x,_,z) in list(dataset)[3:] if x in list_restricted_nets]
             features = np.asarray(dataset[list_restricted_nets])
 
-        self.__clf = kNN(n_neighbors=2)
+        # colonne de chaque réseau dans le vecteur de caractéristiques
+        # (première occurrence si doublon)
+        self.__columns = {}
+        for column, mac in enumerate(self.__networks):
+            self.__columns.setdefault(mac, column)
+
+        # index KD-tree construit une fois sur les empreintes de référence
+        self.__clf = kNN(n_neighbors=2, algorithm="kd_tree")
         self.__clf.fit(features, posIndex)
 
         with open(label_pos) as json_file:
             self.__labels = json.load(json_file)
 
-    def perform_loc(self, wifi_list:[]) -> {}:
-        # form of the wifi_list
-        # [{'bssid': '00:0b:6b:de:ea:36', 'frequency': '2437',
-        # 'signal level': '-37', 'flags': '[WPA-PSK-TKIP][WPA2-PSK-TKIP][ESS]',
-        # 'ssid': 'node14ap', 'distance': '0.858'},
-
-        # Current networks found in scan
-        # Must be of length and order of original networks in dataset
-        found_networks = [0]*len(self.__networks)
-        cells = wifi_list
-
-        for i in range(len(found_networks)): found_networks[i] = 100
-        for cell in cells:
-            mac = cell['bssid']
-            if mac not in self.__networks: continue
-            rssi = cell['signal level']
-            found_networks[self.__networks.index(mac)] = rssi
-
-        position = self.__clf.predict([found_networks])[0]
-        pos = self.__labels[str(position)]
-        print("Position: {}".format(position))
-        print(f"Label: {pos['Label']}")
-        return pos
+    def perform_loc(self, wifi_list) -> {}:
+        return self.perform_loc_many([wifi_list])[0]
+
+    def perform_loc_many(self, readings: []) -> []:
+        """
+        Localise plusieurs lectures wifi en un seul appel au classifieur
+        :param readings: lectures sous la forme {bssid: rssi} (DataCollector) ou
+        [{'bssid': '00:0b:6b:de:ea:36', 'signal level': '-37', ...}, ...]
+        :return: la position (label) de chaque lecture, None si la lecture est vide
+        """
+        # les réseaux non vus dans le scan restent à 100
+        found_networks = np.full((len(readings), len(self.__networks)), 100.)
+        for row, reading in enumerate(readings):
+            if isinstance(reading, dict):
+                cells = reading.items()
+            else:
+                cells = ((cell['bssid'], cell['signal level']) for cell in reading or [])
+            for mac, rssi in cells:
+                column = self.__columns.get(mac)
+                if column is not None:
+                    found_networks[row, column] = rssi
+
+        scanned = [row for row, reading in enumerate(readings) if reading]
+        positions = [None] * len(readings)
+        if scanned:
+            for row, position in zip(scanned, self.__clf.predict(found_networks[scanned])):
+                positions[row] = self.__labels[str(position)]
+                logging.debug(f"Position: {position} Label: {positions[row]['Label']}")
+        return positions
@@ -12,10 +12,12 @@ import logging
 from typing import Optional
 
 import arrow
+import numpy as np
 import pandas as pd
 import requests
 
 from syspad_monitor.database_encry import SysPadDb_encry
+from syspad_monitor.http_client import HttpClient, get_client
 
 
 class MyWithingsApi:
@@ -31,9 +33,11 @@ class MyWithingsApi:
 
     def __init__(self,
                  bd: SysPadDb_encry,
-                 withings_evt_url: str
+                 withings_evt_url: str,
+                 http: HttpClient = None
                  ):
         self.__bd = bd
+        self.__http = http or get_client()
         self.withings_evt_url = withings_evt_url
 
     def set_notify(self, access_token: str) -> bool:
@@ -55,7 +59,8 @@ class MyWithingsApi:
                 'comment': 'subscription'
             }
 
-            response = requests.post('https://wbsapi.withings.net/notify', headers=headers, data=data)
+            response = self.__http.post('https://wbsapi.withings.net/notify', headers=headers,
+                                        data=data)
             if response.status_code != requests.codes.ok:
                 logging.error(f"API--> WGS SERVER ERROR: {response.status_code} on {response.url}")
                 all_ok = False
@@ -88,7 +93,8 @@ class MyWithingsApi:
             'action': 'list',
             'appli': appli
         }
-        response = requests.post('https://wbsapi.withings.net/notify', headers=headers, data=data)
+        response = self.__http.post('https://wbsapi.withings.net/notify', headers=headers,
+                                    data=data)
         if response.status_code != requests.codes.ok:
             logging.error(f"API--> WGS SERVER ERROR: {response.status_code} on {response.url}")
             return False
@@ -122,7 +128,8 @@ class MyWithingsApi:
             'callbackurl': old_url,
             'appli': appli,
         }
-        response = requests.post('https://wbsapi.withings.net/notify', headers=headers, data=data)
+        response = self.__http.post('https://wbsapi.withings.net/notify', headers=headers,
+                                    data=data)
         if response.status_code != requests.codes.ok:
             logging.error(f"API--> WGS SERVER ERROR: {response.status_code} on {response.url}")
             return False
@@ -148,7 +155,7 @@ class MyWithingsApi:
             "client_secret": client_sec,
             "refresh_token": refresh_token,
         }
-        response = requests.post("https://wbsapi.withings.net/v2/oauth2", data=data)
+        response = self.__http.post("https://wbsapi.withings.net/v2/oauth2", data=data)
         if response.status_code != requests.codes.ok:
             logging.error(f"API--> WGS SERVER ERROR: {response.status_code}  on {response.url}")
             return
@@ -175,12 +182,14 @@ class MyWithingsApi:
         self.set_notify(access_token=access_token)
 
     @staticmethod
-    def get_sleep_allseries(access_token: str, startdate: arrow, enddate: arrow) -> Optional[pd.DataFrame]:
+    def get_sleep_allseries(access_token: str, startdate: arrow, enddate: arrow,
+                            http: HttpClient = None) -> Optional[pd.DataFrame]:
         """
         Cette fonction permet de recuperer les données de la nuit avec le tapis Sleep
         :param access_token:
         :param startdate:
         :param enddate:
+        :param http: client HTTP, le client partagé par défaut
         :return:
         """
         headers = {
@@ -189,14 +198,14 @@ class MyWithingsApi:
         params = dict(action="get", startdate=f"{startdate.int_timestamp}",
                       enddate=f"{enddate.int_timestamp}",
                       data_fields="hr,rr,snoring")
-        response = requests.get(
+        response = (http or get_client()).get(
             "https://wbsapi.withings.net/v2/sleep", headers=headers, params=params
         )
         if response.status_code != requests.codes.ok:
             logging.error(f"API--> WGS SERVER ERROR: {response.status_code}  on {response.url}")
             return None
         dict_str = response.content.decode("UTF-8")
-        mydata = ast.literal_eval(dict_str)
+        mydata = json.loads(dict_str)
         status = mydata.get("status")
         if status != 0:
             logging.error(f"ERROR WGS SLEEP-DATA GET: {dict_str}")
@@ -205,45 +214,59 @@ class MyWithingsApi:
         if len(mydata) < 1:
             logging.error(f"NO SLEEP-DATA for day {startdate}")
             return None
-        time_list = []
-        sleep_state_list = []
-        hr_list = []
-        rr_list = []
-        snoring_list = []
-        for ii in mydata:
-            start_time = ii["startdate"]
-            endd_time = ii["enddate"]
-            state = ii["state"]
-            hr = ii.get("hr")
-            rr = ii.get("rr")
-            snoring = ii.get("snoring")
-            for jj in range(start_time, endd_time, 60):
-                current_time = jj
-                time_list.append(current_time)
-                sleep_state_list.append(state)
-                hr_list.append(hr.get(f"{current_time}"))
-                rr_list.append(rr.get(f"{current_time}"))
-                snoring_list.append(snoring.get(f"{current_time}"))
-        sleep_data_frame = pd.DataFrame(
-            {
-                "Time": time_list,
-                "SleepState": sleep_state_list,
-                "HR": hr_list,
-                "RR": rr_list,
-                "SN": snoring_list,
-            }
-        )
-        # les donnes ranges par timeStamp
-        sleep_data_frame = sleep_data_frame.sort_values("Time").reset_index(drop=True)
-        return sleep_data_frame
+        return MyWithingsApi.build_sleep_series(mydata)
+
+    @staticmethod
+    def build_sleep_series(series: list) -> pd.DataFrame:
+        """
+        Construit la série minute par minute de la nuit à partir des segments Withings
+        (chaque segment est étendu de startdate à enddate par pas de 60s)
+        :param series: liste des segments {"startdate", "enddate", "state", "hr", "rr", "snoring"}
+        :return: DataFrame Time, SleepState, HR, RR, SN rangé par Time
+         (NaN si la mesure est absente)
+        """
+        n_segments = len(series)
+        starts = np.fromiter((seg["startdate"] for seg in series), dtype=np.int64,
+                             count=n_segments)
+        ends = np.fromiter((seg["enddate"] for seg in series), dtype=np.int64, count=n_segments)
+        states = np.fromiter((seg["state"] for seg in series), dtype=np.int64, count=n_segments)
+        # autant de minutes que range(startdate, enddate, 60)
+        lengths = np.maximum(0, (ends - starts + 59) // 60)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        total = int(lengths.sum())
+
+        rows = np.arange(total) - np.repeat(offsets, lengths)
+        time_array = np.repeat(starts, lengths) + 60 * rows
+        columns = {"Time": time_array, "SleepState": np.repeat(states, lengths)}
+
+        # alignement des mesures sur la grille minute de leur segment
+        for name, field in (("HR", "hr"), ("RR", "rr"), ("SN", "snoring")):
+            values = np.full(total, np.nan)
+            for seg, start, length, offset in zip(series, starts, lengths, offsets):
+                measures = seg.get(field)
+                if not measures:
+                    continue
+                stamps = np.fromiter(measures.keys(), dtype=np.int64, count=len(measures)) - start
+                vals = np.fromiter(measures.values(), dtype=np.float64, count=len(measures))
+                keep = (stamps >= 0) & (stamps % 60 == 0) & (stamps < 60 * length)
+                values[offset + stamps[keep] // 60] = vals[keep]
+            columns[name] = values
+
+        # les segments sont normalement déjà dans l'ordre, le tri n'est fait que si nécessaire
+        if total > 1 and np.any(np.diff(time_array) < 0):
+            order = np.argsort(time_array, kind="stable")
+            columns = {name: column[order] for name, column in columns.items()}
+        return pd.DataFrame(columns)
 
     @staticmethod
-    def get_sleep_summary(access_token: str, startdate: arrow, enddate: arrow) -> Optional[dict]:
+    def get_sleep_summary(access_token: str, startdate: arrow, enddate: arrow,
+                          http: HttpClient = None) -> Optional[dict]:
         """
         Cette fonction permet de recuperer les données de la nuit avec le tapis Sleep
         :param access_token:
         :param startdate:
         :param enddate:
+        :param http: client HTTP, le client partagé par défaut
         :return:
         """
 
@@ -259,7 +282,7 @@ class MyWithingsApi:
 
         params = dict(action="getsummary", startdateymd=startdate.format('YYYY-MM-DD'),
                       enddateymd=enddate.format('YYYY-MM-DD'), data_fields=all_fields)
-        response = requests.get(
+        response = (http or get_client()).get(
             "https://wbsapi.withings.net/v2/sleep", headers=headers, params=params
         )
         if response.status_code != requests.codes.ok:
@@ -65,16 +65,102 @@ class Score:
     >>> print(score.data)
     """
 
+    # indicators of the previous days: key in data -> key in data_current_day
+    PREV_DAYS_INDICATORS = {'real_score_prev_days': 'score4today',
+                            'pred_score_prev_days': 'score4tomorrow',
+                            'trust_index_prev_days': 'trust_index',
+                            'filling_rate_prev_days': 'filling_rate'}
+
+    # version of the snapshot layout, to be increased when the history buffers change
+    SNAPSHOT_VERSION = 1
+
     def __init__(self, history_length=6, item_list=None):
         """
         :param history_length: length of the data history (default 6 last days)
         :param item_list: dictionary containing items, possible score, etc.
         """
         self.history_length = history_length
-        self.__data = self.get_empty_data()
+        self.__data = {'data_current_day': self.get_empty_data()['data_current_day']}
         if item_list is None:
             item_list = slurpGraph(items_path)
         self.item_list = item_list
+        self.__build_lookup_tables()
+        # previous days kept in ring buffers (days x items, items sorted by id),
+        # see __push_day and __history
+        n_items = self.get_number_of_items()
+        self.__values_history = np.zeros((history_length, n_items), dtype=self.__values_dtype)
+        self.__filled_history = np.zeros((history_length, n_items), dtype=bool)
+        self.__indicators_history = np.zeros((history_length, len(self.PREV_DAYS_INDICATORS)))
+        self.__head = 0  # next row to be written
+        self.__n_days = 0  # number of previous days in the buffers
+        self.__history_rows = np.arange(0)  # rows of the previous days, oldest first
+
+    def __build_lookup_tables(self, ):
+        """
+        Build the per-item lookup tables (id -> item, weight, possible values, ...)
+        used by the scoring methods.
+        They are built once from item_list and never modified afterwards
+        """
+        self.__item_ids = tuple(item['id'] for item in self.item_list)
+        self.__items = {item['id']: item for item in self.item_list}
+        self.__weights = {item['id']: item['weight'] for item in self.item_list}
+        self.__weight_coeff = sum(self.__weights.values())
+        self.__normalized_weights = {idx: weight / self.__weight_coeff
+                                     for idx, weight in self.__weights.items()}
+        self.__score_values = {item['id']: tuple(list(zip(*item['score']))[1])
+                               for item in self.item_list}
+        self.__possible_values = {idx: frozenset(values)
+                                  for idx, values in self.__score_values.items()}
+        self.__score_bounds = {idx: (min(values), max(values))
+                               for idx, values in self.__possible_values.items()}
+        # same tables as arrays, items sorted by id
+        sorted_ids = sorted(self.__item_ids)
+        self.__columns = {idx: col for col, idx in enumerate(sorted_ids)}
+        self.__values_dtype = np.result_type(*[np.array(values)
+                                               for values in self.__score_values.values()])
+        self.__weight_vector = np.array([self.__normalized_weights[idx] for idx in sorted_ids])
+        self.__min_vector = np.array([self.__score_bounds[idx][0] for idx in sorted_ids],
+                                     dtype=np.float64)
+        self.__range_vector = np.array([self.__score_bounds[idx][1] - self.__score_bounds[idx][0]
+                                        for idx in sorted_ids], dtype=np.float64)
+        # possible values padded with NaN (items x max number of values)
+        max_values = max(len(self.__score_values[idx]) for idx in sorted_ids)
+        self.__values_matrix = np.full((len(sorted_ids), max_values), np.nan)
+        for row, idx in enumerate(sorted_ids):
+            self.__values_matrix[row, :len(self.__score_values[idx])] = self.__score_values[idx]
+        # possible values in the order of get_set_of_possible_values_idx
+        # (same tie-breaking as impute_missing)
+        self.__nearest_matrix = np.full(self.__values_matrix.shape, np.nan)
+        for row, idx in enumerate(sorted_ids):
+            possible = list(self.__possible_values[idx])
+            self.__nearest_matrix[row, :len(possible)] = possible
+        self.__sorted_ids = tuple(sorted_ids)
+
+    def __history(self, buffer: np.ndarray) -> np.ndarray:
+        """
+        Return the rows of a history ring buffer ordered from the oldest to the latest day
+        """
+        return buffer[self.__history_rows]
+
+    def __push_day(self, ):
+        """
+        Write the current day in the history ring buffers, overwriting the oldest day when full
+        """
+        current = self.__data["data_current_day"]
+        self.__values_history[self.__head] = 0
+        self.__filled_history[self.__head] = False
+        if current['values']:
+            ids, values = zip(*current['values'])
+            self.__values_history[self.__head, [self.__columns[idx] for idx in ids]] = values
+        if current['filled']:
+            ids, filled = zip(*current['filled'])
+            self.__filled_history[self.__head, [self.__columns[idx] for idx in ids]] = filled
+        self.__indicators_history[self.__head] = [current[key]
+                                                  for key in self.PREV_DAYS_INDICATORS.values()]
+        self.__head = (self.__head + 1) % self.history_length
+        self.__n_days = min(self.__n_days + 1, self.history_length)
+        self.__history_rows = ((self.__head - self.__n_days + np.arange(self.__n_days))
+                               % self.history_length)
 
     def get_empty_data(self, ) -> dict:
         """
@@ -100,7 +186,7 @@ class Score:
         :return: number of items
         :rtype: int
         """
-        return len(self.item_list)
+        return len(self.__item_ids)
 
     def get_normalized_score(self, item_id: int, input_score: float) -> float:
         """
@@ -109,13 +195,14 @@ class Score:
         :param input_score: input value
         :return: normalized score [0,1]
         """
-        item = [it for it in self.item_list if it['id'] == item_id][0]
-        item_score_values = set(list(zip(*item['score']))[1])
+        item_score_values = self.__possible_values[item_id]
         if input_score in item_score_values:
-            return (input_score - min(item_score_values)) / (max(item_score_values) - min(item_score_values))
+            score_min, score_max = self.__score_bounds[item_id]
+            return (input_score - score_min) / (score_max - score_min)
         else:
             raise ValueError(
-                f"Input value for item {item_id} ({item['name']}) is {input_score} might be one of these: {item_score_values}")
+                f"Input value for item {item_id} ({self.__items[item_id]['name']}) is "
+                f"{input_score} might be one of these: {set(item_score_values)}")
 
     def get_weight(self, item_id: int) -> float:
         """
@@ -125,7 +212,7 @@ class Score:
         :return: unnormalized weights
         :rtype: float
         """
-        return [it['weight'] for it in self.item_list if it['id'] == item_id][0]
+        return self.__weights[item_id]
 
     def get_weight_coeff(self, ) -> float:
         """
@@ -133,7 +220,7 @@ class Score:
         :return: sum of unnormalized weights
         :rtype: weights
         """
-        return sum([it['weight'] for it in self.item_list])
+        return self.__weight_coeff
 
     def get_normalized_weight(self, item_id: int) -> list:
         """
@@ -143,7 +230,7 @@ class Score:
         :return:  normalized weights
         :rtype: list[float]
         """
-        return [it['weight'] for it in self.item_list if it['id'] == item_id][0] / self.get_weight_coeff()
+        return self.__normalized_weights[item_id]
 
     def generate_data_idx(self, idx) -> tuple:
         """
@@ -153,8 +240,7 @@ class Score:
         :return: couple of values: (id of the item, score as if was returns from a questionnaire)
         :rtype: (int, float)
         """
-        item = [item for item in self.item_list if item['id'] == idx][0]
-        return item['id'], np.random.choice(list(zip(*item['score']))[1], 1, p=item['prob'])[0]
+        return idx, np.random.choice(self.__score_values[idx], 1, p=self.__items[idx]['prob'])[0]
 
     def get_item_ids(self, ) -> list:
         """
@@ -162,7 +248,7 @@ class Score:
         :return: item ids
         :rtype: list[int]
         """
-        return [item['id'] for item in self.item_list]
+        return list(self.__item_ids)
 
     def generate_data(self, missing=True):
         """
@@ -185,7 +271,8 @@ class Score:
                 elif choice == 2:
                     pass  # Explicit code block to show that for choice == 2 we do not generate any data
             else:
-                L.append((item['id'], np.random.choice(list(zip(*item['score']))[1], 1, p=item['prob'])[0]))
+                value = np.random.choice(self.__score_values[item['id']], 1, p=item['prob'])[0]
+                L.append((item['id'], value))
         return L
 
     def generate_empty_data(self) -> []:
@@ -220,12 +307,12 @@ class Score:
             # the value is drawn from a (discrete) probability distribution
             return self.generate_data_idx(idx)[1]
         elif method.lower() == 'mean':  # should not be used directly since it returns non integer values
-            values_idx = self.get_value_history_idx(idx)
+            values_idx = self.__history(self.__values_history)[:, self.__columns[idx]]
             if len(values_idx) == 0:
                 print(f'Empty history for idx {idx}, generating data based on prior')
                 return self.impute_missing(idx, method='prob')
             else:
-                return np.mean(values_idx)
+                return values_idx.mean()
         elif method.lower() == 'mean_nearest':
             # compute the mean value and pick up the nearest possible value
             value_mean = self.impute_missing(idx, method='mean')
@@ -234,7 +321,7 @@ class Score:
             return possible_values[idx]
         elif method.lower() == 'mode':
             # compute the statistical mode of the historical data
-            values_idx = self.get_value_history_idx(idx)
+            values_idx = self.__history(self.__values_history)[:, self.__columns[idx]]
             if len(values_idx) == 0:
                 print(f'Empty history for idx {idx}, generating data based on prior')
                 return self.impute_missing(idx, method='prob')
@@ -256,23 +343,19 @@ class Score:
         """
         if imputed:
             # Don't filter out imputed data
-            data_prev_days = self.__data["data_prev_days"]
-            values = [d['values'] for d in data_prev_days]
-            values_idx = [val[1] for value in values for val in value if val[0] == idx]
+            values_idx = self.__history(self.__values_history)[:, self.__columns[idx]].tolist()
         else:
             print(f"Option imputed=False not yet implemented, falling back to imputed=True")
             values_idx = self.get_value_history_idx(idx, imputed=True)
         return values_idx
 
-    def get_set_of_possible_values_idx(self, idx: int) -> set:
+    def get_set_of_possible_values_idx(self, idx: int) -> frozenset:
         """
         return set of possible values (scores) for a given index
         :param idx: int
-        :return: set
+        :return: frozenset (shared lookup table, not to be modified)
         """
-        item = [it for it in self.item_list if it['id'] == idx][0]
-        item_score_values = list(zip(*item['score']))[1]
-        return set(item_score_values)
+        return self.__possible_values[idx]
 
     def compute_score(self, values: list) -> tuple:
         """
@@ -282,46 +365,178 @@ class Score:
         :return: values, filled, score, filling_rate
         :rtype: list[tuple[float]], list[int], float, float
         """
+        values, filled, filling_rate = self.__impute_values(values)
         score = 0
-        number_of_items = self.get_number_of_items()
-        filled = []
-        # Add missing entries
-        ids_to_be_added = set(self.get_item_ids()) - set(it[0] for it in values)
-        for idx in ids_to_be_added:
-            values.append((idx, None))
-        values.sort()  # not mandatory but help for debugging
-        # loop over all items, impute missing and compute score
-        for i, (idx, value) in enumerate(values):
-            if (value is None) or (value < 0):
-                value = self.impute_missing(idx)
-                values[i] = (idx, value)  # update data after imputation
-                filled.append((idx, 0))
-            else:
-                filled.append((idx, 1))
+        for idx, value in values:
             score += self.get_normalized_score(idx, value) * self.get_weight(idx)
         score = score / self.get_weight_coeff()
-        filling_rate = sum([it[1] for it in filled]) / number_of_items
         return values, filled, score, filling_rate
 
+    def __impute_values(self, values: list) -> tuple:
+        """
+        Add missing entries and impute missing values
+        :param values: list of couples (id, value)
+        :return: values, filled, filling_rate
+        """
+        return Score.__impute_many([self], [values])[0]
+
+    @staticmethod
+    def __impute_many(scores: list, raw_values: list) -> list:
+        """
+        Add missing entries and impute missing values of several scores (one per room) at once:
+        the 'mean_nearest' imputation of every missing item of every score is a single array
+        operation.
+        Scores without history fall back to impute_missing (value drawn from the prior).
+        All scores must share the same item_list.
+        :param scores: list of Score objects
+        :param raw_values: list of lists of couples (id, value), one per score
+        :return: list of (values, filled, filling_rate), one per score, values sorted by id
+        """
+        reference = scores[0]
+        columns = reference.__columns
+        sorted_ids = reference.__sorted_ids
+        number_of_items = len(sorted_ids)
+        given = [[None] * number_of_items for _ in scores]
+        for row, values in enumerate(raw_values):
+            for idx, value in values:
+                if value is not None and value >= 0:
+                    given[row][columns[idx]] = value
+        missing = np.array([[value is None for value in row] for row in given],
+                           dtype=bool).reshape(len(scores), -1)
+
+        # mean of the history of every item, for the scores having a history and missing values
+        rows = [row for row, score in enumerate(scores)
+                if score.__n_days > 0 and missing[row].any()]
+        imputed = np.zeros(missing.shape)
+        if rows:
+            means = np.stack([scores[row].__history(scores[row].__values_history).mean(axis=0)
+                              for row in rows])
+            distance = np.abs(reference.__nearest_matrix[np.newaxis] - means[:, :, np.newaxis])
+            choice = np.where(np.isnan(distance), np.inf, distance).argmin(axis=2)
+            imputed[rows] = reference.__nearest_matrix[np.arange(number_of_items), choice]
+        imputed = imputed.astype(reference.__values_dtype)
+
+        results = []
+        for row, score in enumerate(scores):
+            values, filled = [], []
+            for col, idx in enumerate(sorted_ids):
+                value = given[row][col]
+                if value is not None:
+                    filled.append((idx, 1))
+                elif score.__n_days > 0:
+                    value = imputed[row, col]
+                    filled.append((idx, 0))
+                else:
+                    value = score.impute_missing(idx)
+                    filled.append((idx, 0))
+                values.append((idx, value))
+            filling_rate = sum([it[1] for it in filled]) / number_of_items
+            results.append((values, filled, filling_rate))
+        return results
+
+    def __normalized_matrix(self, rows: list) -> np.ndarray:
+        """
+        Return normalized scores of several days as an array
+        :param rows: list of lists of couples (id, value) sorted by id and containing every item
+        :return: array (days x items) of normalized scores [0,1]
+        """
+        values = np.array([[value for _, value in row] for row in rows], dtype=np.float64)
+        allowed = (values[:, :, np.newaxis] == self.__values_matrix).any(axis=2)
+        if not allowed.all():
+            col = np.nonzero(~allowed)[1][0]
+            idx = sorted(self.__item_ids)[col]
+            raise ValueError(f"Input value for item {idx} ({self.__items[idx]['name']}) is "
+                             f"{values[:, col]} might be one of these: "
+                             f"{set(self.__possible_values[idx])}")
+        normalized = (values - self.__min_vector) / self.__range_vector
+        return normalized
+
+    @staticmethod
+    def trend_prediction(normalized: np.ndarray) -> np.ndarray:
+        """
+        Closed-form least-squares trend of arctanh(normalized score) over the days,
+        extrapolated to the next day (same as np.polyfit of degree 1 for every item)
+        :param normalized: array (... x days x items) of normalized scores
+        :return: array (... x items) of predicted normalized scores
+        """
+        score_atanh = np.arctanh(np.where(normalized == 1.0, normalized - 1e-6, normalized))
+        n_days = score_atanh.shape[-2]
+        days = np.arange(n_days, dtype=np.float64)
+        days_centered = (days - days.mean())[:, np.newaxis]
+        mean_atanh = score_atanh.mean(axis=-2)
+        slope = (days_centered * (score_atanh - mean_atanh[..., np.newaxis, :])).sum(axis=-2) \
+            / (days_centered ** 2).sum()
+        intercept = mean_atanh - slope * days.mean()
+        return np.tanh(intercept + slope * n_days)
+
+    @staticmethod
+    def update_many(scores: list, raw_values: list):
+        """
+        Update several scores (one per room) as ``update`` would do for each of them.
+        The imputation (see __impute_many), score4today, trust index and score4tomorrow
+        are computed for all scores at once.
+        All scores must share the same item_list.
+
+        :param scores: list of Score objects
+        :param raw_values: list of raw values, one per score
+        """
+        if not scores:
+            return
+        reference = scores[0]
+
+        raws = []
+        for score, raw in zip(scores, raw_values):
+            if not raw:  # case when empty list is passed as argument
+                raw = score.generate_empty_data()
+            score.__flush_current_day_v2()
+            raws.append(raw)
+        days_values = Score.__impute_many(scores, raws)
+        normalized = reference.__normalized_matrix([values for values, _, _ in days_values])
+        scores4today = normalized @ reference.__weight_vector
+        filling_rates = np.array([filling_rate for _, _, filling_rate in days_values])
+        trust_index_prev = np.array([np.sum(score.__history(score.__indicators_history)[:, -1])
+                                     if score.__n_days > 0 else 6 for score in scores])
+        history_lengths = np.array([score.history_length for score in scores])
+        trust_indexes = (filling_rates + trust_index_prev) / (history_lengths + 1)
+
+        # prediction on the history + current day, scores grouped by history length
+        scores4tomorrow = scores4today.copy()
+        by_length = {}
+        for row, score in enumerate(scores):
+            if score.__n_days > 0:
+                by_length.setdefault(score.__n_days, []).append(row)
+        for rows in by_length.values():
+            history = np.stack([np.vstack((scores[row].__normalized_values_history(),
+                                           normalized[row]))
+                                for row in rows])
+            scores4tomorrow[rows] = reference.trend_prediction(history) @ reference.__weight_vector
+
+        for row, score in enumerate(scores):
+            values, filled, filling_rate = days_values[row]
+            data_current_day = score.__data["data_current_day"]
+            data_current_day['values'] = values
+            data_current_day['filled'] = filled
+            data_current_day['filling_rate'] = filling_rate
+            data_current_day['score4today'] = float(scores4today[row])
+            data_current_day['trust_index'] = float(trust_indexes[row])
+            data_current_day['score4tomorrow'] = float(scores4tomorrow[row])
+
     def compute_prediction(self, data):
         """
-        Return predicted score
+        Return predicted score: trend of every item over the previous days and the current one,
+        weighted by the normalized weights
         :param data:
         :return: predicted score
         """
-        normalized_weights = []
-        predicted_score = 0
-        for i, (idx, value) in enumerate(data["data_current_day"]['values']):
-            d = self.get_value_history_idx(idx)
-            d.append(value)
-            normalized_score = [self.get_normalized_score(idx, v) for v in d]
-            normalized_score_trimmed = [n - 1e-6 if n == 1.0 else n for n in normalized_score]
-            score_atanh = np.arctanh(normalized_score_trimmed)
-            p = np.poly1d(np.polyfit(list(range(len(score_atanh))), score_atanh, 1))
-            predicted_normalized_value = np.tanh(p(len(score_atanh)))
-            normalized_weights.append(self.get_normalized_weight(idx))
-            predicted_score += predicted_normalized_value * self.get_normalized_weight(idx)
-        return predicted_score
+        normalized = np.vstack((self.__normalized_values_history(),
+                                self.__normalized_matrix([data["data_current_day"]['values']])))
+        return float(self.trend_prediction(normalized) @ self.__weight_vector)
+
+    def __normalized_values_history(self, ) -> np.ndarray:
+        """
+        Return normalized scores of the previous days (days x items)
+        """
+        return (self.__history(self.__values_history) - self.__min_vector) / self.__range_vector
 
     # def __set_values_current_day(self, ):  # might be useless
     #     self.__data["data_current_day"]['values'] = self.generate_data()
@@ -337,21 +552,21 @@ class Score:
         data["data_current_day"]['filled'] = filled
         data["data_current_day"]['filling_rate'] = filling_rate
         data["data_current_day"]['score4today'] = score
-        if len(data["trust_index_prev_days"]) == 0:
+        if self.__n_days == 0:
             if trust_mode=='geo':
                 trust_index_prev = 1
             else:
                 trust_index_prev = 6
         else:
             if trust_mode=='geo':
-                trust_index_prev = np.prod(data["filling_rate_prev_days"])
+                trust_index_prev = np.prod(self.__history(self.__indicators_history)[:, -1])
             else:
-                trust_index_prev = np.sum(data["filling_rate_prev_days"])
+                trust_index_prev = np.sum(self.__history(self.__indicators_history)[:, -1])
         if trust_mode=='geo':
             data["data_current_day"]['trust_index'] = filling_rate * trust_index_prev
         else:
             data["data_current_day"]['trust_index'] = (filling_rate + trust_index_prev) / (self.history_length + 1)
-        if len(data["real_score_prev_days"]) > 0:
+        if self.__n_days > 0:
             score4tomorrow = self.compute_prediction(data)  # prediction better at the end
         else:
             score4tomorrow = score  # might be set to None ?
@@ -363,12 +578,7 @@ class Score:
         """
         data = self.__data
         if data["data_current_day"]["filled"]:
-            data["data_prev_days"].append({"values": data["data_current_day"]['values'],
-                                           "filled": data["data_current_day"]["filled"]})
-            data["real_score_prev_days"].append(data["data_current_day"]["score4today"])
-            data["pred_score_prev_days"].append(data["data_current_day"]["score4tomorrow"])
-            data["trust_index_prev_days"].append(data["data_current_day"]["trust_index"])
-            data["filling_rate_prev_days"].append(data["data_current_day"]["filling_rate"])
+            self.__push_day()
             data["data_current_day"]['values'] = []
             data["data_current_day"]['filled'] = []
             data["data_current_day"]['filling_rate'] = []
@@ -391,12 +601,7 @@ class Score:
         """
         data = self.__data
         if all([bool(data["data_current_day"][it]) for it in data["data_current_day"]]):
-            data["data_prev_days"].append({"values": data["data_current_day"]['values'],
-                                           "filled": data["data_current_day"]["filled"]})
-            data["real_score_prev_days"].append(data["data_current_day"]["score4today"])
-            data["pred_score_prev_days"].append(data["data_current_day"]["score4tomorrow"])
-            data["trust_index_prev_days"].append(data["data_current_day"]["trust_index"])
-            data["filling_rate_prev_days"].append(data["data_current_day"]["filling_rate"])
+            self.__push_day()
             data["data_current_day"]['values'] = []
             data["data_current_day"]['filled'] = []
             data["data_current_day"]['filling_rate'] = []
@@ -431,24 +636,94 @@ class Score:
         self.__flush_current_day()
         self.__update_data_current_day(raw_values)
 
+    def to_snapshot(self, ) -> dict:
+        """
+        Return the state of the score (history buffers and current day)
+        as a JSON serializable dictionary
+        :return: snapshot, to be restored with ``Score.from_snapshot``
+        """
+        def to_python(value):
+            return value.item() if isinstance(value, np.generic) else value
+
+        current_day = {}
+        for key, value in self.__data['data_current_day'].items():
+            if isinstance(value, list):
+                value = [[to_python(it) for it in elem] if isinstance(elem, tuple)
+                         else to_python(elem)
+                         for elem in value]
+            current_day[key] = to_python(value)
+        return {'version': self.SNAPSHOT_VERSION,
+                'history_length': self.history_length,
+                'item_ids': sorted(self.__item_ids),
+                'values': self.__values_history.tolist(),
+                'filled': self.__filled_history.tolist(),
+                'indicators': self.__indicators_history.tolist(),
+                'head': self.__head,
+                'n_days': self.__n_days,
+                'data_current_day': current_day}
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict, item_list=None):
+        """
+        Restore a score saved with ``to_snapshot``
+        :param snapshot: snapshot dictionary
+        :param item_list: dictionary containing items, must have the same item ids as the snapshot
+        :return: Score
+        :raise ValueError: if the snapshot version or items do not match
+        """
+        if snapshot.get('version') != cls.SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot version {snapshot.get('version')} cannot be restored "
+                             f"(expected {cls.SNAPSHOT_VERSION})")
+        score = cls(history_length=snapshot['history_length'], item_list=item_list)
+        if snapshot['item_ids'] != sorted(score.get_item_ids()):
+            raise ValueError(f"Snapshot items {snapshot['item_ids']} differ from "
+                             f"{sorted(score.get_item_ids())}")
+        score.__values_history[:] = snapshot['values']
+        score.__filled_history[:] = snapshot['filled']
+        score.__indicators_history[:] = snapshot['indicators']
+        score.__head = snapshot['head']
+        score.__n_days = snapshot['n_days']
+        score.__history_rows = ((score.__head - score.__n_days + np.arange(score.__n_days))
+                                % score.history_length)
+        for key, value in snapshot['data_current_day'].items():
+            if key in ('values', 'filled'):
+                value = [tuple(elem) for elem in value]
+            score.__data['data_current_day'][key] = value
+        return score
+
     @property
     def score4today(self, ):
-        return self.data['data_current_day']['score4today']
+        return self.__data['data_current_day']['score4today']
 
     @property
     def score4tomorrow(self, ):
-        return self.data['data_current_day']['score4tomorrow']
+        return self.__data['data_current_day']['score4tomorrow']
 
     @property
     def trustIndex(self, ):
-        return self.data['data_current_day']['trust_index']
+        return self.__data['data_current_day']['trust_index']
 
     @property
     def fillingRate(self, ):
-        return self.data['data_current_day']['filling_rate']
+        return self.__data['data_current_day']['filling_rate']
 
     @property
     def data(self):
-        return self.__data
+        """
+        Current day and previous days (oldest first) with the layout of get_empty_data.
+        The previous days are rebuilt from the history buffers, modifying them has no effect.
+        """
+        data = {'data_current_day': self.__data['data_current_day']}
+        ids = sorted(self.__item_ids)
+        values_history = self.__history(self.__values_history).tolist()
+        filled_history = self.__history(self.__filled_history).astype(int).tolist()
+        data['data_prev_days'] = deque(({'values': list(zip(ids, values)),
+                                         'filled': list(zip(ids, filled))}
+                                        for values, filled in zip(values_history, filled_history)),
+                                       maxlen=self.history_length)
+        indicators = self.__history(self.__indicators_history)
+        for col, key in enumerate(self.PREV_DAYS_INDICATORS):
+            data[key] = deque(indicators[:, col].tolist(), maxlen=self.history_length)
+        return data
 
 
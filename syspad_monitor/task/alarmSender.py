@@ -1,35 +1,98 @@
+import functools
+import itertools
 import json
 import logging
+import queue
 import re
 import smtplib
+import threading
 import time
-import urllib.error
-import urllib.parse
-import urllib.request
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
 from email.message import EmailMessage
 from smtplib import SMTPException
 from threading import Thread
 from pyfcm import FCMNotification
 
-import arrow
+import numpy as np
 import requests
 
 from syspad_monitor.database_encry import SysPadDb_encry
+from syspad_monitor.http_client import HttpClient, get_client
 from syspad_monitor.task import AlarmConst
 
-class AlarmSender(Thread):
+
+class _PriorityExecutor:
+    """
+    Pool de threads dont la file d'attente est ordonnée par clé (la plus petite d'abord),
+    FIFO à clé égale
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        self.__queue = queue.PriorityQueue()
+        self.__seq = itertools.count()
+        for ii in range(max_workers):
+            Thread(target=self.__work, name=f"{thread_name_prefix}_{ii}", daemon=True).start()
+
+    def submit(self, key, fn) -> Future:
+        future = Future()
+        self.__queue.put((key, next(self.__seq), future, fn))
+        return future
+
+    def __work(self):
+        while True:
+            _, _, future, fn = self.__queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn())
+            except Exception as error:
+                future.set_exception(error)
+
+
+class AlarmSender:
     """
     Cette classe est chargée de surveiller la table d'alarmes
+
+    Chaque tour de notification d'une alarme (valeur de NbNotifications) est écrit dans la table
+    des envois (outbox), une ligne par canal. Les envois dus sont réservés en base (SKIP LOCKED),
+    plusieurs émetteurs peuvent donc tourner sans appel en double et un redémarrage
+    ne renvoie rien.
     """
-    # par défaut 5 secondes de sleep du Thread pour vérifier les Alarmes dans la BD
+    # période du job de lecture des Alarmes dans la BD : 5 secondes
     REFRESH_TIME = 5
+    # délai entre deux tours de notification d'une même alarme
     SENDING_TIMEOUT = 180
+    AFILNET_URL = "http://www.afilnet.com/api/http/"
+    # canaux d'envoi : nombre d'envois simultanés et timeout (connexion, lecture) en secondes,
+    # un appel vocal lent ne retarde ni les autres canaux ni les autres alarmes
+    CHANNELS = ("voix", "http", "firebase")
+    CHANNEL_WORKERS = {"voix": 4, "http": 2, "firebase": 2}
+    CHANNEL_TIMEOUT = {"voix": (5, 60), "http": (5, 10), "firebase": 10}
+    # un envoi réservé non terminé après CLAIM_LEASE secondes redevient dû (émetteur arrêté)
+    CLAIM_LEASE = 300
+    # nouvel essai d'un envoi en échec après RETRY_DELAY * 2^(essais-1) secondes (au plus
+    # MAX_RETRY_DELAY), abandon après MAX_ATTEMPTS essais, MAX_ATTEMPTS_HIGH pour une alarme
+    # HIGH ; un tour est consommé dès qu'un canal a réussi, il est retenté SENDING_TIMEOUT
+    # secondes plus tard si aucun n'a réussi
+    RETRY_DELAY = 15
+    MAX_RETRY_DELAY = 60
+    MAX_ATTEMPTS = 5
+    MAX_ATTEMPTS_HIGH = 10
+    # délais création -> envoi gardés par niveau de priorité pour les p50/p99
+    LATENCY_SAMPLES = 1000
+    # lecture incrémentale des alarmes : recouvrement (s) sur la date de création,
+    # relecture complète toutes les FULL_READ_PERIOD secondes
+    # (compteurs modifiés hors de l'émetteur)
+    READ_OVERLAP = 60
+    FULL_READ_PERIOD = 300
 
-    def __init__(self, bd: SysPadDb_encry, params_mail: dict, params_sms: dict, time_out: int, xmessages=1, serv_url=None, firebase=None):
+    def __init__(self, bd: SysPadDb_encry, params_mail: dict, params_sms: dict, time_out: int,
+                 xmessages=1, serv_url=None, firebase=None, http: HttpClient = None):
         self.__bd = bd
+        self.__http = http or get_client()
         self.__thread_name = f"alarm_sender"
-        Thread.__init__(self, name=self.__thread_name, target=self.run)
-        self.__lastSending = dict()
         self.SENDING_TIMEOUT = int(time_out)
         self.__host = params_mail["host"]
         self.__port = params_mail["port"]
@@ -40,62 +103,206 @@ class AlarmSender(Thread):
         self.__serverURL = serv_url
         self.__xm = int(xmessages)
         self.__fb = firebase
+        # client FireBase créé une seule fois (None si pas de clé)
+        self.__push_service = None
+        if firebase and firebase.get("key"):
+            self.__push_service = FCMNotification(api_key=firebase["key"])
+        self.__senders = {"voix": self.__send_voice, "http": self.__send_http_post,
+                          "firebase": self.__sendAndroidNotify}
+        # files d'attente par canal ordonnées par priorité puis date de création
+        self.__pools = {channel: _PriorityExecutor(max_workers=self.CHANNEL_WORKERS[channel],
+                                                   thread_name_prefix=f"alarm_{channel}")
+                        for channel in self.CHANNELS}
+        self.__lock = threading.Lock()
+        self.__busy = {channel: 0 for channel in self.CHANNELS} # envois réservés non terminés
+        self.__stats = {channel: {"sent": 0, "failed": 0, "abandoned": 0,
+                                  "latency_total": 0.0, "latency_max": 0.0}
+                        for channel in self.CHANNELS}
+        self.__latencies = {level.name: deque(maxlen=self.LATENCY_SAMPLES) for level in AlarmConst}
+        self.__lastAlarmId = 0 # plus grand Id d'alarme lu
+        self.__lastFullRead = None
+        self.__bd.create_alarm_outbox()
 
-    def run(self):
-        logging.info(f"Démarrage de la tache de surveillance des alarmes dans la BD")
-        while True:
-            # JSON retourné donc c'est un dict sur toutes les alarmes où le counter > 0
-            alarm_list = self.__bd.read_alarms()
-            now = arrow.now().int_timestamp
-            for alarm in alarm_list:
-                #               0    1       2        3            4            5         6      7
-                #  liste avec (Id, NbNotis, Chambre, NumCh, Description, Creation, Priorite, Appel)
-                alarm_id = alarm["Id"]
-                counts = alarm["NbNotifications"]
-
-                if (str(alarm_id) not in self.__lastSending
-                        or now > self.__lastSending[f"{alarm_id}"] + self.SENDING_TIMEOUT):
-                    self.__lastSending[str(alarm_id)] = now
-
-                    # send SMS in case telephone is defined
-                    phone_exp = r"^(33)[1-9][0-9]{8}$"
-
-                    # send Voice Alarm in case telephone is defined
-                    if alarm["Appel"] and re.search(phone_exp, alarm["Appel"]) and alarm["Priorite"] >= AlarmConst.HIGH.value: # Alarm.HIGH.value = 85 so 75 is enought
-                        my_message = alarm["Description"] + f" résident chambre {alarm['NumCh']}"
-                        voix_ok = self.__send_voice(tel_num=alarm["Appel"], message=my_message)
-                    else:
-                        voix_ok = True
-
-                    # send to HTTP Alarm server if present (NOT USED BY THE MOMENT)
-                    if self.__serverURL:
-                        http_ok = self.__send_http_post(room=alarm[2],
-                                                        alarm_date=alarm[6],
-                                                        message=alarm[3],
-                                                        priority=alarm[7])
-                    else:
-                        http_ok = True
-
-                    # sent to Firebase for Android App notification if defined
-                    # if self.__fb and self.__fb["topic"] and self.__fb["key"]:
-                    if self.__fb and (self.__fb['topic'] or alarm["CanalNotif"]) and self.__fb["key"]:
-                        firebase_ok = self.__sendAndroidNotify(priority=alarm["Priorite"], user_topic=alarm["CanalNotif"])
-                    else:
-                        firebase_ok = True
-
-                    # decrement counter, a l'avenir il faudra avoir un compteur par type d'envoi
-                    if http_ok or voix_ok or firebase_ok:
-                        self.__bd.set_alarm_counter(alarm_id, counts - 1)
-                        if counts - 1 == 0:
-                            del self.__lastSending[f"{alarm_id}"]
-            time.sleep(self.REFRESH_TIME)
+    def poll(self):
+        """ Un passage de lecture des nouvelles alarmes
+            et de réservation des envois dus par canal
+        """
+        # les alarmes dont tous les envois du tour courant sont terminés passent au tour suivant
+        advanced = self.__bd.advance_alarm_rounds(resend_delay=self.SENDING_TIMEOUT)
+        advanced = [alarm for alarm in advanced if alarm["NbNotifications"] > 0]
+        self.__enqueue(self.__readNewAlarms() + advanced)
+        for channel in self.CHANNELS:
+            self.__claim(channel)
+
+    @property
+    def stats(self) -> dict:
+        """ Métriques d'envoi
+
+            :return: {"channels": {canal: envois réussis, échoués, abandonnés,
+             latence totale/max (s)}, "priorities": {niveau: nombre, p50 et p99 (s) du délai
+             entre la création de l'alarme et son premier envoi}}
+            :rtype: dict
+        """
+        with self.__lock:
+            channels = {channel: dict(values) for channel, values in self.__stats.items()}
+            latencies = {level: np.array(values) for level, values in self.__latencies.items()}
+        priorities = dict()
+        for level, values in latencies.items():
+            priorities[level] = {"count": len(values), "p50": None, "p99": None}
+            if len(values):
+                p50, p99 = np.percentile(values, [50, 99]).tolist()
+                priorities[level]["p50"], priorities[level]["p99"] = p50, p99
+        return {"channels": channels, "priorities": priorities}
+
+    @staticmethod
+    def __level(priority: int) -> AlarmConst:
+        if priority > 75:
+            return AlarmConst.HIGH
+        if priority > 50:
+            return AlarmConst.MEDIUM
+        if priority > 25:
+            return AlarmConst.LOW
+        return AlarmConst.INFO
+
+    def __max_attempts(self, priority: int) -> int:
+        if self.__level(priority) is AlarmConst.HIGH:
+            return self.MAX_ATTEMPTS_HIGH
+        return self.MAX_ATTEMPTS
+
+    @staticmethod
+    def __priorityKey(row) -> tuple:
+        creation = row["Creation"]
+        return -row["Priorite"], creation.timestamp() if isinstance(creation, datetime) else 0.0
+
+    def __readNewAlarms(self) -> list:
+        """ Alarmes créées depuis la dernière lecture,
+            toutes les alarmes en cours à chaque relecture complète
+        """
+        last_full = self.__lastFullRead
+        if last_full is None or time.monotonic() - last_full > self.FULL_READ_PERIOD:
+            self.__lastFullRead = time.monotonic()
+            last_id = 0
+        else:
+            last_id = self.__lastAlarmId
+        alarms = list(self.__bd.read_alarms_since(last_id=last_id, overlap=self.READ_OVERLAP))
+        if alarms:
+            self.__lastAlarmId = max(self.__lastAlarmId, alarms[-1]["Id"])
+        return alarms
+
+    def __payloads(self, alarm) -> dict:
+        """ Envois à faire pour cette alarme
+
+            :return: {canal: arguments de la fonction d'envoi},
+             les canaux non applicables sont absents
+        """
+        payloads = dict()
+        # send Voice Alarm in case telephone is defined
+        phone_exp = r"^(33)[1-9][0-9]{8}$"
+        # Alarm.HIGH.value = 85 so 75 is enought
+        if (alarm["Appel"] and re.search(phone_exp, alarm["Appel"])
+                and alarm["Priorite"] >= AlarmConst.HIGH.value):
+            my_message = alarm["Description"] + f" résident chambre {alarm['NumCh']}"
+            payloads["voix"] = {"tel_num": alarm["Appel"], "message": my_message}
+        # send to HTTP Alarm server if present (NOT USED BY THE MOMENT)
+        if self.__serverURL:
+            payloads["http"] = {"room": alarm["Chambre"], "alarm_date": str(alarm["Creation"]),
+                                "message": alarm["Description"], "priority": alarm["Priorite"]}
+        # sent to Firebase for Android App notification if defined
+        if self.__push_service and (self.__fb['topic'] or alarm["CanalNotif"]):
+            payloads["firebase"] = {"priority": alarm["Priorite"],
+                                    "user_topic": alarm["CanalNotif"]}
+        return payloads
+
+    def __enqueue(self, alarm_list):
+        """ Ecrit dans la table des envois le tour courant des alarmes
+            (sans effet s'il y est déjà)
+        """
+        deliveries = []
+        seen = set()
+        for alarm in alarm_list:
+            alarm_id = alarm["Id"]
+            if alarm_id in seen:
+                continue
+            seen.add(alarm_id)
+            # chambre et contact du patient (Appel, CanalNotif) depuis l'index en mémoire de la BD
+            alarm = dict(alarm, **self.__bd.get_alarm_contact(alarm["PatientId"]))
+            payloads = self.__payloads(alarm)
+            if not payloads:
+                # aucun canal applicable, rien ne sera jamais envoyé
+                self.__bd.set_alarm_counter(alarm_id, 0)
+                continue
+            current_round = alarm["NbNotifications"]
+            for channel, payload in payloads.items():
+                key = f"{alarm_id}-{current_round}-{channel}"
+                if channel == "http":
+                    payload["idempotency_key"] = key
+                deliveries.append({"key": key, "alarm_id": alarm_id, "round": current_round,
+                                   "channel": channel, "priority": alarm["Priorite"],
+                                   "creation": alarm["Creation"], "payload": payload})
+        if deliveries:
+            self.__bd.enqueue_alarm_deliveries(deliveries, resend_delay=self.SENDING_TIMEOUT)
+
+    def __claim(self, channel: str):
+        """ Réserve autant d'envois dus que de workers libres du canal et les soumet au pool """
+        with self.__lock:
+            free = self.CHANNEL_WORKERS[channel] - self.__busy[channel]
+        if free <= 0:
+            return
+        claimed = self.__bd.claim_alarm_deliveries(channel=channel, limit=free,
+                                                   lease=self.CLAIM_LEASE)
+        for delivery in claimed:
+            with self.__lock:
+                self.__busy[channel] += 1
+            send = functools.partial(self.__senders[channel], **delivery["Contenu"])
+            future = self.__pools[channel].submit(self.__priorityKey(delivery), send)
+            future.add_done_callback(functools.partial(self.__done, delivery, time.monotonic()))
+
+    def __done(self, delivery, sent_at: float, future):
+        """ Résultat d'un envoi : succès, nouvel essai différé ou abandon """
+        channel = delivery["Canal"]
+        error_msg = None
+        try:
+            ok = bool(future.result())
+        except Exception as error:
+            ok = False
+            error_msg = str(error)
+            logging.error(f"ALARM_SENDER ==> {channel}, erreur d'envoi de l'alarme "
+                          f"{delivery['AlarmeId']}: {error}")
+        try:
+            self.__record(channel, ok, time.monotonic() - sent_at)
+            retry_in = None
+            if ok:
+                creation = delivery["CreationAlarme"]
+                if delivery["Premier"] and isinstance(creation, datetime):
+                    # Creation est enregistrée à l'heure locale par insert_alarm
+                    with self.__lock:
+                        self.__latencies[self.__level(delivery["Priorite"]).name].append(
+                            (datetime.now() - creation).total_seconds())
+            elif delivery["Tentatives"] < self.__max_attempts(delivery["Priorite"]):
+                retry_in = min(self.RETRY_DELAY * 2 ** (delivery["Tentatives"] - 1),
+                               self.MAX_RETRY_DELAY)
+            else:
+                logging.error(f"ALARM_SENDER ==> {channel}, abandon de l'envoi {delivery['Cle']} "
+                              f"après {delivery['Tentatives']} essais")
+                with self.__lock:
+                    self.__stats[channel]["abandoned"] += 1
+            self.__bd.complete_alarm_delivery(delivery["Id"], ok,
+                                              error_msg or (None if ok else "échec"), retry_in)
+        finally:
+            with self.__lock:
+                self.__busy[channel] -= 1
+
+    def __record(self, channel: str, ok: bool, latency: float):
+        with self.__lock:
+            values = self.__stats[channel]
+            values["sent" if ok else "failed"] += 1
+            values["latency_total"] += latency
+            values["latency_max"] = max(values["latency_max"], latency)
 
     def __sendAndroidNotify(self, priority:int, user_topic=None) -> bool:
-        api_key = self.__fb['key']
         topic = self.__fb['topic']
         if user_topic:
             topic = user_topic
-        push_service = FCMNotification(api_key=api_key)
         str_pr = "informative"
         color_code = "gris"
         if priority > 75:
@@ -109,7 +316,9 @@ class AlarmSender(Thread):
             color_code = "jaune"
 
         message_body = f"Alarme SySPAD avec priorité {str_pr}, code couleur {color_code}."
-        result = push_service.notify_topic_subscribers(topic_name=topic, message_title="SySPAD", message_body=message_body)
+        result = self.__push_service.notify_topic_subscribers(
+            topic_name=topic, message_title="SySPAD", message_body=message_body,
+            timeout=self.CHANNEL_TIMEOUT["firebase"])
         if result['success'] > 0:
             logging.debug(f"ALARM_SENDER ==> Notification Android envoyé correctement")
             return True
@@ -137,16 +346,24 @@ class AlarmSender(Thread):
             logging.error(f"ALARM_SENDER ==> SMTP, impossible de se connecter à {self.__host}:{self.__port}")
         return ok
 
-    def __send_http_post(self, room: str, alarm_date: str, message: str, priority: int) -> bool:
+    def __send_http_post(self, room: str, alarm_date: str, message: str, priority: int,
+                         idempotency_key=None) -> bool:
+        # la clé d'idempotence permet au serveur d'ignorer un nouvel essai d'un envoi déjà reçu
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
         data = {
             "Chambre": room,
             "DateAlarme": alarm_date,
             "Message": message,
             "NiveauPriorite": str(priority),
         }
-        reponse = requests.post(self.__serverURL, data=data).content
-        dict_str = reponse.decode("UTF-8")
-        mydata = json.loads(dict_str)
+        try:
+            reponse = self.__http.post(self.__serverURL, data=data, headers=headers,
+                                       timeout=self.CHANNEL_TIMEOUT["http"]).content
+            dict_str = reponse.decode("UTF-8")
+            mydata = json.loads(dict_str)
+        except (requests.RequestException, ValueError) as error:
+            logging.error(f"ALARM_SENDER => HTTP/POST ERROR: {error}")
+            return False
         status = mydata.get("status")
         if status != 200:
             logging.error(f"ALARM_SENDER => HTTP/POST ERROR: status={status}")
@@ -155,53 +372,53 @@ class AlarmSender(Thread):
         return True
 
     def __send_sms(self, tel_num: str, message: str) -> bool:
-        sender = 'Mobaspace'
-        clase = "sms"
-        metodo = "sendsms"
-        scheduledatetime = ""
         ok = False
-        s_url = "http://www.afilnet.com/api/http/?class=" + clase + "&method=" + metodo + \
-                "&user=" + self.__sms_user + \
-                "&password=" + self.__sms_password + \
-                "&from=" + sender + "&to=" + tel_num + \
-                "&sms=" + urllib.parse.quote_plus(message) + \
-                "&scheduledatetime=" + scheduledatetime
+        params = {
+            "class": "sms",
+            "method": "sendsms",
+            "user": self.__sms_user,
+            "password": self.__sms_password,
+            "from": 'Mobaspace',
+            "to": tel_num,
+            "sms": message,
+            "scheduledatetime": "",
+        }
         try:
-            result = json.loads(urllib.request.urlopen(s_url).read().decode('utf-8'))
+            result = self.__http.get(self.AFILNET_URL, idempotent=False, params=params).json()
             if result and "status" in result:
                 if result["status"] == "ERROR" and "error" in result:
                     ok = False
                     logging.error(f"SMS, erreur envoi à {tel_num} : {result['error']}")
                 else:
                     ok = True
-        except urllib.error.URLError as error:
+        except (requests.RequestException, ValueError) as error:
             ok = False
             logging.error(f"SMS, erreur envoi à {tel_num} : {error}")
         return ok
 
     def __send_voice(self, tel_num: str, message: str) -> bool:
-        sender = 'Mobaspace'
-        clase = "voice"
-        metodo = "sendvoice"
-        scheduledatetime = ""
-        language = "fr"
         ok = False
-        s_url = "http://www.afilnet.com/api/http/?class=" + clase + "&method=" + metodo + \
-                "&user=" + self.__sms_user + \
-                "&password=" + self.__sms_password + \
-                "&from=" + sender + "&to=" + tel_num + \
-                "&message=" + urllib.parse.quote_plus((message + ". ")*self.__xm) + \
-                "&scheduledatetime=" + scheduledatetime + \
-                "&language=" + language
+        params = {
+            "class": "voice",
+            "method": "sendvoice",
+            "user": self.__sms_user,
+            "password": self.__sms_password,
+            "from": 'Mobaspace',
+            "to": tel_num,
+            "message": (message + ". ")*self.__xm,
+            "scheduledatetime": "",
+            "language": "fr",
+        }
         try:
-            result = json.loads(urllib.request.urlopen(s_url).read().decode('utf-8'))
+            result = self.__http.get(self.AFILNET_URL, idempotent=False, params=params,
+                                     timeout=self.CHANNEL_TIMEOUT["voix"]).json()
             if result and "status" in result:
                 if result["status"] == "ERROR" and "error" in result:
                     ok = False
                     logging.error(f"Voix, erreur envoi à {tel_num} : {result['error']}")
                 else:
                     ok = True
-        except urllib.error.URLError as error:
+        except (requests.RequestException, ValueError) as error:
             ok = False
             logging.error(f"Voix, erreur envoi à {tel_num} : {error}")
         return ok
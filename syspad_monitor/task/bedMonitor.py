@@ -1,8 +1,12 @@
 # coding: utf8
 
+import heapq
+import itertools
+import json
 import logging
+import os
 import time
-from threading import Thread, Timer
+from threading import Condition, Thread
 
 from dateutil import tz
 import arrow
@@ -12,146 +16,172 @@ from syspad_monitor.task import PatientConst, AlarmConst
 
 
 class BedMonitor(Thread):
-    # par défaut 10 secondes de sleep du Thread pour vérifier si nouvelles données
-    REFRESH_TIME = 10
+    # les évènements lit réveillent le Thread immédiatement, une passe complète
+    # sur tous les patients n'est faite que toutes les 60 secondes
+    REFRESH_TIME = 60
+    # les patients allongés de jour (compteur en cours) sont revus toutes les 10 secondes
+    DAY_REFRESH_TIME = 10
 
-    def __init__(self, bd: SysPadDb_encry):
+    def __init__(self, bd: SysPadDb_encry, deadlines=None):
+        """
+        :param deadlines: échéances de sortie de lit (DeadlineScheduler) partagées entre
+         les instances successives du moniteur, sinon un ordonnanceur propre à cette instance
+         est créé
+        """
         self.__bd = bd
         self.__thread_name = f"BED MONITOR"
         Thread.__init__(self, name=self.__thread_name, target=self.run)
-        self.__myTimers = dict()
+        if deadlines is None:
+            deadlines = DeadlineScheduler(
+                on_expire=lambda pat_id: BedMonitor.bed_exit_alarm(bd, pat_id))
+            deadlines.start()
+        self.__deadlines = deadlines
         self.__myCounters = dict()
         self.stop = False
 
     def run(self):
         logging.info(f"BED MONITOR --> Started")
-
+        next_scan = 0
+        next_day_scan = 0
         while not self.stop:
-            for patient_dict in self.__bd.read_all_patients():
-                pat_id = int(patient_dict["Id"])
-                numCh = patient_dict["NumCh"]
-                nomChambre = patient_dict["Chambre"]
-                chambre = str(numCh) + " " + nomChambre
-
-                # pour rappel h1 est un INT avec les secondes après 0h
-                h1 = int(patient_dict["Coucher_h"] or 0) * 3600 + int(patient_dict["Coucher_min"] or 0) * 60
-                h2 = int(patient_dict["Lever_h"] or 0) * 3600 + int(patient_dict["Lever_min"] or 0) * 60
-                max_time_out_bed = int(patient_dict["DureeMaxHorsLit_min"] or 0) * 60
-                # vérifier si nous sommes dans la plage de surveillance
-                time_now = arrow.now(tz=tz.gettz("Paris/Europe"))
-                secs_on_day = (
-                        time_now.datetime.hour * 3600
-                        + time_now.datetime.minute * 60
-                        + time_now.datetime.second
+            # passe de réconciliation sur tous les patients (compteurs de jour, timers échus...)
+            if time.monotonic() >= next_scan:
+                for patient_dict in self.__bd.read_all_patients():
+                    self.__check_patient(patient_dict)
+                next_scan = time.monotonic() + self.REFRESH_TIME
+                next_day_scan = time.monotonic() + self.DAY_REFRESH_TIME
+            # compteur de temps allongé de jour et alarme "allongé trop longtemps"
+            elif time.monotonic() >= next_day_scan:
+                for lying_id in list(self.__myCounters):
+                    patient_dict = self.__bd.read_one_patient(lying_id)
+                    if patient_dict:
+                        self.__check_patient(patient_dict)
+                next_day_scan = time.monotonic() + self.DAY_REFRESH_TIME
+            # entre deux passes, réveil uniquement pour le patient ayant un nouvel évènement lit
+            next_wakeup = min(next_scan, next_day_scan)
+            pat_id = self.__bd.wait_bed_event(timeout=max(0.0, next_wakeup - time.monotonic()))
+            if pat_id is not None:
+                patient_dict = self.__bd.read_one_patient(pat_id)
+                if patient_dict:
+                    logging.debug(f"BED_MONITOR --> New BED event for Pat={pat_id}")
+                    self.__check_patient(patient_dict)
+
+    def __check_patient(self, patient_dict):
+        pat_id = int(patient_dict["Id"])
+
+        # pour rappel h1 est un INT avec les secondes après 0h
+        h1 = (int(patient_dict["Coucher_h"] or 0) * 3600
+              + int(patient_dict["Coucher_min"] or 0) * 60)
+        h2 = int(patient_dict["Lever_h"] or 0) * 3600 + int(patient_dict["Lever_min"] or 0) * 60
+        max_time_out_bed = int(patient_dict["DureeMaxHorsLit_min"] or 0) * 60
+        # vérifier si nous sommes dans la plage de surveillance
+        time_now = arrow.now(tz=tz.gettz("Paris/Europe"))
+        secs_on_day = (
+                time_now.datetime.hour * 3600
+                + time_now.datetime.minute * 60
+                + time_now.datetime.second
+        )
+        # surveillance de nuit
+        if self.is_time_on_interval(h1, h2, secs_on_day):
+            events_bed = self.__bd.get_last_bed_events(pat_id)
+            last_bed_in = events_bed[0][0]
+            last_bed_out = events_bed[0][1]
+            new_event = events_bed[0][2]
+            # first time they can be "None" or flag is already False
+            if last_bed_out and last_bed_in and new_event:
+                self.__bd.change_patient_flag(
+                    pat_id, False, PatientConst.bed_data.value
                 )
-                # surveillance de nuit
-                if self.is_time_on_interval(h1, h2, secs_on_day):
-                    events_bed = self.__bd.get_last_bed_events(pat_id)
-                    last_bed_in = events_bed[0][0]
-                    last_bed_out = events_bed[0][1]
-                    new_event = events_bed[0][2]
-                    # first time they can be "None" or flag is already False
-                    if last_bed_out and last_bed_in and new_event:
-                        self.__bd.change_patient_flag(
-                            pat_id, False, PatientConst.bed_data.value
-                        )
-                        if last_bed_in < last_bed_out:
-                            # launch Timer if it is stopped
-                            if pat_id not in self.__myTimers:
-                                logging.info(
-                                    f"TIMER ===> Countdown STARTED for Pat={pat_id}"
-                                )
-                                self.__myTimers[pat_id] = MyTimer(self.__bd, pat_id, chambre, max_time_out_bed)
-                                self.__myTimers[pat_id].start()
-
-                        elif pat_id in self.__myTimers:
-                            logging.info(
-                                f"TIMER ===> Countdown STOPPED for Pat={pat_id} because BED_IN > BED_OUT"
-                            )
-                            self.__myTimers[pat_id].cancel()
-                            del self.__myTimers[pat_id]
-                    else:
-                        if pat_id in self.__myTimers and not self.__myTimers[pat_id].is_runing():
-                            logging.info(
-                                f"TIMER ===> Countdown REACHED!!! Timer Object deleted for pat={pat_id}"
-                            )
-                            del self.__myTimers[pat_id]
-                        logging.debug(
-                            f"BED_MONITOR --> Any new BED event for Pat={pat_id} in H1-H2"
+                if last_bed_in < last_bed_out:
+                    # launch Timer if it is stopped
+                    if pat_id not in self.__deadlines:
+                        logging.info(
+                            f"TIMER ===> Countdown STARTED for Pat={pat_id}"
                         )
-                    if patient_dict["CumulTempsAllonge"] and int(patient_dict["CumulTempsAllonge"]) != 0:
-                        self.__bd.update_patient_lying_day_time(pat_id, 0)
-                        if int(patient_dict["CumulTempsAllonge"]) < 0:
-                            patient_dict["CumulTempsAllonge"] = int(patient_dict["CumulTempsAllonge"]) + 86400
-                        # insert the day on db, hypothesis that h1 is always before midnight
-                        self.__bd.insert_day_total_lying_time(patient=pat_id,
-                                                              date_jour=arrow.now().format('YYYY-MM-DD'),
-                                                              temps_allonge_total=int(patient_dict["CumulTempsAllonge"])
-                                                              )
-                        if pat_id in self.__myCounters:
-                            del self.__myCounters[pat_id]
-                        logging.info(f"COUNTER ===> Reset for this day for Pat={pat_id}")
-                # surveillance de jour
+                        self.__deadlines.schedule(pat_id, max_time_out_bed)
+
+                elif self.__deadlines.cancel(pat_id):
+                    logging.info(
+                        f"TIMER ===> Countdown STOPPED for Pat={pat_id} because BED_IN > BED_OUT"
+                    )
+            else:
+                logging.debug(
+                    f"BED_MONITOR --> Any new BED event for Pat={pat_id} in H1-H2"
+                )
+            if patient_dict["CumulTempsAllonge"] and int(patient_dict["CumulTempsAllonge"]) != 0:
+                self.__bd.update_patient_lying_day_time(pat_id, 0)
+                if int(patient_dict["CumulTempsAllonge"]) < 0:
+                    patient_dict["CumulTempsAllonge"] = (int(patient_dict["CumulTempsAllonge"])
+                                                         + 86400)
+                # insert the day on db, hypothesis that h1 is always before midnight
+                self.__bd.insert_day_total_lying_time(
+                    patient=pat_id,
+                    date_jour=arrow.now().format('YYYY-MM-DD'),
+                    temps_allonge_total=int(patient_dict["CumulTempsAllonge"])
+                )
+                if pat_id in self.__myCounters:
+                    del self.__myCounters[pat_id]
+                logging.info(f"COUNTER ===> Reset for this day for Pat={pat_id}")
+        # surveillance de jour
+        else:
+            # cas où le timer tourne encore après passage H2
+            if self.__deadlines.cancel(pat_id):
+                logging.info(f"TIMER ===> Countdown STOPPED for Pat={pat_id} because time > H2")
+                # il faut mettre le flag à True bug 2557
+                self.__bd.change_patient_flag(
+                    pat_id, True, PatientConst.bed_data.value
+                )
+            # compteur de temps dans le lit de jour
+            # si négatif cela veut dire que nous avons déjà envoyé une alarme!!
+            # Pas la peine d'en traiter d'autres car le temps Max à déjà été dépassée
+            # on traitera le compteur en négatif ;) mais on pourra avoir le total à la fin!
+            if patient_dict["Posture"] is not None and int(patient_dict["Posture"]) == 0:
+                if pat_id not in self.__myCounters:
+                    self.__myCounters[pat_id] = arrow.now().int_timestamp
+                    logging.info(f"COUNTER ===> Initialisation for this day for Pat={pat_id}")
                 else:
-                    # cas où le timer tourne encore après passage H2
-                    if pat_id in self.__myTimers:
-                        logging.info(f"TIMER ===> Countdown STOPPED for Pat={pat_id} because time > H2")
-                        self.__myTimers[pat_id].cancel()
-                        del self.__myTimers[pat_id]
-                        # il faut mettre le flag à True bug 2557
-                        self.__bd.change_patient_flag(
-                            pat_id, True, PatientConst.bed_data.value
-                        )
-                    # compteur de temps dans le lit de jour
-                    # si négatif cela veut dire que nous avons déjà envoyé une alarme!! Pas la peine d'en traiter
-                    # d'autres car le temps Max à déjà été dépassée
-                    # on traitera le compteur en négatif ;) mais on pourra avoir le total à la fin!
-                    if patient_dict["Posture"] is not None and int(patient_dict["Posture"]) == 0:
-                        if pat_id not in self.__myCounters:
-                            self.__myCounters[pat_id] = arrow.now().int_timestamp
-                            logging.info(f"COUNTER ===> Initialisation for this day for Pat={pat_id}")
-                        else:
-                            delta_sec = arrow.now().int_timestamp - self.__myCounters[pat_id]
-                            self.__myCounters[pat_id] = arrow.now().int_timestamp
-                            self.__bd.update_patient_lying_day_time(
-                                patient_id=pat_id,
-                                amount=int(patient_dict["CumulTempsAllonge"] or 0) + delta_sec
-                            )
-                    else:
-                        # cas ou lon vient de sortir du lit
-                        if pat_id in self.__myCounters:
-                            delta_sec = arrow.now().int_timestamp - self.__myCounters[pat_id]
-                            self.__bd.update_patient_lying_day_time(
-                                patient_id=pat_id,
-                                amount=int(patient_dict["CumulTempsAllonge"]) + delta_sec
-                            )
-                            del self.__myCounters[pat_id]
-                    if (patient_dict["TempsMaxAllongeJour"] and patient_dict["CumulTempsAllonge"]
-                            and int(patient_dict["CumulTempsAllonge"]) > int(patient_dict["TempsMaxAllongeJour"])):
-                        new_alarm = dict(
-                            {
-                                "id_patient": pat_id,
-                                "id_capteur": self.__bd.get_id_sensor_for_pat(pat_id),
-                                "priorite": AlarmConst.LOW.value,  # 100-75 haute, 50 moyenne, 0 basse
-                                "desc": f"Resident allongé trop longtemps",
-                            }
-                        )
-                        logging.info(f"COUNTER ===> Alarm for Pat={pat_id} because too lying time")
-                        self.__bd.insert_alarm(alarm=new_alarm)
-                        # ceci permet de ne plus traiter l'alarme
-                        # et continuer a compter des secondes, l'IHM devra prende en compte ceci
-                        self.__bd.update_patient_lying_day_time(
-                            patient_id=pat_id,
-                            amount=int(patient_dict["CumulTempsAllonge"]) - 86400
-                        )
-                    # cas où la surveillance a été mise à vide (effet de bord!)
-                    if patient_dict["CumulTempsAllonge"] and int(patient_dict["CumulTempsAllonge"]) > 86400:
-                        self.__bd.update_patient_lying_day_time(
-                            patient_id=pat_id,
-                            amount=0
-                        )
-                    logging.debug(f"BED_MONITOR --> Pat={pat_id} is Out of H1-H2")
-            time.sleep(self.REFRESH_TIME)
+                    delta_sec = arrow.now().int_timestamp - self.__myCounters[pat_id]
+                    self.__myCounters[pat_id] = arrow.now().int_timestamp
+                    self.__bd.update_patient_lying_day_time(
+                        patient_id=pat_id,
+                        amount=int(patient_dict["CumulTempsAllonge"] or 0) + delta_sec
+                    )
+            else:
+                # cas ou lon vient de sortir du lit
+                if pat_id in self.__myCounters:
+                    delta_sec = arrow.now().int_timestamp - self.__myCounters[pat_id]
+                    self.__bd.update_patient_lying_day_time(
+                        patient_id=pat_id,
+                        amount=int(patient_dict["CumulTempsAllonge"]) + delta_sec
+                    )
+                    del self.__myCounters[pat_id]
+            if (patient_dict["TempsMaxAllongeJour"] and patient_dict["CumulTempsAllonge"]
+                    and int(patient_dict["CumulTempsAllonge"])
+                    > int(patient_dict["TempsMaxAllongeJour"])):
+                new_alarm = dict(
+                    {
+                        "id_patient": pat_id,
+                        "id_capteur": self.__bd.get_id_sensor_for_pat(pat_id),
+                        "priorite": AlarmConst.LOW.value,  # 100-75 haute, 50 moyenne, 0 basse
+                        "desc": f"Resident allongé trop longtemps",
+                    }
+                )
+                logging.info(f"COUNTER ===> Alarm for Pat={pat_id} because too lying time")
+                self.__bd.insert_alarm(alarm=new_alarm)
+                # ceci permet de ne plus traiter l'alarme
+                # et continuer a compter des secondes, l'IHM devra prende en compte ceci
+                self.__bd.update_patient_lying_day_time(
+                    patient_id=pat_id,
+                    amount=int(patient_dict["CumulTempsAllonge"]) - 86400
+                )
+            # cas où la surveillance a été mise à vide (effet de bord!)
+            if (patient_dict["CumulTempsAllonge"]
+                    and int(patient_dict["CumulTempsAllonge"]) > 86400):
+                self.__bd.update_patient_lying_day_time(
+                    patient_id=pat_id,
+                    amount=0
+                )
+            logging.debug(f"BED_MONITOR --> Pat={pat_id} is Out of H1-H2")
 
     @staticmethod
     def is_time_on_interval(begin_time: int, end_time: int, check_time: int) -> bool:
@@ -164,36 +194,156 @@ class BedMonitor(Thread):
             return check_time >= begin_time or check_time <= end_time
 
 
-class MyTimer:
-
-    def __init__(self, bd: SysPadDb_encry, pat_id: int, room: str, interval: int):
-        self.__bd = bd
-        self.__pat_id = pat_id
-        self.__room = room
-        self.__myTimer = Timer(interval, self.__alarm)
-
-    def start(self):
-        if not self.__myTimer.is_alive():
-            self.__myTimer.start()
-
-    def cancel(self):
-        if self.__myTimer.is_alive():
-            self.__myTimer.cancel()
-
-    def is_runing(self) -> bool:
-        if self.__myTimer.is_alive():
-            return True
-        return False
-
-    def __alarm(self):
-        logging.info(f"TIMER ===> Enregistrement d'alarme lit pour le patient {self.__pat_id}")
+    @staticmethod
+    def bed_exit_alarm(bd: SysPadDb_encry, pat_id: int):
+        """ Echéance de sortie de lit atteinte : enregistrement de l'alarme """
+        logging.info(f"TIMER ===> Enregistrement d'alarme lit pour le patient {pat_id}")
         new_alarm = dict(
             {
-                "id_patient": self.__pat_id,
-                "id_capteur": self.__bd.get_id_sensor_for_pat(self.__pat_id),
+                "id_patient": pat_id,
+                "id_capteur": bd.get_id_sensor_for_pat(pat_id),
                 "priorite": AlarmConst.HIGH.value,  # 100 haute, 50 moyenne, 0 basse
                 "desc": f"Sortie de lit inattendue",
             }
         )
-        self.__bd.insert_alarm(alarm=new_alarm)
-        return
+        bd.insert_alarm(alarm=new_alarm)
+
+
+class DeadlineScheduler(Thread):
+    """
+    Echéances (clé -> date) gérées par un seul thread, quel que soit leur nombre
+
+    Tas binaire des échéances avec annulation paresseuse : programmer ou reprogrammer une clé
+    coûte O(log n), l'annuler O(1). Les échéances sont des dates absolues (time.time())
+    sauvegardées dans un fichier JSON au plus SAVE_DELAY secondes après une modification
+    et rechargées à la création.
+    """
+    # au rechargement, une échéance dépassée depuis plus de STALE_AFTER secondes est abandonnée
+    STALE_AFTER = 600
+    # les modifications sont regroupées pendant SAVE_DELAY secondes avant sauvegarde
+    SAVE_DELAY = 1.0
+
+    def __init__(self, on_expire, path=None, name="DEADLINES"):
+        """
+        :param on_expire: fonction appelée avec la clé à l'échéance
+         (dans le thread de l'ordonnanceur)
+        :param path: fichier de sauvegarde des échéances (None: pas de sauvegarde)
+        """
+        Thread.__init__(self, name=name, target=self.run, daemon=True)
+        self.__on_expire = on_expire
+        self.__path = path
+        self.__heap = [] # (échéance, numéro, clé)
+        self.__entries = dict() # clé -> (échéance, numéro) de l'entrée valide du tas
+        self.__seq = itertools.count()
+        self.__cond = Condition()
+        self.__dirty_since = None # date de la première modification non sauvegardée
+        self.stop = False
+        self.__load()
+
+    def __contains__(self, key) -> bool:
+        with self.__cond:
+            return key in self.__entries
+
+    def __len__(self) -> int:
+        with self.__cond:
+            return len(self.__entries)
+
+    def schedule(self, key, delay: float):
+        """ Programme (ou reprogramme) l'échéance de la clé dans delay secondes """
+        with self.__cond:
+            self.__push(key, time.time() + delay)
+            self.__modified()
+            # la nouvelle échéance est peut-être la plus proche
+            self.__cond.notify()
+
+    def cancel(self, key) -> bool:
+        """ Annule l'échéance de la clé
+
+            :return: True si une échéance était programmée
+        """
+        with self.__cond:
+            # l'entrée reste dans le tas et sera ignorée à son échéance
+            if self.__entries.pop(key, None) is None:
+                return False
+            self.__modified()
+            return True
+
+    def deadline(self, key):
+        """ Date (time.time()) de l'échéance de la clé, None si elle n'est pas programmée """
+        with self.__cond:
+            entry = self.__entries.get(key)
+        return entry[0] if entry else None
+
+    def run(self):
+        while not self.stop:
+            with self.__cond:
+                expired = self.__pop_expired()
+                if expired:
+                    self.__modified()
+                dirty_since = self.__dirty_since
+                if dirty_since is not None and time.time() - dirty_since >= self.SAVE_DELAY:
+                    self.__save()
+                if not expired:
+                    wake_up = [self.__heap[0][0]] if self.__heap else []
+                    if self.__dirty_since is not None:
+                        wake_up.append(self.__dirty_since + self.SAVE_DELAY)
+                    self.__cond.wait(min(wake_up) - time.time() if wake_up else None)
+                    continue
+            for key in expired:
+                try:
+                    self.__on_expire(key)
+                except Exception as error:
+                    logging.error(f"{self.name} --> erreur à l'échéance de {key}: {error}")
+
+    def __modified(self):
+        if self.__dirty_since is None:
+            self.__dirty_since = time.time()
+            self.__cond.notify()
+
+    def __push(self, key, deadline: float):
+        seq = next(self.__seq)
+        self.__entries[key] = (deadline, seq)
+        heapq.heappush(self.__heap, (deadline, seq, key))
+        # le tas est reconstruit quand les entrées annulées y sont majoritaires
+        if len(self.__heap) > 2 * len(self.__entries) + 16:
+            self.__heap = [(deadline, seq, key) for key, (deadline, seq) in self.__entries.items()]
+            heapq.heapify(self.__heap)
+
+    def __pop_expired(self) -> list:
+        expired = []
+        now = time.time()
+        while self.__heap and self.__heap[0][0] <= now:
+            deadline, seq, key = heapq.heappop(self.__heap)
+            if self.__entries.get(key) == (deadline, seq):
+                del self.__entries[key]
+                expired.append(key)
+        return expired
+
+    def __load(self):
+        if not self.__path or not os.path.exists(self.__path):
+            return
+        try:
+            with open(self.__path) as f:
+                saved = json.load(f)
+        except (EnvironmentError, ValueError) as e:
+            logging.error(f"{self.name} --> Impossible de relire les échéances: {e}")
+            return
+        now = time.time()
+        for key, deadline in saved:
+            if deadline < now - self.STALE_AFTER:
+                logging.info(f"{self.name} --> échéance de {key} trop ancienne, abandonnée")
+                continue
+            self.__push(key, deadline)
+        logging.info(f"{self.name} --> {len(self.__entries)} échéance(s) rechargée(s)")
+
+    def __save(self):
+        self.__dirty_since = None
+        if not self.__path:
+            return
+        try:
+            tmp_path = self.__path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump([[key, deadline] for key, (deadline, seq) in self.__entries.items()], f)
+            os.replace(tmp_path, self.__path)
+        except EnvironmentError as e:
+            logging.error(f"{self.name} --> Impossible de sauvegarder les échéances: {e}")
@@ -8,7 +8,10 @@ import time
 from threading import Thread
 import ast
 import arrow
+import numpy as np
 import pandas as pd
+import psycopg2
+import requests
 import zmq
 from zmq import ZMQError
 
@@ -17,8 +20,8 @@ from syspad_monitor.model.oauth_api import MyWithingsApi
 from syspad_monitor.task import PatientConst
 
 class DataCollector(Thread):
-    # par défaut 10 secondes de sleep du Thread pour vérifier les Notifications
-    REFRESH_TIME = 10
+    # attente maximum (ms) sur le socket ZMQ avant de revérifier le flag stop
+    POLL_TIMEOUT = 1000
     # Thread_name sera wgs_notify_usedId pour pouvoir traquer le message dans la queu ZMQ
 
     def __init__(self, bd: SysPadDb_encry, zmq_port: int):
@@ -30,6 +33,19 @@ class DataCollector(Thread):
         self.__zmq_queue = zmq.Context().socket(zmq.SUB)
         self.__zmq_queue.connect(f"tcp://localhost:{zmq_port}")
         self.__zmq_queue.setsockopt_string(zmq.SUBSCRIBE, self.__thread_name)
+        self.__poller = zmq.Poller()
+        self.__poller.register(self.__zmq_queue, zmq.POLLIN)
+        # traitement associé à chaque code appli
+        self.__handlers = {
+            777: self.__process_tracker,
+            888: self.__process_linto,
+            44: self.__process_sleep,
+            50: self.__process_bed_in,
+            51: self.__process_bed_out,
+        }
+        self.__stats = {"started": time.time(), "messages": 0, "errors": 0, "unknown": 0,
+                        "batches": 0, "by_appli": dict(), "latency_total": 0.0, "latency_max": 0.0,
+                        "processing_total": 0.0, "processing_max": 0.0}
         self.stop = False
 
     def run(self):
@@ -37,17 +53,33 @@ class DataCollector(Thread):
             f"DATA-COLLECTOR --> Process has been started"
         )
         while not self.stop:
-            try:
-                event = self.__zmq_queue.recv(flags=zmq.NOBLOCK)
-                # si un évènement arrive, extraire le JSON
-                _, message = event.split(maxsplit=1)
-                json_message = json.loads(message)
-            except ZMQError:
-                json_message = None
-            # execution du traitement
-            self.process(json_message)
-            logging.debug(f"DATA-COLLECTOR --> Running")
-            time.sleep(self.REFRESH_TIME)
+            # bloquant jusqu'à l'arrivée d'un message (ou POLL_TIMEOUT)
+            events = dict(self.__poller.poll(self.POLL_TIMEOUT))
+            # écriture groupée des lectures Smart-Tracker dont la fenêtre est échue
+            self.__bd.flush_trackers()
+            if self.__zmq_queue not in events:
+                continue
+            # vider la file: tous les messages en attente sont traités à ce réveil
+            nb_messages = 0
+            while True:
+                try:
+                    event = self.__zmq_queue.recv(flags=zmq.NOBLOCK)
+                except ZMQError:
+                    break
+                nb_messages += 1
+                try:
+                    # si un évènement arrive, extraire le JSON
+                    _, message = event.split(maxsplit=1)
+                    json_message = json.loads(message)
+                except ValueError:
+                    logging.error(f"DATA-COLLECTOR --> Message ZMQ illisible: {event}")
+                    self.__stats["errors"] += 1
+                    continue
+                # execution du traitement
+                self.process(json_message)
+            self.__stats["batches"] += 1
+            logging.debug(f"DATA-COLLECTOR --> {nb_messages} message(s) traité(s)")
+        self.__bd.flush_trackers(force=True)
 
     def process(self, json_message: dict):
         """
@@ -55,162 +87,245 @@ class DataCollector(Thread):
         et proceder a son traitement
         :return:
         """
-        if json_message:
-            # ========= PARTIE IoT MOBASPACE + LinTO  =================
-            # ici c'est le traitement du Smart-Tracker
-            if int(json_message["appli"]) == 777:
-                # trace de l'information reçue
-                logging.debug(f"DATA-COLLECTOR --> Reception of data from Smart-Tracker")
-                myDev = json_message["devId"]
-                nb_pas = int(json_message["steps"])
-                power = int(json_message["power"])
-                lect_wifi = None
-                if len(json_message["macs"]) > 0:
-                    listMACS = json_message["macs"].split(",")
-                    listRSSI = json_message["rssis"].split(",")
-                    lect_wifi = {}
-                    for ii in range(len(listMACS)):
-                        lect_wifi[listMACS[ii]] = int(listRSSI[ii])
-                shock_posture = None
-                if len(json_message["shock"]) > 0:
-                    # liste contenant NN elements d'acceleration + NN elements de position angulaire
-                    shock_posture = list(ast.literal_eval(json_message["shock"]))
-                    shock_posture = shock_posture + list(ast.literal_eval(json_message["position"]))
-                vit_marche = float(json_message["speed"])
-                temps_marche = int(json_message["uptime"])
-
-                self.__bd.update_tracker(
-                    macAdd=myDev,
-                    lec_wifi=lect_wifi,
-                    nb_pas=nb_pas,
-                    acc_vector=shock_posture,
-                    power=power,
-                    walk_speed=vit_marche,
-                    act_time=temps_marche
-                )
-                self.__bd.set_tracker_state(tracker_mac=myDev, state=True)
-                return
-            # ici c'est le traitement des information LinTO
-            if int(json_message["appli"]) == 888:
-                # trace de l'information reçue pour releves/transmissions
-                logging.debug(f"DATA-COLLECTOR --> Reception of Voice Data from LinTO")
-                myRoom = json_message["chambre"]
-                myObs = json_message["type"]
-                myVals = json.loads(json_message["values"])
-                if myObs == "Questionnaire":
-                    self.__bd.set_filledForm(room=myRoom, values=myVals)
-                elif myObs == "ChambreEntiere":
-                    myUser = json_message["idUser"]
-                    self.__bd.setBedroomInfoBlock(room=myRoom, values=myVals, idPer=myUser)
-                else:
-                    # ceci est l'ancienne méthode
-                    # self.__bd.set_observable(myObs, myVals, myRoom)
-                    logging.debug(f"DATA-COLLECTOR --> Reception of Voice Data from LinTO in wrong format")
-                return
-
-
-            # ========= TOUTE CETTE PARTIE TRAITE WITHINGS  =================
-            # c'est la date de reception de la notification
-            if "date" in json_message:
-                date_new_int = int(json_message["date"])
-            else:
-                date_new_int = 0
-
-            # correspondance user wthings et patient Id
-            wgs_user_id = json_message["userid"]
-            patient_id = self.__bd.get_patient_from_wgs_user(wgs_user_id=wgs_user_id)
-
-            if not patient_id:
-                logging.debug(f"DATA-COLLECTOR --> API_user={wgs_user_id} is linked to any patient. NOTHING TO DO")
-                return
-            try:
-                patient_id = int(patient_id[0][0])
-            except TypeError:
-                logging.debug(f"DATA-COLLECTOR --> API_user={wgs_user_id} is linked to any patient. NOTHING TO DO")
-                return
-
-            current_patient = self.__bd.read_one_patient(pat_id=patient_id)
-            current_api = self.__bd.read_patient_api(patient_id=patient_id, provider='Withings')[0]
-
-            if int(json_message["appli"]) == 50:
-
-                logging.info(
-                    f"Reception BED_IN for patId={patient_id}"
-                    f" on room={current_patient['Chambre']}"
-                )
-                self.__bd.update_bed_notify(
-                    patient_id, bed_type=PatientConst.BED_IN.value, noti_date=date_new_int
-                )
-                self.__bd.update_patient_posture(patient_id, PatientConst.LYING.value)
-
-            elif int(json_message["appli"]) == 51:
-
-                logging.info(
-                    f"Reception BED_OUT for patId={patient_id}"
-                    f" on room={current_patient['Chambre']}"
-                )
-                self.__bd.update_bed_notify(
-                    patient_id, bed_type=PatientConst.BED_OUT.value, noti_date=date_new_int
-                )
-                self.__bd.update_patient_posture(patient_id, PatientConst.STANDING.value)
-
-            elif int(json_message["appli"]) == 44:
-                # ce sont les données du matelas AURA2
-                logging.info(
-                    f"Reception AURA2 for patId={patient_id}"
-                    f" on room={current_patient['Chambre']}"
-                )
-                d_ini = arrow.get(int(json_message["startdate"]))
-                d_end = arrow.get(int(json_message["enddate"]))
-
-                # partie résumé de la nuit
-                new_summary = MyWithingsApi.get_sleep_summary(
-                    access_token=current_api['AccessToken'],
-                    startdate=d_ini,
-                    enddate=d_end)
-
-                if new_summary:
-                    d_min = arrow.get(new_summary["DateDebut"])
-                    self.__bd.insert_sleep_summary(patient=patient_id,
-                                                   date_nuit=d_min.format('YYYY-MM-DD'),
-                                                   data=new_summary)
-
-                    # cet element nous permettra de faire le calcul des sorties de lit
-                    new_data_api = MyWithingsApi.get_sleep_allseries(
-                        access_token=current_api['AccessToken'],
-                        startdate=d_ini,
-                        enddate=d_end)
-
-                    # partie calcul des trous dans la nuit
-                    if new_data_api is not None:
-                        my_dict = self.__get_outs_of_bed(new_data_api[["Time"]])
-                        self.__bd.insert_bedouts_summary(patient=patient_id,
-                                                         date_nuit=d_min.format('YYYY-MM-DD'),
-                                                         bedouts_summ=my_dict)
+        if not json_message:
+            return
+        begin = time.time()
+        try:
+            appli = int(json_message["appli"])
+            handler = self.__handlers.get(appli)
+        except (KeyError, TypeError, ValueError):
+            appli, handler = None, None
+        if handler is None:
+            logging.debug(f"DATA-COLLECTOR --> appli inconnue dans le message {json_message}")
+            self.__stats["unknown"] += 1
+            return
+        try:
+            handler(json_message)
+        except (KeyError, TypeError, ValueError, IndexError) as error:
+            # un message mal formé ne doit pas faire perdre le reste de la file
+            logging.error(f"DATA-COLLECTOR --> Erreur de traitement appli={appli}: {error!r}")
+            self.__stats["errors"] += 1
+        except (requests.RequestException, psycopg2.DatabaseError,
+                psycopg2.InterfaceError) as error:
+            # API Withings ou base indisponible : le message est perdu mais pas le reste de la file
+            logging.error(f"DATA-COLLECTOR --> Erreur réseau/base appli={appli}: {error!r}")
+            self.__stats["errors"] += 1
+        end = time.time()
+        stats = self.__stats
+        stats["messages"] += 1
+        stats["by_appli"][appli] = stats["by_appli"].get(appli, 0) + 1
+        processing = end - begin
+        stats["processing_total"] += processing
+        stats["processing_max"] = max(stats["processing_max"], processing)
+        # temps entre la réception HTTP (horodatée par Flask) et la fin du traitement
+        if "recv_ts" in json_message:
+            latency = end - float(json_message["recv_ts"])
+            stats["latency_total"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Compteurs du collecteur: nombre de messages (total, par appli, erreurs, inconnus),
+        débit en messages/s depuis le démarrage, latences réception->traité
+        et temps de traitement (s)
+        :return: dict
+        """
+        stats = dict(self.__stats)
+        stats["by_appli"] = dict(stats["by_appli"])
+        nb = stats["messages"]
+        stats["throughput"] = nb / max(time.time() - stats.pop("started"), 1e-6)
+        stats["latency_avg"] = stats["latency_total"] / nb if nb else 0.0
+        stats["processing_avg"] = stats["processing_total"] / nb if nb else 0.0
+        return stats
+
+    # ========= PARTIE IoT MOBASPACE + LinTO  =================
+    def __process_tracker(self, json_message: dict):
+        # ici c'est le traitement du Smart-Tracker
+        # trace de l'information reçue
+        logging.debug(f"DATA-COLLECTOR --> Reception of data from Smart-Tracker")
+        myDev = json_message["devId"]
+        nb_pas = int(json_message["steps"])
+        power = int(json_message["power"])
+        lect_wifi = None
+        if len(json_message["macs"]) > 0:
+            listMACS = json_message["macs"].split(",")
+            listRSSI = json_message["rssis"].split(",")
+            lect_wifi = {}
+            for ii in range(len(listMACS)):
+                lect_wifi[listMACS[ii]] = int(listRSSI[ii])
+        shock_posture = None
+        if len(json_message["shock"]) > 0:
+            # liste contenant NN elements d'acceleration + NN elements de position angulaire
+            shock_posture = list(ast.literal_eval(json_message["shock"]))
+            shock_posture = shock_posture + list(ast.literal_eval(json_message["position"]))
+        vit_marche = float(json_message["speed"])
+        temps_marche = int(json_message["uptime"])
+
+        # écriture différée et groupée avec les autres dispositifs (voir flush_trackers)
+        self.__bd.buffer_tracker(
+            macAdd=myDev,
+            lec_wifi=lect_wifi,
+            nb_pas=nb_pas,
+            acc_vector=shock_posture,
+            power=power,
+            walk_speed=vit_marche,
+            act_time=temps_marche
+        )
+
+    def __process_linto(self, json_message: dict):
+        # ici c'est le traitement des information LinTO
+        # trace de l'information reçue pour releves/transmissions
+        logging.debug(f"DATA-COLLECTOR --> Reception of Voice Data from LinTO")
+        myRoom = json_message["chambre"]
+        myObs = json_message["type"]
+        myVals = json.loads(json_message["values"])
+        if myObs == "Questionnaire":
+            self.__bd.set_filledForm(room=myRoom, values=myVals)
+        elif myObs == "ChambreEntiere":
+            myUser = json_message["idUser"]
+            self.__bd.setBedroomInfoBlock(room=myRoom, values=myVals, idPer=myUser)
+        else:
+            # ceci est l'ancienne méthode
+            # self.__bd.set_observable(myObs, myVals, myRoom)
+            logging.debug(f"DATA-COLLECTOR --> Reception of Voice Data from LinTO in wrong format")
+
+    # ========= TOUTE CETTE PARTIE TRAITE WITHINGS  =================
+    def __get_patient(self, json_message: dict):
+        """
+        Correspondance user Withings et patient
+        :return: (patient_id, patient) ou None si l'utilisateur n'est lié à aucun patient
+        """
+        wgs_user_id = json_message["userid"]
+        patient_id = self.__bd.get_patient_from_wgs_user(wgs_user_id=wgs_user_id)
+
+        if not patient_id:
+            logging.debug(f"DATA-COLLECTOR --> API_user={wgs_user_id} is linked to any patient. "
+                          f"NOTHING TO DO")
+            return None
+        try:
+            patient_id = int(patient_id[0][0])
+        except TypeError:
+            logging.debug(f"DATA-COLLECTOR --> API_user={wgs_user_id} is linked to any patient. "
+                          f"NOTHING TO DO")
+            return None
+        return patient_id, self.__bd.get_room_of_patient(patient_id) or {"Chambre": None}
+
+    @staticmethod
+    def __get_date(json_message: dict) -> int:
+        # c'est la date de reception de la notification
+        if "date" in json_message:
+            return int(json_message["date"])
+        return 0
+
+    def __process_bed_in(self, json_message: dict):
+        found = self.__get_patient(json_message)
+        if not found:
+            return
+        patient_id, current_patient = found
+        logging.info(
+            f"Reception BED_IN for patId={patient_id}"
+            f" on room={current_patient['Chambre']}"
+        )
+        # posture écrite avant l'évènement lit qui réveille le BedMonitor,
+        # qui relit alors le patient
+        self.__bd.update_patient_posture(patient_id, PatientConst.LYING.value)
+        self.__bd.update_bed_notify(
+            patient_id, bed_type=PatientConst.BED_IN.value,
+            noti_date=self.__get_date(json_message)
+        )
+
+    def __process_bed_out(self, json_message: dict):
+        found = self.__get_patient(json_message)
+        if not found:
+            return
+        patient_id, current_patient = found
+        logging.info(
+            f"Reception BED_OUT for patId={patient_id}"
+            f" on room={current_patient['Chambre']}"
+        )
+        # posture écrite avant l'évènement lit qui réveille le BedMonitor,
+        # qui relit alors le patient
+        self.__bd.update_patient_posture(patient_id, PatientConst.STANDING.value)
+        self.__bd.update_bed_notify(
+            patient_id, bed_type=PatientConst.BED_OUT.value,
+            noti_date=self.__get_date(json_message)
+        )
+
+    def __process_sleep(self, json_message: dict):
+        # ce sont les données du matelas AURA2
+        found = self.__get_patient(json_message)
+        if not found:
+            return
+        patient_id, current_patient = found
+        current_api = self.__bd.read_patient_api(patient_id=patient_id, provider='Withings')[0]
+        logging.info(
+            f"Reception AURA2 for patId={patient_id}"
+            f" on room={current_patient['Chambre']}"
+        )
+        d_ini = arrow.get(int(json_message["startdate"]))
+        d_end = arrow.get(int(json_message["enddate"]))
+
+        # partie résumé de la nuit
+        new_summary = MyWithingsApi.get_sleep_summary(
+            access_token=current_api['AccessToken'],
+            startdate=d_ini,
+            enddate=d_end)
+
+        if new_summary:
+            d_min = arrow.get(new_summary["DateDebut"])
+            self.__bd.insert_sleep_summary(patient=patient_id,
+                                           date_nuit=d_min.format('YYYY-MM-DD'),
+                                           data=new_summary)
+
+            # cet element nous permettra de faire le calcul des sorties de lit
+            new_data_api = MyWithingsApi.get_sleep_allseries(
+                access_token=current_api['AccessToken'],
+                startdate=d_ini,
+                enddate=d_end)
+
+            # partie calcul des trous dans la nuit
+            if new_data_api is not None:
+                my_dict = self.get_outs_of_bed(new_data_api[["Time"]])
+                self.__bd.insert_bedouts_summary(patient=patient_id,
+                                                 date_nuit=d_min.format('YYYY-MM-DD'),
+                                                 bedouts_summ=my_dict)
 
     @staticmethod
-    def __get_outs_of_bed(time_series: pd.DataFrame) -> dict:
+    def get_outs_of_bed(time_series: pd.DataFrame, by=None, min_gap=60) -> dict:
         """
         This functions evaluates the number of times out of bed during the night
-        and also the total time out of bed
+        and also the total time out of bed. A gap between two consecutive timestamps
+        greater than min_gap seconds is an out of bed.
         :param time_series: the Pandas dataframe containing the time series
-        :return: a dict of integers containing #number of outs, total seconds out of bed,
-        timestamp of first BED_IN, timestamp of last BED_OUT
+        ("Time" in seconds, ordered)
+        :param by: optional column of time_series (night, patient...) to evaluate several series
+        in one call, gaps are never computed across two different values of this column
+        :param min_gap: minimum gap in seconds to be counted as an out of bed
+        :return: a dict of integers containing #number of outs, total seconds out of bed and
+        the details {start of the gap: duration}, or a dict of such dicts indexed by the values
+        of `by`
         """
-        counts = 0
-        total_secs = 0
-        last_time = time_series.iloc[0]["Time"].item()
-        n_rows = len(time_series.index)
-        # details = dict()
-        my_list = []
-        for ii in range(1, n_rows-1):
-            current_time = time_series.iloc[ii]["Time"].item()
-            diff_time = current_time - last_time
-            if diff_time > 60:
-                counts += 1
-                total_secs += diff_time
-                my_list.append( (str(arrow.get(last_time).format("DD-MM-YYYY HH:mm:ss")), diff_time) )
-                # details[str(arrow.get(last_time).time())] = diff_time
-            last_time = current_time
-        details = dict(my_list)
-        return {'counts': counts, 'total_secs': total_secs, 'details': details}
+        times = time_series["Time"].to_numpy(dtype=np.int64)
+        diffs = np.diff(times)
+        gaps = diffs > min_gap
+        if by is not None:
+            keys = time_series[by].to_numpy()
+            gaps &= keys[1:] == keys[:-1]
+        gap_index = np.flatnonzero(gaps)
+        # seules les lignes de début de trou sont formatées
+        starts = pd.to_datetime(times[gap_index], unit="s").strftime("%d-%m-%Y %H:%M:%S")
+        durations = diffs[gap_index]
+
+        if by is None:
+            return {'counts': len(gap_index), 'total_secs': int(durations.sum()),
+                    'details': dict(zip(starts, durations.tolist()))}
+
+        result = {key: {'counts': 0, 'total_secs': 0, 'details': dict()}
+                  for key in pd.unique(keys)}
+        for key, start, duration in zip(keys[gap_index], starts, durations.tolist()):
+            summary = result[key]
+            summary['counts'] += 1
+            summary['total_secs'] += duration
+            summary['details'][start] = duration
+        return result
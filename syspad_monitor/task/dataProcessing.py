@@ -2,7 +2,6 @@
 import json
 import logging
 import time
-from threading import Thread
 import os
 import pandas as pd
 import pickle
@@ -13,18 +12,20 @@ from syspad_monitor.model.fingerPrinting import loc_fingerprinting
 from syspad_monitor.model.feature_extractor import FeatureExtractor
 
 
-class DataProcessor(Thread):
+class DataProcessor:
     """
     Cette classe permet de surveiller les données du patient et enregistrer une alarme dans la
     BD si nécessaire
     """
-    # par défaut 10 secondes de sleep du Thread pour vérifier si nouvelles données
+    # période du job de traitement des nouvelles données : 10 secondes
     REFRESH_TIME = 10
+    # probabilité de chute à partir de laquelle une alarme HIGH est levée
+    FALL_THRESHOLD = 0.5
+    # classe "chute" de l'estimateur (estimator.pickle : 1 chute, 2 activité quotidienne)
+    FALL_LABEL = 1
     def __init__(self, bd: SysPadDb_encry, minutes_out_of_bounds: int, loc_params=None, classifier_params=None):
         self.__bd = bd
         self.__thread_name = f"DATA-PROCESSING"
-        Thread.__init__(self, name=self.__thread_name, target=self.run)
-        self.stop = False
         self.__conMin = minutes_out_of_bounds
         self.__fgpt = None #fingerprinting
         if loc_params and len(loc_params)==3:
@@ -38,6 +39,8 @@ class DataProcessor(Thread):
                                              )
         self.__estimator = None
         self.__featureExtractor = None
+        self.__threshold = self.FALL_THRESHOLD
+        self.__fallLabel = self.FALL_LABEL
         if classifier_params is not None:
             try:
                 with open(os.path.join("model", classifier_params['file']), 'rb') as f:
@@ -47,66 +50,130 @@ class DataProcessor(Thread):
                 logging.warning(f"Could not load estimator, prediction is disabled")
             lmt, umt, it, fs = classifier_params['lmt'], classifier_params['umt'], classifier_params['it'], classifier_params['fs']
             self.__featureExtractor = FeatureExtractor(lmt, umt, it, fs)
+            self.__threshold = classifier_params.get('threshold', self.FALL_THRESHOLD)
+            self.__fallLabel = classifier_params.get('fall_label', self.FALL_LABEL)
         else:
             logging.warning(f"Could not load estimator, prediction will be disabled")
 
         self.__battAlarms = []
 
-    def run(self):
-        logging.info(f"DATA-PROCESSING --> Started")
-        while not self.stop:
-            for tracker in self.__bd.get_trackers(): # retourne uniquement les trackers mis à jour
-                if tracker["PatientId"]: # traitement seulement si le tracker est attaché à un résident
-                    # traitement de la localisation
-                    my_pos = None
-                    if self.__fgpt:
-                        my_pos = self.__fgpt.perform_loc(tracker["LecturesWifi"])
+    def process_trackers(self):
+        """ Un passage de traitement des trackers mis à jour
+            (pas, chute, batterie, localisation)
+        """
+        falls = []
+        trackers = self.__bd.get_trackers() # retourne uniquement les trackers mis à jour
+        # traitement de la localisation, en un seul appel pour les trackers attachés à un résident
+        positions = [None] * len(trackers)
+        if self.__fgpt:
+            attached = [ii for ii, tracker in enumerate(trackers) if tracker["PatientId"]]
+            located = self.__fgpt.perform_loc_many([trackers[ii]["LecturesWifi"]
+                                                    for ii in attached])
+            for ii, my_pos in zip(attached, located):
+                positions[ii] = my_pos
+        for tracker, my_pos in zip(trackers, positions):
+            if tracker["PatientId"]: # traitement seulement si le tracker est attaché à un résident
 
-                    # traitement des pas pour la journée en cours
-                    self.__bd.insert_day_steps(
-                        patient=tracker["PatientId"],
-                        date_jour=tracker["LastUpdate"].strftime('%Y-%m-%d'),
-                        steps=tracker["NbPas"],
-                        activityTime=tracker["ActivityTime"],
-                        stepfreq=tracker["VitesseMarche"]
+                # traitement des pas pour la journée en cours
+                self.__bd.insert_day_steps(
+                    patient=tracker["PatientId"],
+                    date_jour=tracker["LastUpdate"].strftime('%Y-%m-%d'),
+                    steps=tracker["NbPas"],
+                    activityTime=tracker["ActivityTime"],
+                    stepfreq=tracker["VitesseMarche"]
+                )
+                # traitement de la chute
+                if tracker["AccVector"]:
+                    # cas ou nous avons le vecteur acc et position complets :
+                    # évalué en lot par le classifieur
+                    if len(tracker["AccVector"]) > 2:
+                        falls.append((tracker, my_pos))
+                    # cas ou nous avons les valeurs [-1000,-1000] qui correspond à une chute
+                    # n'ayant pu être transmise en temps réel
+                    else:
+                        self.__fallAlarm(tracker, my_pos,
+                                         f"Evenement à risque survenu il y a quelques minutes",
+                                         AlarmConst.MEDIUM.value)
+                # traitement de l'energie
+                # la batterie contient 400mAh pour le moment
+                if tracker["Power"] < 20.0 and tracker["CapteurId"] not in self.__battAlarms:
+                    msg = (f"Le dispositif MoBy de la chambre {tracker['Chambre']} "
+                           f"a une batterie faible")
+                    self.__alarm(
+                        pat_id=tracker["PatientId"],
+                        message=msg,
+                        level=AlarmConst.LOW.value,
+                        cap_id=tracker["CapteurId"]
+                    )
+                    self.__battAlarms.append(tracker["CapteurId"])
+                if tracker["Power"] > 20.0 and tracker["CapteurId"] in self.__battAlarms:
+                    self.__battAlarms.remove(tracker["CapteurId"])
+            # passage à traité de la nouvelle donnée tracker
+            self.__bd.set_tracker_flag(devId=tracker["Id"], flag=True)
+
+        if falls:
+            probas = self.__fallProbabilities([tracker["AccVector"] for tracker, _ in falls])
+            for (tracker, my_pos), proba in zip(falls, probas):
+                if proba >= self.__threshold:
+                    self.__fallAlarm(tracker, my_pos, f"Evenement à risque detecté",
+                                     AlarmConst.HIGH.value)
+                else:
+                    logging.info(
+                        f"DATA-PROCESSING --> Fall discarded for patient={tracker['PatientId']} "
+                        f"(p={proba:.2f})"
                     )
-                    # traitement de la chute
-                    if tracker["AccVector"]:
-                        # cas ou nous avons le vecteur acc et position complets
-                        if len(tracker["AccVector"]) > 2:
-                            msg = f"Evenement à risque detecté"
-                            lev = AlarmConst.HIGH.value
-                        # cas ou nous avons les valeurs [-1000,-1000] qui correspond à une chute n'ayant pu être transmise en temps réel
-                        else:
-                            msg = f"Evenement à risque survenu il y a quelques minutes"
-                            lev = AlarmConst.MEDIUM.value
-                        if my_pos:
-                            msg += f" autour de {my_pos['Label']}"
-                        self.__alarm(
-                            pat_id=tracker["PatientId"],
-                            message=msg,
-                            level=lev,
-                            cap_id=tracker["CapteurId"]
-                        )
-                    # traitement de l'energie
-                    # la batterie contient 400mAh pour le moment
-                    if tracker["Power"] < 20.0 and tracker["CapteurId"] not in self.__battAlarms:
-                        msg = f"Le dispositif MoBy de la chambre {tracker['Chambre']} a une batterie faible"
-                        self.__alarm(
-                            pat_id=tracker["PatientId"],
-                            message=msg,
-                            level=AlarmConst.LOW.value,
-                            cap_id=tracker["CapteurId"]
-                        )
-                        self.__battAlarms.append(tracker["CapteurId"])
-                    if tracker["Power"] > 20.0 and tracker["CapteurId"] in self.__battAlarms:
-                        self.__battAlarms.remove(tracker["CapteurId"])
-                # passage à traité de la nouvelle donnée tracker
-                self.__bd.set_tracker_flag(devId=tracker["Id"], flag=True)
 
-            self.__splitDataFromRoom()
+        self.__splitDataFromRoom()
 
-            time.sleep(self.REFRESH_TIME)
+    def __fallProbabilities(self, acc_vectors: list) -> np.ndarray:
+        """
+        Probabilité de chute de chaque vecteur en un seul appel au classifieur
+        :param acc_vectors: vecteurs MoBy
+         (NN elements d'acceleration + NN elements de position angulaire)
+        :return: probabilités, 1 pour tous si le classifieur n'est pas disponible, 1 pour
+         les fenêtres dont les caractéristiques ne peuvent pas être calculées
+         (pas de pic d'impact, trop peu d'échantillons)
+        """
+        n_falls = len(acc_vectors)
+        if self.__estimator is None or self.__featureExtractor is None:
+            return np.ones(n_falls)
+        start = time.perf_counter()
+        try:
+            # les fenêtres sont regroupées par longueur pour l'extraction en lot
+            windows = {}
+            for ii, vector in enumerate(acc_vectors):
+                windows.setdefault(len(vector) // 2, []).append(ii)
+            features = np.full((n_falls, len(FeatureExtractor.FEATURES)), np.nan)
+            for length, indexes in windows.items():
+                accs = np.array([acc_vectors[ii][:length] for ii in indexes], dtype=np.float64)
+                features[indexes] = self.__featureExtractor.getFeaturesBatch(accs)
+            # une fenêtre non classable est traitée comme un échec du classifieur :
+            # l'alarme est levée
+            valid = ~np.isnan(features).any(axis=1)
+            probas = np.ones(n_falls)
+            if valid.any():
+                fall_column = list(self.__estimator.classes_).index(self.__fallLabel)
+                probas[valid] = self.__estimator.predict_proba(features[valid])[:, fall_column]
+        except Exception as e:
+            logging.error(f"DATA-PROCESSING --> Fall classification failed, "
+                          f"every event is raised: {e}")
+            return np.ones(n_falls)
+        logging.info(
+            f"DATA-PROCESSING --> {n_falls} fall candidates "
+            f"({n_falls - valid.sum()} not classifiable, raised) "
+            f"classified in {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
+        return probas
+
+    def __fallAlarm(self, tracker: dict, my_pos: dict, msg: str, level: int):
+        if my_pos:
+            msg += f" autour de {my_pos['Label']}"
+        self.__alarm(
+            pat_id=tracker["PatientId"],
+            message=msg,
+            level=level,
+            cap_id=tracker["CapteurId"]
+        )
 
     def __splitDataFromRoom(self):
         # this function will split Block of data from "infoblocchambreview" into single "Observables"
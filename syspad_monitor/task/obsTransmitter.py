@@ -1,9 +1,8 @@
 import json
 import logging
-import time
 import datetime
-from threading import Thread
 from syspad_monitor.database_encry import SysPadDb_encry
+from syspad_monitor.http_client import HttpClient, get_client
 import requests
 import re
 import arrow
@@ -11,18 +10,18 @@ import arrow
 # ceci doit pouvoir être supprimé fin 2021 car MàJ NetSOINS
 requests.packages.urllib3.util.ssl_.DEFAULT_CIPHERS = 'ALL:@SECLEVEL=1'
 
-class ObsTransmitter(Thread):
+class ObsTransmitter:
     """
     Cette classe permet de transmettre les observations faites par le personnel vers
     le logiciel NetSOINS
     """
-    # par défaut 60 secondes de sleep du Thread pour vérifier si nouvelles données
+    # période du job de transmission des observables : 60 secondes
     REFRESH_TIME = 60
 
-    def __init__(self, bd: SysPadDb_encry, crm_url: str, crm_key: str):
+    def __init__(self, bd: SysPadDb_encry, crm_url: str, crm_key: str, http: HttpClient = None):
         self.__bd = bd
+        self.__http = http or get_client()
         self.__thread_name = f"OBS-TRANSMITTER"
-        Thread.__init__(self, name=self.__thread_name, target=self.run)
         # Pour le moment le crm en iterface est NetSOINS
         self.__url = crm_url # https://test.netsoins.org/webservice.php/teranga
         self.__key = crm_key
@@ -33,6 +32,8 @@ class ObsTransmitter(Thread):
         self.__myPersonnels = dict() # ceci est un objet dictionnaire avec les NOM/Prenom <--> URI
         self.__myTransmissions = dict() # ceci est un objet dictionnaire contenant la correspondance UriTrans vs Libellé
         self.__uriSyspad = None # ceci est l'URI du personnel correspondant à SySPAD pour faire les transmissions
+        self.__nightsDate = None # jour de la dernière transmission des nuits
+        self.__daysDate = None # jour de la dernière transmission des jours
         if(self.__url and self.__key):
             self.__iniUriSyspad() # initialise la valeur de uriSyspad
             self.__getPersUri() # mise à jour du personnel NetSOINS
@@ -41,77 +42,71 @@ class ObsTransmitter(Thread):
             self.__getTransUri() # mise à jours des uri/transmissions NetSOINS
             self.__getReleveUri() # obtention des uri/libellés des observables ou relevés --> Mise à jour de la BD et du dict
             self.__associateCaregiversURI() # actualisation des URI des possibles nouveaux utilisateurs SySPAD
-            self.stop = False
+            self.enabled = True
         else:
-            self.stop = True
-
-    def run(self):
-        if (not self.stop):
-            logging.info(f"OBS-TRANSMITTER --> Started")
-        else:
-            logging.info(f"OBS-TRANSMITTER --> Not Started because any URL and KEY available")
-        done_for_the_day = False
-        nights_done = False
-        days_done = False
-        while not self.stop:
-            # mise à jour des données NetSOINS pour les résidents chaque mi-nuit
-            # et aussi pour le personnel NetSOINS et la cohérence avec SySPAD users
-            myTimeNow = datetime.datetime.now().time()
-            if not done_for_the_day and myTimeNow > datetime.time(23, 50):
-                self.__getResUri()
-                # self.__getResExtendedUri()
-                self.__getTransUri()
-                self.__getPersUri()
-                done_for_the_day = True
-            if done_for_the_day and myTimeNow < datetime.time(0, 10):
-                done_for_the_day = False
-
-            # traitement des observables enregistrés via LinTO
-            for observable in self.__bd.get_all_observables():
-                tout_ok = False
-                if observable['Type'] == 'Transmission':
-                    tout_ok = self.__transmitTrans(observable)
-                else:
-                    tout_ok = self.__transmitReleve(observable)
-                if not tout_ok:
-                    logging.error(f"OBS-TRANSMITTER --> Problème de transmission vers NetSOINS")
-                else:
-                    # passage de l'observable à traité
-                    self.__bd.change_obs_flag(obs_id=observable['Id'])
-                # effacer la ligne de la table si c'est une donnée médicale
-                #if self.__isMedical(observable['Type']):
-                    #self.__bd.erase_observable(obs_id=observable['Id'])
-
-            # traitement des observables enregistrés via Withings SLEEP (dans table Nuits)
-            # this is done at 12h in order to wait for all night data
-            if not nights_done and myTimeNow > datetime.time(12, 0):
-                for id in self.__bd.get_ids_from_nights():
-                    all_good = True
-                    all_good = all_good and self.__transmitNight(night=self.__bd.get_SLEEP_from_nights(id)[0])
-                    if all_good:
-                        # update table
-                        logging.info(f"Updating night flag to NuitTraitee...")
-                        self.__bd.update_night_flagTraitee(night_id=id)
-                nights_done = True
-            elif nights_done and myTimeNow < datetime.time(0, 10):
-                nights_done = False
-
-            # traitement des observables enregistrés via Withings DAY & MoBY
-            # this is done at 23h50
-            if not days_done and myTimeNow > datetime.time(23,50):
-                for day in self.__bd.get_days():
-                    if self.__transmitDay(day):
-                        # effacer la ligne de la table
-                        logging.info(f"Updating day flag to JourTraite...")
-                        self.__bd.update_day_flagTraitee(day_id=day['Id'], flag=True)
-                        # self.__bd.erase_day(day['Id'])
-            elif days_done and myTimeNow < datetime.time(0, 10):
-                days_done = False
-
-            # if a new SySPAD user has been declared in the System
-            self.__associateCaregiversURI()
-
-            time.sleep(self.REFRESH_TIME)
+            logging.info(f"OBS-TRANSMITTER --> Désactivé car aucune URL et clé NetSOINS")
+            self.enabled = False
+
+    @property
+    def nights_date(self) -> datetime.date:
+        """ Jour de la dernière transmission des nuits (None si pas encore faite) """
+        return self.__nightsDate
+
+    @property
+    def days_date(self) -> datetime.date:
+        """ Jour de la dernière transmission des jours (None si pas encore faite) """
+        return self.__daysDate
+
+    def refresh_references(self):
+        """ Mise à jour des résidents, transmissions et personnels NetSOINS (une fois par jour) """
+        self.__getResUri()
+        # self.__getResExtendedUri()
+        self.__getTransUri()
+        self.__getPersUri()
+
+    def transmit_observables(self):
+        """ Transmission des observables enregistrés via LinTO
+            et association des nouveaux utilisateurs SySPAD
+        """
+        for observable in self.__bd.get_all_observables():
+            tout_ok = False
+            if observable['Type'] == 'Transmission':
+                tout_ok = self.__transmitTrans(observable)
+            else:
+                tout_ok = self.__transmitReleve(observable)
+            if not tout_ok:
+                logging.error(f"OBS-TRANSMITTER --> Problème de transmission vers NetSOINS")
+            else:
+                # passage de l'observable à traité
+                self.__bd.change_obs_flag(obs_id=observable['Id'])
+            # effacer la ligne de la table si c'est une donnée médicale
+            #if self.__isMedical(observable['Type']):
+                #self.__bd.erase_observable(obs_id=observable['Id'])
+
+        # if a new SySPAD user has been declared in the System
+        self.__associateCaregiversURI()
+
+    def transmit_nights(self):
+        """ Transmission des observables enregistrés via Withings SLEEP (dans table Nuits) """
+        for id in self.__bd.get_ids_from_nights():
+            all_good = True
+            night = self.__bd.get_SLEEP_from_nights(id)[0]
+            all_good = all_good and self.__transmitNight(night=night)
+            if all_good:
+                # update table
+                logging.info(f"Updating night flag to NuitTraitee...")
+                self.__bd.update_night_flagTraitee(night_id=id)
+        self.__nightsDate = datetime.date.today()
+
+    def transmit_days(self):
+        """ Transmission des observables enregistrés via Withings DAY & MoBY """
+        for day in self.__bd.get_days():
+            if self.__transmitDay(day):
+                # effacer la ligne de la table
+                logging.info(f"Updating day flag to JourTraite...")
+                self.__bd.update_day_flagTraitee(day_id=day['Id'], flag=True)
+                # self.__bd.erase_day(day['Id'])
+        self.__daysDate = datetime.date.today()
 
     def __isMedical(self, my_type:str) -> bool:
         isMedical = True
@@ -296,7 +291,8 @@ class ObsTransmitter(Thread):
                     ]
                 }
             ]
-        response = requests.post(self.__url + '/Transmission', headers=headers, params=params, data=json.dumps(mydata))
+        response = self.__http.post(self.__url + '/Transmission', headers=headers, params=params,
+                                    data=json.dumps(mydata))
         mycode = json.loads(response.text)
         if response.status_code == 200 and mycode['WS-Code'] == 0:
             logging.info(f"Transation vers NETSOINS OK --> Id = {mydata[0]['IdentifiantExterne']}")
@@ -378,7 +374,8 @@ class ObsTransmitter(Thread):
             "DatePrevue": jour12h, #f"{night['DateFin'].isoformat()}",
             "Commentaire": "Relevé SySPAD \n" + comment
         }]
-        response = requests.post(self.__url + '/ResidentReleveValeur', headers=headers, params=params, data=json.dumps(mydata))
+        response = self.__http.post(self.__url + '/ResidentReleveValeur', headers=headers,
+                                    params=params, data=json.dumps(mydata))
         mycode = json.loads(response.text)
         if response.status_code == 200 and mycode['WS-Code'] == 0:
             logging.info(f"Transation vers NETSOINS OK --> Id = {mydata[0]['IdentifiantExterne']}")
@@ -448,7 +445,8 @@ class ObsTransmitter(Thread):
             "DateFait": f"{observable['Date'].isoformat()}",
             "Commentaire": my_commentaire
         }]
-        response = requests.post(self.__url + '/ResidentReleveValeur', headers=headers, params=params, data=json.dumps(mydata))
+        response = self.__http.post(self.__url + '/ResidentReleveValeur', headers=headers,
+                                    params=params, data=json.dumps(mydata))
         mycode = json.loads(response.text)
         if response.status_code == 200 and mycode['WS-Code'] == 0:
             logging.info(f"Transation vers NETSOINS OK --> Id = {mydata[0]['IdentifiantExterne']}")
@@ -484,7 +482,8 @@ class ObsTransmitter(Thread):
             ('output', 'json'),
             ('fields', 'Uri,Libelle'),
         )
-        response = requests.get(self.__url + "/TransmissionCible", headers=headers, params=params)
+        response = self.__http.get(self.__url + "/TransmissionCible", headers=headers,
+                                   params=params)
         dict_str = response.content.decode("UTF-8")
         my_data = json.loads(dict_str)['TransmissionCible']
         mycode = json.loads(dict_str)['WS-Code']
@@ -524,7 +523,7 @@ class ObsTransmitter(Thread):
             ('fields', 'Uri,Nom'),
         )
 
-        response = requests.get(self.__url + '/Personnel', headers=headers, params=params)
+        response = self.__http.get(self.__url + '/Personnel', headers=headers, params=params)
         dict_str = response.content.decode("UTF-8")
         my_data = json.loads(dict_str)['Personnel']
         for per in my_data:
@@ -563,7 +562,7 @@ class ObsTransmitter(Thread):
             ('module', '1'),
             ('UriResident', uriRes),
         )
-        response = requests.get(self.__url + "/Transmission", headers=headers, params=params)
+        response = self.__http.get(self.__url + "/Transmission", headers=headers, params=params)
         dict_str = response.content.decode("UTF-8")
         try:
             my_data = json.loads(dict_str)['Transmission']
@@ -596,7 +595,8 @@ class ObsTransmitter(Thread):
             "Commentaire": "Création automatique par SySPAD"
         }]
 
-        response = requests.post(self.__url + '/Personnel', headers=headers, params=params, data=json.dumps(mydata))
+        response = self.__http.post(self.__url + '/Personnel', headers=headers, params=params,
+                                    data=json.dumps(mydata))
         mycode = json.loads(response.text)
         if response.status_code == 200 and mycode['WS-Code'] == 0:
             logging.debug(f"Création utilisateur SYSPAD OK")
@@ -623,7 +623,7 @@ class ObsTransmitter(Thread):
             ('statut_archive', 'tous'),
             ('situation', 'present'),
         )
-        response = requests.get(self.__url + "/Resident", headers=headers, params=params)
+        response = self.__http.get(self.__url + "/Resident", headers=headers, params=params)
         dict_str = response.content.decode("UTF-8")
         my_data = json.loads(dict_str)['Resident']
         for res in my_data:
@@ -660,7 +660,7 @@ class ObsTransmitter(Thread):
             ('statut_archive', 'tous'),
             ('situation', 'present'),
         )
-        response = requests.get(self.__url + "/Resident", headers=headers, params=params)
+        response = self.__http.get(self.__url + "/Resident", headers=headers, params=params)
         dict_str = response.content.decode("UTF-8")
         my_data = json.loads(dict_str)['Resident']
         for res in my_data:
@@ -689,7 +689,7 @@ class ObsTransmitter(Thread):
             ('fields', 'Uri,Libelle'),
         )
 
-        response = requests.get(self.__url+'/Releve', headers=headers, params=params)
+        response = self.__http.get(self.__url+'/Releve', headers=headers, params=params)
         dict_str = response.content.decode("UTF-8")
         my_data = json.loads(dict_str)['Releve']
         for rel in my_data:
@@ -700,7 +700,8 @@ class ObsTransmitter(Thread):
         self.__bd.update_uri_typeObservable(libelle="Transmission", new_uri=None)
 
     def __getPersUri(self):
-        self.__myPersonnels = ObsTransmitter.getCaregiversList(self.__url, self.__type, self.__key)
+        self.__myPersonnels = ObsTransmitter.getCaregiversList(self.__url, self.__type, self.__key,
+                                                               http=self.__http)
 
     def __findUriPersByNameSurname(self, nom:str, prenom:str) -> str:
         for personnel in self.__myPersonnels:
@@ -730,7 +731,8 @@ class ObsTransmitter(Thread):
         return prenom_nom
 
     @staticmethod
-    def getCaregiversList(url:str, type:str, key:str, restrictedTo=None) -> []:
+    def getCaregiversList(url:str, type:str, key:str, restrictedTo=None,
+                          http: HttpClient = None) -> []:
         """
         Cette méthode permet de recupérer la liste du Personnel de l'EHPAD
         :return: un objet de type liste/array
@@ -744,7 +746,7 @@ class ObsTransmitter(Thread):
             ('output', 'json'),
             ('fields', 'Uri,Actif,Nom,Prenom'),
         )
-        response = requests.get(url + "/Personnel", headers=headers, params=params)
+        response = (http or get_client()).get(url + "/Personnel", headers=headers, params=params)
         dict_str = response.content.decode("UTF-8")
         my_data = json.loads(dict_str)['Personnel']
 
@@ -760,12 +762,13 @@ class ObsTransmitter(Thread):
 
 
     @staticmethod
-    def getReleveList(url:str, type:str, key:str) -> []:
+    def getReleveList(url:str, type:str, key:str, http: HttpClient = None) -> []:
         """
         Cette méthode permet de recupérer la liste de releves possibles dans l'EHPAD
         :param url:
         :param type:
         :param key:
+        :param http: client HTTP, le client partagé par défaut
         :return:
         """
         headers = {
@@ -779,7 +782,7 @@ class ObsTransmitter(Thread):
             ('fields', 'Libelle'),
         )
 
-        response = requests.get(url+'/Releve', headers=headers, params=params)
+        response = (http or get_client()).get(url+'/Releve', headers=headers, params=params)
         dict_str = response.content.decode("UTF-8")
         my_data = json.loads(dict_str)['Releve']
         mycode = json.loads(dict_str)['WS-Code']
@@ -794,12 +797,13 @@ class ObsTransmitter(Thread):
         return res_data
 
     @staticmethod
-    def getTransmissionList(url:str, type:str, key:str) -> []:
+    def getTransmissionList(url:str, type:str, key:str, http: HttpClient = None) -> []:
         """
         Cette méthode permet de recupérer la liste de releves possibles dans l'EHPAD
         :param url:
         :param type:
         :param key:
+        :param http: client HTTP, le client partagé par défaut
         :return:
         """
         headers = {
@@ -811,7 +815,8 @@ class ObsTransmitter(Thread):
             ('output', 'json'),
             ('fields', 'Libelle'),
         )
-        response = requests.get(url + "/TransmissionCible", headers=headers, params=params)
+        response = (http or get_client()).get(url + "/TransmissionCible", headers=headers,
+                                              params=params)
         dict_str = response.content.decode("UTF-8")
         my_data = json.loads(dict_str)['TransmissionCible']
         mycode = json.loads(dict_str)['WS-Code']
@@ -0,0 +1,279 @@
+# coding: utf8
+import heapq
+import itertools
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Condition, Thread
+
+
+class CronExpression:
+    """
+    Expression cron à 5 champs "minute heure jour mois jour_semaine" (heure locale)
+
+    Chaque champ accepte *, une valeur, une plage a-b, un pas */n, a/n (de a au maximum) ou a-b/n
+    et des listes séparées par des virgules. Jour de la semaine : 0 ou 7 = dimanche.
+    """
+    FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12),
+              ("weekday", 0, 7))
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != len(self.FIELDS):
+            raise ValueError(f"expression cron invalide (5 champs attendus): {expression}")
+        self.expression = expression
+        self.__values = dict()
+        for text, (name, low, high) in zip(fields, self.FIELDS):
+            self.__values[name] = self.__parse(text, low, high)
+        if 7 in self.__values["weekday"]:
+            self.__values["weekday"] = (self.__values["weekday"] - {7}) | {0}
+        # comme cron : si jour et jour de semaine sont restreints, l'un ou l'autre suffit
+        self.__any_day = fields[2] == "*"
+        self.__any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def __parse(text: str, low: int, high: int) -> frozenset:
+        values = set()
+        for part in text.split(","):
+            body, _, step = part.partition("/")
+            if body == "*":
+                first, last = low, high
+            elif "-" in body:
+                first, last = (int(bound) for bound in body.split("-", 1))
+            else:
+                first = last = int(body)
+                if step:
+                    last = high
+            if not low <= first <= last <= high:
+                raise ValueError(f"valeur hors limites [{low}, {high}]: {part}")
+            values.update(range(first, last + 1, int(step) if step else 1))
+        return frozenset(values)
+
+    def __day_matches(self, date: datetime) -> bool:
+        day_ok = date.day in self.__values["day"]
+        weekday_ok = (date.weekday() + 1) % 7 in self.__values["weekday"]
+        if self.__any_day or self.__any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, after: datetime) -> datetime:
+        """ Première date (à la minute) strictement postérieure à after
+            correspondant à l'expression
+        """
+        date = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = date + timedelta(days=366 * 4)
+        while date < limit:
+            if date.month not in self.__values["month"]:
+                date = (date.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.__day_matches(date):
+                date = date.replace(hour=0, minute=0) + timedelta(days=1)
+            elif date.hour not in self.__values["hour"]:
+                date = date.replace(minute=0) + timedelta(hours=1)
+            elif date.minute not in self.__values["minute"]:
+                date += timedelta(minutes=1)
+            else:
+                return date
+        raise ValueError(f"l'expression cron ne correspond à aucune date: {self.expression}")
+
+    def previous_today(self, before: datetime):
+        """ Dernière date (à la minute) du jour de before, antérieure ou égale à before,
+            correspondant à l'expression
+
+            :return: None si aucune échéance n'est passée ce jour
+        """
+        if before.month not in self.__values["month"] or not self.__day_matches(before):
+            return None
+        for hour in sorted(self.__values["hour"], reverse=True):
+            if hour > before.hour:
+                continue
+            for minute in sorted(self.__values["minute"], reverse=True):
+                if hour == before.hour and minute > before.minute:
+                    continue
+                return before.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return None
+
+
+class _Job:
+
+    def __init__(self, name: str, fn, interval=None, cron=None, jitter=0.0, max_concurrency=1,
+                 executor=None):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.cron = cron
+        self.jitter = jitter
+        self.max_concurrency = max_concurrency
+        self.executor = executor # pool propre au job, None pour le pool partagé
+        self.running = 0
+        self.next_run = None
+        self.stats = {"runs": 0, "errors": 0, "overruns": 0, "last_runtime": 0.0,
+                      "total_runtime": 0.0, "max_runtime": 0.0, "last_start": None}
+
+    def schedule_next(self, now: float):
+        if self.cron is not None:
+            next_run = self.cron.next_after(datetime.fromtimestamp(now)).timestamp()
+        else:
+            next_run = now + self.interval
+        self.next_run = next_run + random.uniform(0, self.jitter)
+
+
+class TaskScheduler(Thread):
+    """
+    Ordonnanceur des taches périodiques : un seul thread gère les échéances de tous les jobs
+    (tas binaire), les jobs sont exécutés par un pool de WORKERS threads.
+
+    Un job encore en cours max_concurrency fois à son échéance n'est pas relancé : l'occurrence
+    est comptée comme dépassement (overrun) et le job est reprogrammé à l'échéance suivante.
+    Un job court et fréquent peut avoir ses propres threads (dedicated) pour ne pas attendre
+    derrière les jobs longs du pool.
+
+    Les échéances des jobs périodiques suivent l'horloge monotone (insensible aux corrections NTP),
+    celles des jobs cron l'heure murale, dans deux tas séparés.
+    """
+    WORKERS = 8
+    # les échéances cron sont comparées à l'heure murale au moins toutes les WALL_CHECK secondes
+    WALL_CHECK = 60
+
+    def __init__(self, workers=WORKERS, name="SCHEDULER"):
+        Thread.__init__(self, name=name, target=self.run, daemon=True)
+        self.__pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.__jobs = dict()
+        self.__heap = [] # jobs périodiques (échéance monotone, numéro, job)
+        self.__cron_heap = [] # jobs cron (échéance murale, numéro, job)
+        self.__seq = itertools.count()
+        self.__cond = Condition()
+        self.stop = False
+
+    def add_interval(self, name: str, fn, interval: float, jitter=0.0, max_concurrency=1,
+                     first_delay=0.0, dedicated=False):
+        """ Exécute fn toutes les interval secondes (plus un délai aléatoire entre 0 et jitter)
+
+            :param first_delay: délai avant la première exécution
+            :param dedicated: exécuté par max_concurrency threads propres au job
+             plutôt que par le pool partagé
+        """
+        executor = None
+        if dedicated:
+            executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=name)
+        job = _Job(name, fn, interval=interval, jitter=jitter, max_concurrency=max_concurrency,
+                   executor=executor)
+        job.next_run = time.monotonic() + first_delay + random.uniform(0, jitter)
+        self.__add(job)
+
+    def add_cron(self, name: str, fn, cron: str, jitter=0.0, max_concurrency=1, last_run=None):
+        """ Exécute fn aux dates de l'expression cron (ex. "30 23 * * *" tous les jours à 23h30)
+
+            :param last_run: fonction donnant la date (datetime.date) de la dernière exécution
+             de fn, None si jamais faite : une échéance du jour déjà passée et pas encore faite
+             est rattrapée dès la déclaration (démarrage ou redémarrage de l'ordonnanceur)
+        """
+        job = _Job(name, fn, cron=CronExpression(cron), jitter=jitter,
+                   max_concurrency=max_concurrency)
+        now = time.time()
+        job.schedule_next(now)
+        if last_run is not None:
+            missed = job.cron.previous_today(datetime.fromtimestamp(now))
+            done = last_run()
+            if missed is not None and (done is None or done < missed.date()):
+                logging.info(f"{self.name} --> {name} : échéance de {missed.time()} rattrapée")
+                job.next_run = now
+        self.__add(job)
+
+    def remove(self, name: str) -> bool:
+        """ Retire un job, une exécution en cours se termine normalement """
+        with self.__cond:
+            # l'entrée reste dans le tas et sera ignorée à son échéance
+            job = self.__jobs.pop(name, None)
+        if job is not None and job.executor is not None:
+            job.executor.shutdown(wait=False)
+        return job is not None
+
+    @property
+    def stats(self) -> dict:
+        """ Métriques par job
+
+            :return: {job: exécutions, erreurs, dépassements, exécutions en cours,
+             durées dernière/moyenne/max (s), prochaine exécution}
+            :rtype: dict
+        """
+        with self.__cond:
+            stats = dict()
+            for name, job in self.__jobs.items():
+                values = dict(job.stats, running=job.running)
+                runs = values["runs"]
+                values["avg_runtime"] = values["total_runtime"] / runs if runs else 0.0
+                next_run = job.next_run
+                if job.cron is None:
+                    next_run += time.time() - time.monotonic()
+                values["next_run"] = datetime.fromtimestamp(next_run).isoformat(timespec="seconds")
+                stats[name] = values
+        return stats
+
+    def run(self):
+        logging.info(f"{self.name} --> Started with {len(self.__jobs)} job(s)")
+        while not self.stop:
+            with self.__cond:
+                due = []
+                timeout = self.WALL_CHECK if self.__cron_heap else None
+                for heap, clock in ((self.__heap, time.monotonic), (self.__cron_heap, time.time)):
+                    now = clock()
+                    while heap and heap[0][0] <= now:
+                        _, _, job = heapq.heappop(heap)
+                        if self.__jobs.get(job.name) is not job:
+                            continue
+                        due.append(job)
+                        job.schedule_next(max(now, job.next_run))
+                        heapq.heappush(heap, (job.next_run, next(self.__seq), job))
+                    if heap:
+                        wait = heap[0][0] - now
+                        timeout = wait if timeout is None else min(timeout, wait)
+                for job in due:
+                    if job.running >= job.max_concurrency:
+                        job.stats["overruns"] += 1
+                        logging.warning(f"{self.name} --> {job.name} toujours en cours, "
+                                        f"exécution sautée")
+                        continue
+                    job.running += 1
+                    (job.executor or self.__pool).submit(self.__execute, job)
+                if not due:
+                    self.__cond.wait(timeout)
+        self.__pool.shutdown(wait=False)
+        with self.__cond:
+            executors = [job.executor for job in self.__jobs.values() if job.executor is not None]
+        for executor in executors:
+            executor.shutdown(wait=False)
+
+    def __add(self, job: _Job):
+        with self.__cond:
+            if job.name in self.__jobs:
+                raise ValueError(f"job déjà déclaré: {job.name}")
+            self.__jobs[job.name] = job
+            heap = self.__cron_heap if job.cron is not None else self.__heap
+            heapq.heappush(heap, (job.next_run, next(self.__seq), job))
+            self.__cond.notify()
+
+    def __execute(self, job: _Job):
+        start = time.monotonic()
+        failed = False
+        try:
+            job.fn()
+        except Exception as error:
+            failed = True
+            logging.exception(f"{self.name} --> erreur du job {job.name}: {error}")
+        finally:
+            runtime = time.monotonic() - start
+            with self.__cond:
+                job.running -= 1
+                stats = job.stats
+                stats["runs"] += 1
+                stats["errors"] += int(failed)
+                stats["last_runtime"] = runtime
+                stats["total_runtime"] += runtime
+                stats["max_runtime"] = max(stats["max_runtime"], runtime)
+                last_start = datetime.fromtimestamp(time.time() - runtime)
+                stats["last_start"] = last_start.isoformat(timespec="seconds")
+            if job.interval is not None and runtime > job.interval:
+                logging.warning(f"{self.name} --> {job.name} a duré {runtime:.1f}s, "
+                                f"plus que sa période ({job.interval}s)")
@@ -1,116 +1,223 @@
 # coding: utf8
 import json
 import logging
+import os
 import time
 import arrow
 import datetime
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-from threading import Thread
+from threading import Lock
 
 from syspad_monitor.database_encry import SysPadDb_encry
+from syspad_monitor.http_client import HttpClient, get_client
 from syspad_monitor.task import PatientConst, AlarmConst
 from syspad_monitor.model.score import Score
 
 
 
-class ScorePredictor(Thread):
+class ScorePredictor:
     """
     Cette classe permet de surveiller les données du patient et enregistrer une alarme dans la
     BD si nécessaire
     """
-    # reveil du Thread tous les 15min
-    REFRESH_TIME = 900
-    def __init__(self, bd: SysPadDb_encry, crm_url=None, crm_key=None):
+    # requêtes NetSOINS simultanées pendant l'imputation
+    # et timeout (connexion, lecture) en secondes
+    CRM_WORKERS = 4
+    CRM_TIMEOUT = (5, 30)
+    # relevés NetSOINS utilisés pour l'imputation
+    CRM_RELEVES = ('Température', 'Selles', 'Alimentation', 'Hydratation')
+    def __init__(self, bd: SysPadDb_encry, crm_url=None, crm_key=None, snapshot_dir=None,
+                 http: HttpClient = None):
         self.__bd = bd
         self.__thread_name = f"SCORE-PREDICTOR"
-        Thread.__init__(self, name=self.__thread_name, target=self.run)
-        self.stop = False
         self.__url = crm_url
         self.__key = crm_key
         self.__type = 'syspad' # this can be différent, for testing this is "teranga"
         self.__items = {} #list of items
         self.__iniID()
         self.__myResidents = dict() # ceci est un objet dictionnaire contenant la correspondante UriResident vs NumChm
+        self.__releveUris = dict() # cache libellé de l'observable vs UriReleve
+        self.__http = http or get_client() # client HTTP partagé (keep-alive, réessais)
         self.__patientScore = {} # this dict contains scores of followed patients
-        self.__scoreComputed = False # ceci permet de calculer le Score une fois par jour
-        self.__imputationDone = False # ceci permet d'imputer de valeurs en cas de non reception du formulaire
-
-    def run(self):
-        logging.info(self.__thread_name + " --> Started")
-        while not self.stop:
-            currTime = arrow.now().time()
+        self.__scoreDates = {} # date of the last day given to the score of each room
+        # répertoire des sauvegardes des scores (None: pas de sauvegarde)
+        self.__snapshotDir = snapshot_dir
+        self.__loadSnapshots()
+        self.__scoreDate = None # jour du dernier calcul des Scores (un calcul par jour)
+        # jour de la dernière imputation des valeurs en cas de non reception du formulaire
+        self.__imputationDate = None
+        self.__lock = Lock() # imputation et calcul des Scores ne se chevauchent pas
+
+    @property
+    def imputation_date(self) -> date:
+        """ Jour de la dernière imputation (None si pas encore faite) """
+        return self.__imputationDate
+
+    @property
+    def score_date(self) -> date:
+        """ Jour du dernier calcul des Scores (None si pas encore fait) """
+        return self.__scoreDate
+
+    def impute(self):
+        """ Imputation des formulaires des 7 derniers jours de toutes les chambres suivies
+            (capteurs + NetSOINS)
+        """
+        with self.__lock:
+            self.__impute(currDate=arrow.now().date())
+
+    def __impute(self, currDate: datetime.date):
+        list_of_expected_dates = []
+        for day in range(0,7):
+            list_of_expected_dates.append(currDate - datetime.timedelta(days=day))
+        # recupérer toutes les chambres qui sont suivies pour la prédiction
+        rooms = self.__bd.get_roomsId_4_prediction()
+        # relevés NetSOINS de la semaine de toutes les chambres, récupérés en parallèle
+        crmRels = self.__fetchCrmReleves(rooms=rooms, date_deb=list_of_expected_dates[-1],
+                                         date_fin=currDate)
+        for room in rooms:
+            days_to_set = list_of_expected_dates.copy()
+            num_ch = room['NumCh']
+            roomData = self.__bd.get_roomValues_4_prediction(room=num_ch)
+            for data in roomData:
+                if data["Date"] in list_of_expected_dates: # le formulaire n'a pas été rempli
+                    days_to_set.remove(data["Date"])
+            for day in days_to_set:
+                # if the day is not set so empty list
+                my_vals = []
+                self.__bd.set_filledForm(room=num_ch, values=my_vals, for_date=day)
+
+            # now combined imputation with sensors and CRM for all days if necessary!!
+            roomData = self.__bd.get_roomValues_4_prediction(room=num_ch)
+            for data in roomData:
+                my_vals = data["Current_values"]
+                my_day = data["Date"]
+                my_vals = self.__combine(num_ch=num_ch, day=my_day, main_vals=my_vals,
+                                         crm_rels=crmRels.get(num_ch))
+                self.__bd.set_filledForm(room=num_ch, values=my_vals, for_date=my_day)
+        self.__imputationDate = currDate
+
+    def compute_scores(self):
+        """ Calcul des Scores du jour,
+            précédé de l'imputation si elle n'a pas encore été faite ce jour
+        """
+        with self.__lock:
             currDate = arrow.now().date()
-            list_of_expected_dates = []
-            for day in range(0,7):
-                list_of_expected_dates.append(currDate - datetime.timedelta(days=day))
-            # recupérer toutes les chambres qui sont suivies pour la prédiction
-            rooms = self.__bd.get_roomsId_4_prediction()
-            # 23h to do this
-            if currTime > datetime.time(23, 0) and not self.__imputationDone:
-                for room in rooms:
-                    days_to_set = list_of_expected_dates.copy()
-                    num_ch = room['NumCh']
-                    roomData = self.__bd.get_roomValues_4_prediction(room=num_ch)
-                    for data in roomData:
-                        if data["Date"] in list_of_expected_dates: # le formulaire n'a pas été rempli
-                            days_to_set.remove(data["Date"])
-                    for day in days_to_set:
-                        # if the day is not set so empty list
-                        my_vals = []
-                        self.__bd.set_filledForm(room=num_ch, values=my_vals, for_date=day)
-
-                    # now combined imputation with sensors and CRM for all days if necessary!!
-                    roomData = self.__bd.get_roomValues_4_prediction(room=num_ch)
-                    for data in roomData:
-                        my_vals = data["Current_values"]
-                        my_day = data["Date"]
-                        my_vals = self.__combine(num_ch=num_ch, day=my_day, main_vals=my_vals)
-                        self.__bd.set_filledForm(room=num_ch, values=my_vals, for_date=my_day)
-                self.__imputationDone = True
-            # 23h30 to do this
-            if currTime > datetime.time(23, 30) and not self.__scoreComputed and self.__imputationDone:
-                tmpScore = {} #this will also erase rooms not used any more by an assigment
-                for room in rooms:
-                    # à list of "Id", "Date", "Current_values" for the last seven days
-                    num_ch = room['NumCh']
-                    week_data = self.__bd.get_roomValues_4_prediction(room=num_ch)
-                    # this is important in case of reboot or similar
-                    if num_ch not in self.__patientScore:
-                        # fetch last 7 days data ordered by ASC date
-                        myScore = Score()
-                        for data in week_data:
-                            currentVal = data["Current_values"]
-                            currentVal = self.__change2tuples(currentVal)
-                            myScore.update(currentVal)
-                        data = week_data[-1]
-                        tmpScore[num_ch] = myScore
-                    # if the room exists, only make the update with the last value
-                    else:
-                        tmpScore[num_ch] = self.__patientScore[num_ch]
-                        data = week_data[-1]
-                        currentVal = data["Current_values"]
-                        currentVal = self.__change2tuples(currentVal)
-                        tmpScore[num_ch].update(currentVal)
-
-                    today = tmpScore[num_ch].score4today
-                    tomorrow = tmpScore[num_ch].score4tomorrow
-                    trustIndex = tmpScore[num_ch].trustIndex
-                    fillingRate = tmpScore[num_ch].fillingRate
-
-                    #update database
-                    logging.debug(self.__thread_name + f"Score pour la chambre={num_ch} et le jour={currDate}")
-                    self.__bd.update_prediction(id=data["Id"], s4today=today, s4tomorrow=tomorrow, ti=trustIndex, fr=fillingRate)
-                self.__patientScore = tmpScore
-                self.__scoreComputed = True
-
-            if currTime < datetime.time(1, 0):
-                self.__imputationDone = False
-                self.__scoreComputed = False
-
-            time.sleep(self.REFRESH_TIME)
-
-    def __combine(self, num_ch:int, day:datetime.date, main_vals:[]):
+            if self.__imputationDate != currDate:
+                self.__impute(currDate=currDate)
+            self.__computeScores(rooms=self.__bd.get_roomsId_4_prediction(), currDate=currDate)
+            self.__scoreDate = currDate
+
+    def __computeScores(self, rooms: [], currDate: datetime.date):
+        """
+        Calcule les scores du jour de toutes les chambres suivies en une passe :
+        une requête pour les 7 derniers jours, un calcul groupé, une mise à jour groupée
+        """
+        tmpScore = {} #this will also erase rooms not used any more by an assigment
+        week_data = {}
+        # à list of "NumCh", "Id", "Date", "Current_values" for the last seven days
+        # ordered by ASC date
+        room_ids = [room['NumCh'] for room in rooms]
+        for data in self.__bd.get_roomsValues_4_prediction(rooms=room_ids) or []:
+            week_data.setdefault(data["NumCh"], []).append(data)
+        tmpDates = {}
+        to_update = []
+        last_values = []
+        for num_ch, days in week_data.items():
+            # if the room exists (in memory or restored from its snapshot),
+            # only the new days are given to the score
+            if num_ch in self.__patientScore:
+                tmpScore[num_ch] = self.__patientScore[num_ch]
+                days = [data for data in days if data["Date"] > self.__scoreDates[num_ch]]
+            # this is important in case of reboot or similar
+            else:
+                tmpScore[num_ch] = Score()
+            tmpDates[num_ch] = self.__scoreDates.get(num_ch)
+            if not days:
+                continue
+            # rebuild the history with the previous days,
+            # the last one is computed with the other rooms
+            for data in days[:-1]:
+                tmpScore[num_ch].update(self.__change2tuples(data["Current_values"]))
+            to_update.append(num_ch)
+            last_values.append(self.__change2tuples(days[-1]["Current_values"]))
+            tmpDates[num_ch] = days[-1]["Date"]
+
+        start = time.perf_counter()
+        Score.update_many([tmpScore[num_ch] for num_ch in to_update], last_values)
+        predictions = []
+        for num_ch in to_update:
+            score = tmpScore[num_ch]
+            logging.debug(self.__thread_name
+                          + f"Score pour la chambre={num_ch} et le jour={currDate}")
+            predictions.append({
+                "id": week_data[num_ch][-1]["Id"],
+                "s4today": score.score4today,
+                "s4tomorrow": score.score4tomorrow,
+                "ti": score.trustIndex,
+                "fr": score.fillingRate,
+            })
+        #update database
+        if predictions:
+            self.__bd.update_predictions(predictions=predictions)
+        logging.info(self.__thread_name
+                     + f" --> Scores de {len(predictions)} chambre(s) calculés en "
+                       f"{(time.perf_counter() - start) * 1000:.1f} ms")
+        self.__patientScore = tmpScore
+        self.__scoreDates = tmpDates
+        self.__saveSnapshots()
+
+    def __snapshotPath(self, num_ch: int) -> str:
+        return os.path.join(self.__snapshotDir, f"score_{num_ch}.json")
+
+    def __loadSnapshots(self):
+        """
+        Recharge les scores sauvegardés,
+        une chambre sans sauvegarde valide sera reconstruite sur 7 jours
+        """
+        if not self.__snapshotDir or not os.path.isdir(self.__snapshotDir):
+            return
+        for file in os.listdir(self.__snapshotDir):
+            if not (file.startswith("score_") and file.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(self.__snapshotDir, file)) as f:
+                    snapshot = json.load(f)
+                num_ch = snapshot["NumCh"]
+                self.__patientScore[num_ch] = Score.from_snapshot(snapshot["Score"])
+                self.__scoreDates[num_ch] = datetime.date.fromisoformat(snapshot["Date"])
+            except (EnvironmentError, ValueError, KeyError, TypeError) as e:
+                logging.warning(self.__thread_name + f" --> Sauvegarde {file} ignorée: {e}")
+        logging.info(self.__thread_name + f" --> {len(self.__patientScore)} score(s) rechargé(s)")
+
+    def __saveSnapshots(self):
+        """
+        Sauvegarde l'état des scores (un fichier par chambre, écriture atomique)
+        et supprime les sauvegardes des chambres qui ne sont plus suivies
+        """
+        if not self.__snapshotDir:
+            return
+        try:
+            os.makedirs(self.__snapshotDir, exist_ok=True)
+            for num_ch, score in self.__patientScore.items():
+                if self.__scoreDates.get(num_ch) is None:
+                    continue
+                snapshot = {"NumCh": num_ch, "Date": self.__scoreDates[num_ch].isoformat(),
+                            "Score": score.to_snapshot()}
+                tmp_path = self.__snapshotPath(num_ch) + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_path, self.__snapshotPath(num_ch))
+            followed = {os.path.basename(self.__snapshotPath(num_ch))
+                        for num_ch in self.__patientScore}
+            for file in os.listdir(self.__snapshotDir):
+                if file.startswith("score_") and file.endswith(".json") and file not in followed:
+                    os.remove(os.path.join(self.__snapshotDir, file))
+        except EnvironmentError as e:
+            logging.error(self.__thread_name + f" --> Impossible de sauvegarder les scores: {e}")
+
+    def __combine(self, num_ch:int, day:datetime.date, main_vals:[], crm_rels=None):
         combinedVals = main_vals
         sensorVals = self.__imputationFromSensors(num_ch, day)
         list_mainId = []
@@ -127,8 +234,8 @@ class ScorePredictor(Thread):
                 if val[0] == id:
                     combinedVals.append(val)
         if self.__url and self.__key:
-            self.__getResUri() #update correspondance between URI & num_ch
-            crmVals = self.__imputationFromCRM(num_ch, day) #here we can obtain somme medical data as temperature...
+            #here we can obtain somme medical data as temperature...
+            crmVals = self.__imputationFromCRM(num_ch, day, crm_rels)
         else:
             crmVals = self.__imputationFromBD(num_ch, day) #here we've only physiological data
         if crmVals:
@@ -268,17 +375,19 @@ class ScorePredictor(Thread):
                     logging.debug("L'item fatigue ne fait pas partie du questionnaire")
         return my_vals
 
-    def __imputationFromCRM(self, num_ch:int, day:date) ->[]:
+    def __imputationFromCRM(self, num_ch:int, day:date, crm_rels=None) ->[]:
+        """
+        :param crm_rels: relevés de la chambre récupérés par __fetchCrmReleves
+         {libellé: {jour: [valeurs]}}
+        """
         my_vals = []
-        if self.__url and self.__key:
+        if self.__url and self.__key and crm_rels is not None:
             logging.debug(self.__thread_name + f"--> La connexion avec le NetSOINS est possible pour la chambre={num_ch}")
-            uriPat = self.__myResidents[num_ch]
 
             # traitement de l'item fièvre/température
             try:
                 idx = self.__items["fièvre"]
-                uriRel = self.__bd.get_uri_for_Observable(libelle='Température')
-                rels = self.__getRel(releve_uri=uriRel, patient_uri=uriPat, date_deb=day)
+                rels = crm_rels.get('Température', {}).get(day, [])
                 if rels:
                     val_temp = 36.5
                     for rel in rels:
@@ -295,8 +404,7 @@ class ScorePredictor(Thread):
             try:
                 idxQ = self.__items["selles_quantité"]
                 idxT = self.__items["selles_texture"]
-                uriRel = self.__bd.get_uri_for_Observable(libelle='Selles')
-                rels = self.__getRel(releve_uri=uriRel, patient_uri=uriPat, date_deb=day) # ["M2", "N3", "0",...]
+                rels = crm_rels.get('Selles', {}).get(day, []) # ["M2", "N3", "0",...]
                 if rels:
                     val_qua = 0
                     val_tex = 0
@@ -322,8 +430,8 @@ class ScorePredictor(Thread):
             # traitement de l'item 'appétit'
             try:
                 idx = self.__items["appétit"]
-                uriRel = self.__bd.get_uri_for_Observable(libelle='Alimentation')
-                rels = self.__getRel(releve_uri=uriRel, patient_uri=uriPat, date_deb=day) # ["0.5", "0.3", "0.75", "0"...]
+                # ["0.5", "0.3", "0.75", "0"...]
+                rels = crm_rels.get('Alimentation', {}).get(day, [])
                 logging.debug(f"Alimentation {rels}")
                 if rels:
                     val = 0
@@ -340,8 +448,7 @@ class ScorePredictor(Thread):
             # traitement de l'item 'hydratation'
             try:
                 idx = self.__items["hydratation"]
-                uriRel = self.__bd.get_uri_for_Observable(libelle='Hydratation')
-                rels = self.__getRel(releve_uri=uriRel, patient_uri=uriPat, date_deb=day) # ["12", "20", "15", "0"...] cL
+                rels = crm_rels.get('Hydratation', {}).get(day, []) # ["12", "20", "15", "0"...] cL
 
                 if rels:
                     val = 0
@@ -359,33 +466,114 @@ class ScorePredictor(Thread):
                 logging.debug("L'item hydratation ne fait pas partie du questionnaire")
         return my_vals
 
-    def __getRel(self, releve_uri:str, patient_uri:str, date_deb:date) -> []:
-        valeur = []
+    def __fetchCrmReleves(self, rooms: [], date_deb: date, date_fin: date) -> dict:
+        """
+        Récupère en parallèle les relevés NetSOINS utilisés pour l'imputation
+        de toutes les chambres
+        (une requête par résident pour tous les relevés et toute la période)
+        :return: {num_ch: {libellé: {jour: [valeurs]}}}, vide si NetSOINS n'est pas configuré
+        """
+        crm = {}
+        if not (self.__url and self.__key):
+            return crm
+        start = time.perf_counter()
+        try:
+            self.__getResUri() #update correspondance between URI & num_ch, once per run
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logging.error(self.__thread_name
+                          + f" --> Liste des résidents NetSOINS indisponible: {e}")
+            return crm
+        uris = {libelle: self.__getReleveUri(libelle) for libelle in self.CRM_RELEVES}
+        uris = {libelle: uriRel for libelle, uriRel in uris.items() if uriRel}
+        tasks = {}
+        with ThreadPoolExecutor(max_workers=self.CRM_WORKERS,
+                                thread_name_prefix=self.__thread_name) as pool:
+            for room in rooms:
+                num_ch = room['NumCh']
+                uriPat = self.__myResidents.get(num_ch)
+                if not uriPat:
+                    logging.debug(self.__thread_name
+                                  + f" --> Pas de résident NetSOINS pour la chambre={num_ch}")
+                    continue
+                tasks[num_ch] = pool.submit(self.__getReleves, date_deb, date_fin, uriPat,
+                                            list(uris.values()))
+            for num_ch, future in tasks.items():
+                try:
+                    releves = future.result().get(self.__myResidents[num_ch], {})
+                except (requests.RequestException, ValueError) as e:
+                    logging.error(self.__thread_name
+                                  + f" --> Relevés indisponibles pour la chambre={num_ch}: {e}")
+                    continue
+                crm[num_ch] = {libelle: releves.get(uriRel, {})
+                               for libelle, uriRel in uris.items()}
+        logging.info(self.__thread_name + f" --> {len(tasks)} requête(s) NetSOINS en "
+                                          f"{(time.perf_counter() - start) * 1000:.0f} ms")
+        return crm
+
+    def __getReleveUri(self, libelle: str):
+        # les URI des relevés changent rarement, elles sont gardées en cache
+        if libelle not in self.__releveUris:
+            try:
+                self.__releveUris[libelle] = self.__bd.get_uri_for_Observable(libelle=libelle)
+            except (IndexError, TypeError):
+                logging.debug(self.__thread_name + f" --> Pas d'URI pour l'observable {libelle}")
+                return None
+        return self.__releveUris[libelle]
+
+    def __getReleves(self, date_deb: date, date_fin: date, patient_uri=None,
+                     releve_uris=None) -> {}:
+        """
+        Valeurs des relevés sur la période en une seule requête,
+        pour un résident ou pour tous les résidents, rangées par résident, relevé et jour.
+        Les champs demandés (UriResident, UriReleve, DatePrevue) sont ceux de la ressource
+        ResidentReleveValeur, les mêmes que ObsTransmitter envoie lors de ses POST
+        :param patient_uri: UriResident, None pour tous les résidents
+        :param releve_uris: liste des UriReleve à récupérer, None pour tous les relevés
+        :return: {UriResident: {UriReleve: {jour: [valeurs]}}}
+        """
+        valeurs = {}
         headers = {
             'accept': 'application/xml;charset=UTF-8',
         }
 
-        params = (
+        params = [
             ('type', self.__type),
             ('key', self.__key),
             ('output', 'json'),
-            ('fields', 'Uri,Resident,Libelle,Releve,Valeur,Commentaire'),
+            ('fields', 'Uri,UriResident,UriReleve,Valeur,DatePrevue'),
             ('date_debut_prevue', date_deb.isoformat() + ' 00:00:00'),
-            ('date_fin_prevue', date_deb.isoformat() + ' 23:59:59'),
-            ('UriResident', patient_uri),
-            ('UriReleve', releve_uri),
-        )
-
-        response = requests.get(self.__url+'/ResidentReleveValeur', headers=headers, params=params)
+            ('date_fin_prevue', date_fin.isoformat() + ' 23:59:59'),
+        ]
+        if patient_uri:
+            params.append(('UriResident', patient_uri))
+        if releve_uris:
+            # filtre sur les seuls relevés utiles,
+            # sinon tous les types de relevés de la période sont renvoyés
+            params.append(('UriReleve', ','.join(releve_uris)))
+
+        response = self.__http.get(self.__url+'/ResidentReleveValeur', headers=headers,
+                                   params=params, timeout=self.CRM_TIMEOUT)
         dict_str = response.content.decode("UTF-8")
+        ignores = 0
         try:
             my_data = json.loads(dict_str)['ResidentReleveValeur']
             #it can has several measurement of this type during the day
             for rel in my_data:
-                valeur.append(rel["Valeur"])
+                if not rel.get("DatePrevue") or not rel.get("UriReleve"):
+                    ignores += 1
+                    continue
+                uri_res = rel.get("UriResident") or patient_uri
+                day = arrow.get(rel["DatePrevue"]).date()
+                valeurs.setdefault(uri_res, {}).setdefault(rel["UriReleve"], {}) \
+                    .setdefault(day, []).append(rel["Valeur"])
         except KeyError:
-            logging.debug(self.__thread_name + f" --> Pas de données Netsoins pour {patient_uri}")
-        return valeur
+            logging.debug(self.__thread_name
+                          + f" --> Pas de données Netsoins pour {patient_uri or 'les résidents'}")
+        if ignores:
+            logging.warning(self.__thread_name
+                            + f" --> {ignores} relevé(s) NetSOINS ignoré(s) sans DatePrevue "
+                              f"ou UriReleve pour {patient_uri or 'les résidents'}")
+        return valeurs
 
     def __getResUri(self):
         """
@@ -406,7 +594,8 @@ class ScorePredictor(Thread):
             ('statut_archive', 'tous'),
             ('situation', 'present'),
         )
-        response = requests.get(self.__url + "/Resident", headers=headers, params=params)
+        response = self.__http.get(self.__url + "/Resident", headers=headers, params=params,
+                                   timeout=self.CRM_TIMEOUT)
         dict_str = response.content.decode("UTF-8")
         my_data = json.loads(dict_str)['Resident']
         for res in my_data:
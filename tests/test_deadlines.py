@@ -0,0 +1,125 @@
+# coding: utf8
+import json
+import threading
+import time
+
+import pytest
+
+from syspad_monitor.task.bedMonitor import DeadlineScheduler
+
+
+class _FastSave(DeadlineScheduler):
+    SAVE_DELAY = 0.05
+
+
+def wait_for(condition, timeout=3.0):
+    limit = time.monotonic() + timeout
+    while time.monotonic() < limit:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def expired():
+    return []
+
+
+@pytest.fixture
+def deadlines(expired, tmp_path):
+    scheduler = _FastSave(on_expire=expired.append, path=str(tmp_path / "deadlines.json"))
+    scheduler.start()
+    yield scheduler
+    scheduler.stop = True
+
+
+def test_expire(deadlines, expired):
+    deadlines.schedule(1, 0.05)
+    deadlines.schedule(2, 0.1)
+    assert 1 in deadlines and len(deadlines) == 2
+    assert wait_for(lambda: len(expired) == 2)
+    assert expired == [1, 2]
+    assert len(deadlines) == 0
+
+
+def test_cancel(deadlines, expired):
+    deadlines.schedule(1, 0.1)
+    assert deadlines.cancel(1)
+    assert not deadlines.cancel(1)
+    assert deadlines.deadline(1) is None
+    time.sleep(0.3)
+    assert expired == []
+
+
+def test_reschedule_keeps_one_deadline(deadlines, expired):
+    deadlines.schedule(1, 0.05)
+    deadlines.schedule(1, 0.3)
+    time.sleep(0.15)
+    assert expired == []
+    assert wait_for(lambda: expired == [1])
+    time.sleep(0.1)
+    assert expired == [1]
+
+
+def test_callback_error_does_not_stop_the_thread(tmp_path):
+    expired = []
+
+    def on_expire(key):
+        if key == "bad":
+            raise RuntimeError("échec")
+        expired.append(key)
+
+    scheduler = DeadlineScheduler(on_expire=on_expire)
+    scheduler.start()
+    try:
+        scheduler.schedule("bad", 0.01)
+        scheduler.schedule("good", 0.05)
+        assert wait_for(lambda: expired == ["good"])
+    finally:
+        scheduler.stop = True
+
+
+def test_save_and_reload(deadlines, tmp_path):
+    path = tmp_path / "deadlines.json"
+    deadlines.schedule(7, 60)
+    deadlines.schedule(8, 60)
+    deadlines.cancel(8)
+    assert wait_for(path.exists)
+    assert wait_for(lambda: len(json.loads(path.read_text())) == 1)
+    reloaded = DeadlineScheduler(on_expire=lambda key: None, path=str(path))
+    assert 7 in reloaded and 8 not in reloaded
+    assert reloaded.deadline(7) == pytest.approx(deadlines.deadline(7))
+
+
+def test_reload_drops_stale_deadlines(tmp_path):
+    path = tmp_path / "deadlines.json"
+    now = time.time()
+    path.write_text(json.dumps([[1, now - DeadlineScheduler.STALE_AFTER - 60], [2, now - 10],
+                                [3, now + 60]]))
+    expired = []
+    scheduler = DeadlineScheduler(on_expire=expired.append, path=str(path))
+    assert 1 not in scheduler and 2 in scheduler and 3 in scheduler
+    scheduler.start()
+    try:
+        # une échéance dépassée de peu pendant l'arrêt expire dès le démarrage
+        assert wait_for(lambda: expired == [2])
+    finally:
+        scheduler.stop = True
+
+
+def test_unreadable_file(tmp_path):
+    path = tmp_path / "deadlines.json"
+    path.write_text("{pas du json")
+    scheduler = DeadlineScheduler(on_expire=lambda key: None, path=str(path))
+    assert len(scheduler) == 0
+
+
+def test_concurrent_schedules(deadlines, expired):
+    threads = [threading.Thread(target=deadlines.schedule, args=(key, 0.05)) for key in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert wait_for(lambda: len(expired) == 50)
+    assert sorted(expired) == list(range(50))
@@ -0,0 +1,103 @@
+# coding: utf8
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from syspad_monitor import http_client
+from syspad_monitor.http_client import HttpClient, get_client, set_client
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ Répond selon le chemin : /ok 200, /unavailable 503, /slow après 0,5 s """
+
+    def do_GET(self):
+        self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+        if self.path == "/slow":
+            time.sleep(0.5)
+        status = 503 if self.path == "/unavailable" else 200
+        body = b"ok"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.hits = dict()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client():
+    previous = http_client._client
+    client = HttpClient(timeout=(1, 0.2), retries=2, backoff_factor=0)
+    set_client(client)
+    yield client
+    client.close()
+    set_client(previous)
+
+
+def test_set_client(client):
+    assert get_client() is client
+
+
+def test_get(server, client):
+    server, url = server
+    response = get_client().get(url + "/ok")
+    assert response.status_code == 200 and response.text == "ok"
+    stats = client.stats
+    assert len(stats) == 1
+    values = next(iter(stats.values()))
+    assert values["count"] == 1 and values["errors"] == 0
+    assert values["histogram"]["inf"] == 1
+
+
+def test_idempotent_request_retried_on_5xx(server, client):
+    server, url = server
+    response = client.get(url + "/unavailable")
+    assert response.status_code == 503
+    assert server.hits["/unavailable"] == 3
+
+
+def test_non_idempotent_request_not_retried_on_5xx(server, client):
+    server, url = server
+    response = client.post(url + "/unavailable", idempotent=False)
+    assert response.status_code == 503
+    assert server.hits["/unavailable"] == 1
+
+
+def test_non_idempotent_request_not_retried_on_read_timeout(server, client):
+    server, url = server
+    with pytest.raises(requests.RequestException):
+        client.get(url + "/slow", idempotent=False)
+    time.sleep(0.6)
+    assert server.hits["/slow"] == 1
+
+
+def test_idempotent_request_retried_on_read_timeout(server, client):
+    server, url = server
+    with pytest.raises(requests.RequestException):
+        client.get(url + "/slow")
+    time.sleep(0.6)
+    assert server.hits["/slow"] == 3
+
+
+def test_unreachable_host_counted_as_error(client):
+    with pytest.raises(requests.RequestException):
+        client.get("http://127.0.0.1:9/ok")
+    values = next(iter(client.stats.values()))
+    assert values["count"] == 1 and values["errors"] == 1
@@ -0,0 +1,166 @@
+# coding: utf8
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from syspad_monitor.task.scheduler import CronExpression, TaskScheduler
+
+
+def wait_for(condition, timeout=3.0):
+    limit = time.monotonic() + timeout
+    while time.monotonic() < limit:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = TaskScheduler(workers=2)
+    yield scheduler
+    scheduler.stop = True
+
+
+def test_cron_fields():
+    cron = CronExpression("*/15 8-10 * * *")
+    assert cron.next_after(datetime(2026, 1, 1, 7, 59)) == datetime(2026, 1, 1, 8, 0)
+    assert cron.next_after(datetime(2026, 1, 1, 8, 0)) == datetime(2026, 1, 1, 8, 15)
+    assert cron.next_after(datetime(2026, 1, 1, 10, 45)) == datetime(2026, 1, 2, 8, 0)
+
+
+def test_cron_step_from_single_value():
+    # a/n : de a jusqu'au maximum du champ
+    cron = CronExpression("5/20 * * * *")
+    assert cron.next_after(datetime(2026, 1, 1, 10, 0)) == datetime(2026, 1, 1, 10, 5)
+    assert cron.next_after(datetime(2026, 1, 1, 10, 5)) == datetime(2026, 1, 1, 10, 25)
+    assert cron.next_after(datetime(2026, 1, 1, 10, 45)) == datetime(2026, 1, 1, 11, 5)
+
+
+def test_cron_lists_ranges_and_month_rollover():
+    cron = CronExpression("0 12 1,15 2-3/1 *")
+    assert cron.next_after(datetime(2026, 1, 20)) == datetime(2026, 2, 1, 12, 0)
+    assert cron.next_after(datetime(2026, 2, 1, 12, 0)) == datetime(2026, 2, 15, 12, 0)
+    assert cron.next_after(datetime(2026, 3, 15, 12, 0)) == datetime(2027, 2, 1, 12, 0)
+
+
+def test_cron_weekday():
+    # 7 et 0 sont le dimanche ; le 4 janvier 2026 est un dimanche
+    assert CronExpression("0 0 * * 7").next_after(datetime(2026, 1, 1)) == datetime(2026, 1, 4)
+    assert CronExpression("0 0 * * 0").next_after(datetime(2026, 1, 1)) == datetime(2026, 1, 4)
+    # jour et jour de semaine restreints : l'un ou l'autre suffit
+    assert CronExpression("0 0 10 * 0").next_after(datetime(2026, 1, 1)) == datetime(2026, 1, 4)
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "0 24 * * *", "0 0 0 * *",
+                                        "5-1 * * * *"])
+def test_cron_invalid(expression):
+    with pytest.raises(ValueError):
+        CronExpression(expression)
+
+
+def test_cron_previous_today():
+    cron = CronExpression("0,30 12 * * *")
+    assert cron.previous_today(datetime(2026, 1, 1, 11, 59)) is None
+    assert cron.previous_today(datetime(2026, 1, 1, 12, 0, 30)) == datetime(2026, 1, 1, 12, 0)
+    assert cron.previous_today(datetime(2026, 1, 1, 12, 45)) == datetime(2026, 1, 1, 12, 30)
+    assert cron.previous_today(datetime(2026, 1, 1, 23, 59)) == datetime(2026, 1, 1, 12, 30)
+    # le 1er janvier 2026 est un jeudi
+    assert CronExpression("0 12 * * 1").previous_today(datetime(2026, 1, 1, 13, 0)) is None
+
+
+def test_interval_runs(scheduler):
+    runs = []
+    scheduler.add_interval("tick", lambda: runs.append(time.monotonic()), 0.05)
+    scheduler.start()
+    assert wait_for(lambda: len(runs) >= 4)
+    stats = scheduler.stats["tick"]
+    assert stats["runs"] >= 3 and stats["errors"] == 0
+
+
+def test_errors_are_counted(scheduler):
+    def fail():
+        raise RuntimeError("échec")
+    scheduler.add_interval("fail", fail, 0.05)
+    scheduler.start()
+    assert wait_for(lambda: scheduler.stats["fail"]["errors"] >= 2)
+    stats = scheduler.stats["fail"]
+    assert stats["runs"] == stats["errors"]
+
+
+def test_overrun_skips_run(scheduler):
+    running = []
+    concurrent = []
+    lock = threading.Lock()
+
+    def slow():
+        with lock:
+            running.append(1)
+            concurrent.append(len(running))
+        time.sleep(0.3)
+        with lock:
+            running.pop()
+
+    scheduler.add_interval("slow", slow, 0.05)
+    scheduler.start()
+    assert wait_for(lambda: scheduler.stats["slow"]["overruns"] >= 3)
+    assert max(concurrent) == 1
+    assert scheduler.stats["slow"]["running"] <= 1
+
+
+def test_dedicated_job_does_not_wait_for_the_pool():
+    scheduler = TaskScheduler(workers=1)
+    ticks = []
+    release = threading.Event()
+    scheduler.add_interval("long", release.wait, 100)
+    scheduler.add_interval("fast", lambda: ticks.append(1), 0.05, first_delay=0.05, dedicated=True)
+    scheduler.start()
+    try:
+        assert wait_for(lambda: len(ticks) >= 3)
+        assert scheduler.stats["long"]["running"] == 1
+    finally:
+        release.set()
+        scheduler.stop = True
+
+
+def test_remove(scheduler):
+    runs = []
+    scheduler.add_interval("tick", lambda: runs.append(1), 0.05)
+    scheduler.start()
+    assert wait_for(lambda: runs)
+    assert scheduler.remove("tick")
+    assert not scheduler.remove("tick")
+    count = len(runs)
+    time.sleep(0.2)
+    assert len(runs) <= count + 1
+    assert "tick" not in scheduler.stats
+
+
+def test_duplicate_job(scheduler):
+    scheduler.add_interval("tick", lambda: None, 10)
+    with pytest.raises(ValueError):
+        scheduler.add_interval("tick", lambda: None, 10)
+
+
+@pytest.mark.parametrize("last_run, expected", [
+    (lambda: None, True),
+    (lambda: date.today() - timedelta(days=1), True),
+    (lambda: date.today(), False),
+])
+def test_cron_catch_up(scheduler, last_run, expected):
+    # l'échéance de minuit est passée, la suivante est demain : seul le rattrapage peut l'exécuter
+    runs = []
+    scheduler.add_cron("midnight", lambda: runs.append(1), "0 0 * * *", last_run=last_run)
+    scheduler.start()
+    assert bool(wait_for(lambda: runs, timeout=0.5)) is expected
+    next_run = datetime.fromisoformat(scheduler.stats["midnight"]["next_run"])
+    assert next_run.date() == date.today() + timedelta(days=1)
+
+
+def test_cron_without_catch_up(scheduler):
+    runs = []
+    scheduler.add_cron("midnight", lambda: runs.append(1), "0 0 * * *")
+    scheduler.start()
+    assert not wait_for(lambda: runs, timeout=0.3)